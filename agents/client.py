@@ -0,0 +1,171 @@
+"""
+One Valkey client per process, shared by every agent.
+
+`connect()` builds the client on first use – standalone or cluster,
+depending on `VALKEY_URL` (see `agents/cluster.py`) – and hands the same
+instance to every later caller, so all tasks of a process draw from one
+connection pool.  Callers keep calling it after a `ConnectionError`: it
+pings with exponential backoff (plus jitter) until Valkey answers, and
+the pool replaces broken connections by itself.
+
+Pool settings:
+
+* `VALKEY_MAX_CONNECTIONS` – pool size (per node on a cluster).  A
+  blocking read holds its connection for the whole block, so keep it
+  above the number of concurrent tasks (fan‑out: topics × shards ×
+  (`FANOUT_INFLIGHT` + 1));
+* `VALKEY_POOL_TIMEOUT` – seconds a command waits for a connection of a
+  full standalone pool before it fails (`0`: fail at once).  A cluster
+  client's per‑node pools always fail at once;
+* `VALKEY_KEEPALIVE` – TCP keepalive on every socket;
+* `VALKEY_HEALTH_CHECK` – seconds a connection may sit idle before it is
+  PINGed on checkout, so dead sockets are found before a command is lost;
+* `VALKEY_PROTOCOL` – 3 (RESP3, default) or 2.  The hiredis parser is
+  used automatically when the `hiredis` package is installed; RESP3 needs
+  redis-py 5.2 or later (see `requirements.txt`), set 2 on older clients;
+* `VALKEY_RETRIES` – per‑command retries on connection errors, with
+  `VALKEY_BACKOFF_BASE` … `VALKEY_BACKOFF_CAP` seconds between attempts
+  (the same bounds pace `connect()`).  A retried XREADGROUP whose reply
+  was lost on the wire leaves its entries pending; `agents/recovery.py`
+  reclaims them like those of a dead consumer.
+
+RESP3 changes one reply shape the agents rely on: XREAD/XREADGROUP come
+back as `{stream: [entries]}`.  `stream_replies()` turns either form into
+the RESP2 `[(stream, entries)]` list.
+
+The pool is exported as `valkey_pool_connections{state=in_use|idle|max}`.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import random
+from typing import Dict, List, Tuple
+
+from prometheus_client import Counter, Gauge
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnError, TimeoutError
+
+from agents import cluster
+
+try:
+    from redis.utils import HIREDIS_AVAILABLE
+except ImportError:
+    HIREDIS_AVAILABLE = False
+
+MAX_CONNECTIONS = int(os.getenv("VALKEY_MAX_CONNECTIONS", "256"))
+KEEPALIVE = os.getenv("VALKEY_KEEPALIVE", "1") == "1"
+HEALTH_CHECK = float(os.getenv("VALKEY_HEALTH_CHECK", "30"))   # seconds
+POOL_TIMEOUT = float(os.getenv("VALKEY_POOL_TIMEOUT", "2"))    # seconds
+PROTOCOL = int(os.getenv("VALKEY_PROTOCOL", "3"))
+RETRIES = int(os.getenv("VALKEY_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("VALKEY_BACKOFF_BASE", "0.1"))  # seconds
+BACKOFF_CAP = float(os.getenv("VALKEY_BACKOFF_CAP", "10"))
+
+POOL = Gauge("valkey_pool_connections",
+             "Connections in this process's Valkey pool", ["state"])
+RECONNECTS = Counter("valkey_reconnect_attempts_total",
+                     "Failed attempts to reach Valkey before it answered")
+CLIENT_INFO = Gauge("valkey_client_info", "Client protocol and reply parser",
+                    ["protocol", "parser"])
+
+log = logging.getLogger("valkey")
+_client = None
+
+
+def pool_options() -> dict:
+    """Keyword arguments for the client (and its pool)."""
+    return {
+        "decode_responses": True,
+        "max_connections": MAX_CONNECTIONS,
+        "pool_timeout": POOL_TIMEOUT,
+        "socket_keepalive": KEEPALIVE,
+        "health_check_interval": HEALTH_CHECK,
+        "protocol": PROTOCOL,
+        "retry": Retry(ExponentialBackoff(cap=BACKOFF_CAP, base=BACKOFF_BASE),
+                       RETRIES),
+        "retry_on_error": [RedisConnError, TimeoutError],
+    }
+
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait before reconnect *attempt* (1, 2, …), "full jitter"."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+async def connect(url: str = cluster.VALKEY_URL, retries: int | None = None):
+    """The process's client, once Valkey answers PING.
+
+    Retries forever unless *retries* is given; the last error is raised
+    after that many failed attempts.
+    """
+    global _client
+    attempt = 0
+    while True:
+        try:
+            if _client is None:
+                _client = await cluster.connect(url, **pool_options())
+            await _client.ping()
+            return _client
+        except Exception as exc:
+            attempt += 1
+            RECONNECTS.inc()
+            if retries is not None and attempt >= retries:
+                raise
+            delay = backoff(attempt)
+            log.warning("[valkey] not ready (%r); retry in %.2fs", exc, delay)
+            await asyncio.sleep(delay)
+
+
+def _count(obj, *names) -> int | None:
+    """Length of the first of *obj*'s private collections *names* present."""
+    for name in names:
+        items = getattr(obj, name, None)
+        if items is not None:
+            return len(items)
+    return None
+
+
+def pool_usage(r=None) -> Dict[str, int]:
+    """In‑use, idle and maximum connections of *r*'s pool(s).
+
+    redis-py keeps these counts in private attributes.  When a release
+    renames them, in-use falls back to the created-connection count (or
+    0) minus the idle ones, so the scrape never fails.
+    """
+    r = r if r is not None else _client
+    in_use = idle = size = 0
+    if hasattr(r, "get_nodes"):                       # cluster: pool per node
+        pools = [(node, _count(node, "_free"), _count(node, "_connections"))
+                 for node in r.get_nodes()]
+    else:
+        pool = getattr(r, "connection_pool", None)
+        free = _count(pool, "_available_connections")
+        busy = _count(pool, "_in_use_connections")
+        pools = [(pool, free, None if busy is None else busy + (free or 0))]
+    for pool, free, total in pools:
+        free = free or 0
+        if total is None:
+            total = getattr(pool, "_created_connections", free)
+            if not isinstance(total, int):
+                total = free
+        idle += free
+        in_use += max(total - free, 0)
+        size += getattr(pool, "max_connections", 0) or 0
+    return {"in_use": in_use, "idle": idle, "max": size}
+
+
+def stream_replies(msgs) -> List[Tuple[str, list]]:
+    """XREAD/XREADGROUP reply as `[(stream, entries)]` for RESP2 and RESP3."""
+    if isinstance(msgs, dict):
+        return [(stream, entries[0] if entries and isinstance(entries[0], list)
+                 else entries) for stream, entries in msgs.items()]
+    return msgs or []
+
+
+for _state in ("in_use", "idle", "max"):
+    POOL.labels(state=_state).set_function(
+        lambda state=_state: pool_usage()[state])
+CLIENT_INFO.labels(protocol=str(PROTOCOL),
+                   parser="hiredis" if HIREDIS_AVAILABLE else "python").set(1)
@@ -3,17 +3,78 @@ Enrichment service (topic classification).
 
 * Adds GPU‑utilisation gauge so the dashboard can show how many replicas
   actually run on CUDA.
+* Adaptive micro‑batching: a batch is classified once `ENRICH_BATCH`
+  messages are buffered *or* the oldest has waited `ENRICH_MAX_WAIT_MS`;
+  the batch size then drifts toward `ENRICH_TARGET_LATENCY` seconds per
+  batch within [`ENRICH_BATCH_MIN`, `ENRICH_BATCH_MAX`].
+* Staged pipeline: read → classify → write run as separate tasks joined
+  by bounded queues (`ENRICH_QUEUE_DEPTH` batches).  Inference runs on
+  an executor (`ENRICH_EXECUTOR=thread|process|inline`, `ENRICH_WORKERS`)
+  so reads, routing and acks overlap with the model.
+* Classification cache: results are keyed by a SHA‑1 of the classifier
+  input and kept in an in‑process LRU (`ENRICH_CACHE_SIZE`,
+  `ENRICH_CACHE_TTL`), optionally shared through Valkey `clf:<sha1>`
+  keys (`ENRICH_CACHE_VALKEY=1`).  Hits skip the model but are routed
+  like any other document.
+* Classifier backends (`ENRICH_BACKEND`): `zeroshot` runs the NLI
+  pipeline (one forward pass per document × label); `embed` encodes the
+  label hypotheses once at startup and scores each document with a
+  single encoder pass plus a NumPy cosine similarity.  `int8` runs
+  the zero‑shot pipeline on a dynamically quantized copy of the model,
+  exported once to the HF cache volume and reused on later starts.
+* Token‑budget batching: with `ENRICH_TOKEN_BUDGET` set, each batch is
+  sorted by tokenized length and split into forward passes whose padded
+  size (documents × longest) stays within the budget, so one long
+  article no longer pads everything else.  Results keep message order.
+* Fast startup: torch/transformers load in the background after the
+  metrics port is up and `cg_enrich` is joined.  Reading waits for the
+  model plus one warm‑up batch: entries read earlier would sit unacked
+  through a cold load, and past `RECLAIM_MIN_IDLE_MS` other replicas
+  take them over and route them a second time.
+  `enrich_model_ready` and `enrich_first_ack_seconds` expose progress.
+* One round trip per batch: topic writes, XACK, an approximate
+  `XTRIM news_raw MAXLEN ~` and XLEN share a single pipeline; the exact
+  (O(n)) trim runs every `ENRICH_TRIM_INTERVAL` seconds in the
+  background.  `enrich_round_trips_per_batch` counts every Valkey call a
+  batch costs – shared‑cache MGET/SET and each routing attempt.
+* Pending‑entry recovery: entries left unacked by dead replicas are
+  taken over with XAUTOCLAIM and classified like new reads; idle
+  consumers are removed (see `agents/recovery.py`).  Ids read but not
+  yet routed are tracked in flight, so a slow model never makes a
+  replica re‑claim (and route twice) its own entries.
+* Multi‑label routing: with `ENRICH_MULTI_LABEL=1` the same single
+  inference call scores every topic independently and a document is
+  written to each `topic:*` stream scoring ≥ `ENRICH_THRESHOLD` (at most
+  `ENRICH_MAX_TOPICS`, always at least its best topic), all in the batch
+  pipeline.  Payloads carry the routed topics in `tags` and their scores
+  in `scores`; fan‑out dedups the copies by article id as usual.
+* Topic shards: with `TOPIC_SHARDS` > 1 documents go to
+  `topic:<t>:<crc32(id) % N>` instead of `topic:<t>` (see
+  `agents/sharding.py`).
+* Cluster mode: with a `redis+cluster://` URL the routing pipeline is
+  non‑transactional (its keys span slots) and shared‑cache lookups use
+  `mget_nonatomic` (see `agents/cluster.py`).
 * Keeps original functionality unchanged otherwise.
 """
 from __future__ import annotations
 import os, json, asyncio, time
-from typing import List, Dict
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Dict, Optional, Sequence
 
+import numpy as np
 import redis.asyncio as redis
 from redis.exceptions import ConnectionError as RedisConnError
 from prometheus_client import Counter, Histogram, Gauge, start_http_server
-from transformers import pipeline
-import torch
+
+from agents.client import connect as rconn, stream_replies
+from agents.cluster import CLUSTER
+from agents.recovery import Reclaimer
+from agents.sharding import shard_maxlen, topic_stream
+
+STARTED = time.monotonic()
 
 # Ensure HF cache directory is writable
 def _ensure_cache_dir() -> None:
@@ -30,48 +91,188 @@ _ensure_cache_dir()
 # ─────────────────────────────────────────
 #  Device selection
 # ─────────────────────────────────────────
-USE_CUDA_ENV = os.getenv("ENRICH_USE_CUDA", "auto").lower()
-if USE_CUDA_ENV == "1":
-    DEVICE = 0
-elif USE_CUDA_ENV == "0":
-    DEVICE = -1
-else:
-    DEVICE = 0 if torch.cuda.is_available() else -1
+def select_device() -> int:
+    """CUDA device index for the model, -1 for CPU (`ENRICH_USE_CUDA`)."""
+    use_cuda = os.getenv("ENRICH_USE_CUDA", "auto").lower()
+    if use_cuda == "1":
+        return 0
+    if use_cuda == "0":
+        return -1
+    import torch
+    return 0 if torch.cuda.is_available() else -1
 
 #  Publish a one‑shot gauge that stays at 1 when running on GPU
 GPU_GAUGE = Gauge(
     "enrich_gpu",
     "1 if this enrich replica is running on GPU; 0 otherwise",
 )
-GPU_GAUGE.set(1 if DEVICE >= 0 else 0)
+MODEL_READY = Gauge("enrich_model_ready",
+                    "1 once the classifier is loaded and warmed up")
+FIRST_ACK = Gauge("enrich_first_ack_seconds",
+                  "Seconds from process start to the first acked batch")
 
 # ─────────────────────────────────────────
-VALKEY = os.getenv("VALKEY_URL", "redis://valkey:6379")
 SOURCE = "news_raw"
 TOPICS = [
     "politics", "business", "technology", "sports", "health",
     "climate", "science", "education", "entertainment", "finance",
 ]
-BATCH = int(os.getenv("ENRICH_BATCH", "32"))
+BATCH = int(os.getenv("ENRICH_BATCH", "32"))           # initial batch size
+BATCH_MIN = int(os.getenv("ENRICH_BATCH_MIN", "1"))
+BATCH_MAX = int(os.getenv("ENRICH_BATCH_MAX", "256"))
+MAX_WAIT = int(os.getenv("ENRICH_MAX_WAIT_MS", "200")) / 1000
+TARGET_LATENCY = float(os.getenv("ENRICH_TARGET_LATENCY", "0.5"))  # 0 = fixed size
+IDLE_BLOCK_MS = 500
+EXECUTOR = os.getenv("ENRICH_EXECUTOR", "thread").lower()  # thread | process | inline
+WORKERS = int(os.getenv("ENRICH_WORKERS", "1"))
+QUEUE_DEPTH = int(os.getenv("ENRICH_QUEUE_DEPTH", "2"))    # batches between stages
 NEWS_RAW_MAXLEN = int(os.getenv("NEWS_RAW_MAXLEN", "5000"))
+TOPIC_MAXLEN = shard_maxlen(10_000)   # per stream, ~10k per topic
+TRIM_INTERVAL = float(os.getenv("ENRICH_TRIM_INTERVAL", "5"))  # exact trim, seconds
 TXT_CLF = 512  # characters fed to classifier
+BACKEND = os.getenv("ENRICH_BACKEND", "zeroshot").lower()  # zeroshot | embed | int8
+ZEROSHOT_MODEL = "typeform/distilbert-base-uncased-mnli"
+EMBED_MODEL = os.getenv("ENRICH_EMBED_MODEL",
+                        "sentence-transformers/all-MiniLM-L6-v2")
+HYPOTHESIS = "This example is about {}."  # zero-shot pipeline's default
+MULTI_LABEL = os.getenv("ENRICH_MULTI_LABEL", "0") == "1"
+THRESHOLD = float(os.getenv("ENRICH_THRESHOLD", "0.5"))   # multi-label cut-off
+MAX_TOPICS = int(os.getenv("ENRICH_MAX_TOPICS", "3"))     # streams per document
+TOKEN_BUDGET = int(os.getenv("ENRICH_TOKEN_BUDGET", "0"))  # padded tokens/pass, 0 = off
+CACHE_SIZE = int(os.getenv("ENRICH_CACHE_SIZE", "10000"))    # 0 = no cache
+CACHE_TTL = int(os.getenv("ENRICH_CACHE_TTL", "86400"))      # seconds
+CACHE_VALKEY = os.getenv("ENRICH_CACHE_VALKEY", "0") == "1"  # share via clf:<sha1>
 
 # ─────────────────────────────────────────
-async def rconn() -> redis.Redis:
-    while True:
-        try:
-            r = await redis.from_url(VALKEY, decode_responses=True)
-            await r.ping()
-            return r
-        except Exception:
-            await asyncio.sleep(1)
-
-classifier = pipeline(
-    "zero-shot-classification",
-    model="typeform/distilbert-base-uncased-mnli",
-    device=DEVICE,
-)
-print(f"[enrich] classifier device={DEVICE}")
+class EmbedClassifier:
+    """Zero‑shot by similarity, call‑compatible with the pipeline.
+
+    Every label is rendered into the pipeline's hypothesis sentence and
+    encoded once; a batch of documents then costs one encoder pass and a
+    matrix product against those vectors.  Single‑label scores are a
+    softmax over cosine similarities (sharpened by `temperature`);
+    multi‑label scores are each label's closeness to the best one,
+    ``exp((sim - best) / temperature)``, so the top label scores 1 and a
+    runner‑up `temperature`·ln 2 behind it scores 0.5.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray],
+                 labels: Sequence[str] = TOPICS, template: str = HYPOTHESIS,
+                 temperature: float = 0.05) -> None:
+        self.encode, self.template = encode, template
+        self.tokenizer = getattr(encode, "tokenizer", None)
+        self.temperature = temperature
+        self.label_vecs: Dict[tuple, np.ndarray] = {}
+        self._labels(labels)
+
+    @staticmethod
+    def _unit(vecs: np.ndarray) -> np.ndarray:
+        vecs = np.asarray(vecs, dtype=np.float32)
+        return vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-9)
+
+    def _labels(self, labels: Sequence[str]) -> np.ndarray:
+        key = tuple(labels)
+        if key not in self.label_vecs:
+            hyps = [self.template.format(l) for l in key]
+            self.label_vecs[key] = self._unit(self.encode(hyps))
+        return self.label_vecs[key]
+
+    def __call__(self, texts: List[str], labels: Sequence[str],
+                 multi_label: bool = False, **_kw) -> List[Dict]:
+        if not texts:
+            return []
+        sims = self._unit(self.encode(list(texts))) @ self._labels(labels).T
+        z = np.exp((sims - sims.max(axis=1, keepdims=True)) / self.temperature)
+        scores = z if multi_label else z / z.sum(axis=1, keepdims=True)
+        order = np.argsort(-scores, axis=1)
+        return [
+            {
+                "labels": [labels[j] for j in row],
+                "scores": [float(s) for s in sc[row]],
+            }
+            for row, sc in zip(order, scores)
+        ]
+
+
+def hf_encoder(name: str = EMBED_MODEL, device: Optional[int] = None,
+               max_length: int = 256) -> Callable[[List[str]], np.ndarray]:
+    """Mean‑pooled sentence embeddings from a HuggingFace encoder."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    if device is None:
+        device = select_device()
+    tok = AutoTokenizer.from_pretrained(name)
+    model = AutoModel.from_pretrained(name).eval()
+    dev = torch.device(f"cuda:{device}" if device >= 0 else "cpu")
+    model.to(dev)
+
+    def encode(texts: List[str]) -> np.ndarray:
+        enc = tok(texts, padding=True, truncation=True,
+                  max_length=max_length, return_tensors="pt").to(dev)
+        with torch.inference_mode():
+            hidden = model(**enc).last_hidden_state
+        mask = enc["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+        return pooled.float().cpu().numpy()
+
+    encode.tokenizer = tok
+    return encode
+
+
+def quantized_model(name: str = ZEROSHOT_MODEL, cache_dir: Optional[str] = None):
+    """*name* with every Linear layer dynamically quantized to int8.
+
+    The quantized module is pickled under the HF cache, keyed by model
+    and torch version, so only the first replica on a volume pays for
+    the conversion.  Writes go through a temp file + rename because
+    replicas share the volume.
+    """
+    import torch
+
+    hf_home = os.getenv("HF_HOME") or os.getenv("TRANSFORMERS_CACHE")
+    cache_dir = cache_dir or os.path.join(hf_home, "enrich")
+    slug = name.replace("/", "--")
+    path = os.path.join(cache_dir, f"{slug}-int8-torch{torch.__version__}.pt")
+    if os.path.exists(path):
+        return torch.load(path, weights_only=False)
+
+    from transformers import AutoModelForSequenceClassification
+    model = AutoModelForSequenceClassification.from_pretrained(name).eval()
+    qmodel = torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    torch.save(qmodel, tmp)
+    os.replace(tmp, path)
+    return qmodel
+
+
+def load_classifier(backend: str = BACKEND):
+    from transformers import pipeline
+
+    # dynamic quantization kernels are CPU-only
+    device = -1 if backend == "int8" else select_device()
+    GPU_GAUGE.set(1 if device >= 0 else 0)
+    print(f"[enrich] loading classifier backend={backend} device={device}")
+    if backend == "embed":
+        return EmbedClassifier(hf_encoder(device=device))
+    if backend == "int8":
+        from transformers import AutoTokenizer
+        return pipeline(
+            "zero-shot-classification",
+            model=quantized_model(),
+            tokenizer=AutoTokenizer.from_pretrained(ZEROSHOT_MODEL),
+            device=device,
+        )
+    return pipeline(
+        "zero-shot-classification",
+        model=ZEROSHOT_MODEL,
+        device=device,
+    )
+
+classifier = None   # loaded by warm_up(), never at import time
+first_ack: Optional[float] = None
 
 # ─────────────────────────────────────────
 IN_MSG  = Counter("enrich_in_total",  "Raw messages consumed")
@@ -79,79 +280,430 @@ OUT_MSG = Counter("enrich_out_total", "Messages routed to topic streams", ["topi
 LAT     = Histogram("enrich_classifier_latency_seconds", "Classification latency")
 BACKLOG = Gauge("news_raw_len", "Length of news_raw stream")
 TRIM_OPS = Gauge("news_raw_trim_ops_total", "Trimming operations on news_raw")
+BATCH_SIZE = Gauge("enrich_batch_size", "Current adaptive batch size")
+QUEUE_WAIT = Histogram("enrich_queue_wait_seconds",
+                       "Time a message waited in the batch buffer")
+ROUND_TRIPS = Histogram("enrich_round_trips_per_batch",
+                        "Valkey round trips spent on a batch (cache reads "
+                        "and writes, routing attempts)",
+                        buckets=(1, 2, 3, 4, 6, 8))
+CACHE_HITS = Counter("enrich_cache_hits_total",
+                     "Classifications served from cache", ["tier"])
+CACHE_MISSES = Counter("enrich_cache_misses_total",
+                       "Classifications that had to run the model")
+
+# ─────────────────────────────────────────
+
+class AdaptiveBatcher:
+    """Size‑or‑deadline flush policy steering batch size toward a latency target.
+
+    A batch is due once `size` messages are buffered or the oldest one has
+    waited `max_wait` seconds.  After each classification the observed
+    per‑document latency moves `size` halfway toward the size that would
+    take `target` seconds; it only grows on evidence from full batches.
+    """
+
+    def __init__(self, size: int = BATCH, lo: int = BATCH_MIN, hi: int = BATCH_MAX,
+                 max_wait: float = MAX_WAIT, target: float = TARGET_LATENCY) -> None:
+        self.lo, self.hi = lo, hi
+        self.size = max(lo, min(hi, size))
+        self.max_wait, self.target = max_wait, target
+        BATCH_SIZE.set(self.size)
+
+    def due(self, buffer: List, now: float) -> bool:
+        if len(buffer) >= self.size:
+            return True
+        return bool(buffer) and now - buffer[0][2] >= self.max_wait
+
+    def block_ms(self, buffer: List, now: float) -> int:
+        """How long the next read may block without missing the deadline."""
+        if not buffer:
+            return IDLE_BLOCK_MS
+        left = self.max_wait - (now - buffer[0][2])
+        return max(1, int(left * 1000))     # block=0 would mean "forever"
+
+    def observe(self, n: int, latency: float) -> None:
+        if not self.target or n == 0 or latency <= 0:
+            return
+        ideal = int(self.target * n / latency)
+        if ideal > self.size and n < self.size:
+            return      # a partial batch says nothing about going bigger
+        self.size = max(self.lo, min(self.hi, (self.size + ideal + 1) // 2))
+        BATCH_SIZE.set(self.size)
 
 # ─────────────────────────────────────────
 
+def clf_text(doc: Dict[str, str]) -> str:
+    return doc["title"] + " " + doc["body"][:TXT_CLF]
+
+def token_lengths(texts: List[str]) -> List[int]:
+    """Tokenized length per text; a word count if the model has no tokenizer."""
+    tok = getattr(classifier, "tokenizer", None)
+    if tok is None:
+        return [len(t.split()) + 2 for t in texts]
+    return [len(ids) for ids in tok(texts, truncation=True)["input_ids"]]
+
+def token_batches(lengths: List[int], budget: int) -> List[List[int]]:
+    """Group indices by ascending length so count × longest ≤ *budget*.
+
+    A text longer than the budget on its own still gets a group.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    groups: List[List[int]] = []
+    cur: List[int] = []
+    for i in order:
+        # sorted ascending, so the newcomer is the longest of the group
+        if cur and (len(cur) + 1) * lengths[i] > budget:
+            groups.append(cur)
+            cur = []
+        cur.append(i)
+    if cur:
+        groups.append(cur)
+    return groups
+
 def classify(batch: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    texts = [d["title"] + " " + d["body"][:TXT_CLF] for d in batch]
-    with LAT.time():
-        results = classifier(texts, TOPICS, multi_label=False)
+    if classifier is None:
+        warm_up()
+    texts = [clf_text(d) for d in batch]
+    if TOKEN_BUDGET > 0:
+        groups = token_batches(token_lengths(texts), TOKEN_BUDGET)
+    else:
+        groups = [list(range(len(texts)))]
+    results: List[Dict] = [{}] * len(texts)
+    for idx in groups:
+        out = classifier([texts[i] for i in idx], TOPICS,
+                         multi_label=MULTI_LABEL, batch_size=len(idx))
+        for i, res in zip(idx, out):
+            results[i] = res
     for doc, res in zip(batch, results):
         doc["topic"] = res["labels"][0]
+        doc["scores"] = dict(zip(res["labels"], res.get("scores", [])))
     return batch
 
-# ─────────────────────────────────────────
-async def main() -> None:
-    start_http_server(9110)
-    r = await rconn()
+def doc_topics(doc: Dict) -> List[str]:
+    """Topic streams a classified document is routed to, best first."""
+    if not MULTI_LABEL:
+        return [doc["topic"]]
+    ranked = sorted(doc.get("scores", {}).items(), key=lambda kv: -kv[1])
+    passed = [t for t, score in ranked if score >= THRESHOLD][:MAX_TOPICS]
+    return passed or [doc["topic"]]
 
-    grp, consumer = "cg_enrich", f"enrich-{os.getpid()}"
-    try:
-        await r.xgroup_create(SOURCE, grp, id="0", mkstream=True)
-    except redis.ResponseError:
-        pass  # group may already exist
+def warm_up() -> None:
+    """Load the model for this process and push one batch through it.
 
-    buffer: List = []
+    Runs off the event loop (executor thread, or as the initializer of
+    each worker process); the first call pays for lazy CUDA/kernel setup
+    so the first real batch doesn't.  A classifier that was set from
+    outside is left alone.
+    """
+    global classifier
+    if classifier is not None:
+        return
+    tic = time.perf_counter()
+    classifier = load_classifier()
+    classify([{"title": "Warm-up", "body": " ".join(TOPICS)}])
+    print(f"[enrich] classifier ready in {time.perf_counter() - tic:.1f}s")
+
+class ClassifyCache:
+    """LRU of classifier results keyed by a hash of the classifier input.
+
+    Entries hold ``{"topic", "scores"}`` and expire after `ttl` seconds.
+    With `shared` set, local misses fall back to Valkey ``clf:<sha1>``
+    keys (same TTL) so replicas reuse each other's results; Valkey errors
+    only turn into misses.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: int = CACHE_TTL,
+                 shared: bool = CACHE_VALKEY) -> None:
+        self.size, self.ttl, self.shared = size, ttl, shared
+        self.entries: OrderedDict = OrderedDict()   # key -> (expires, result)
+        self.trips = 0                              # Valkey calls made so far
+
+    @staticmethod
+    def key(text: str) -> str:
+        # scores differ per backend and between single/multi-label mode
+        salted = f"{BACKEND}:{int(MULTI_LABEL)}:{text}"
+        return "clf:" + hashlib.sha1(salted.encode()).hexdigest()
+
+    def _get(self, key: str, now: float) -> Optional[Dict]:
+        hit = self.entries.get(key)
+        if hit is None:
+            return None
+        if hit[0] <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return hit[1]
+
+    def _put(self, key: str, result: Dict, now: float) -> None:
+        self.entries[key] = (now + self.ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def lookup(self, r, keys: List[str]) -> Dict[str, Dict]:
+        """Cached results for the distinct *keys* that have one."""
+        if self.size <= 0:
+            return {}
+        now = time.monotonic()
+        found: Dict[str, Dict] = {}
+        for k in dict.fromkeys(keys):
+            res = self._get(k, now)
+            if res is not None:
+                found[k] = res
+        CACHE_HITS.labels(tier="lru").inc(len(found))
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if self.shared and missing:
+            self.trips += 1
+            try:
+                if CLUSTER:
+                    values = await r.mget_nonatomic(missing)
+                else:
+                    values = await r.mget(missing)
+            except RedisConnError:
+                values = [None] * len(missing)
+            shared = 0
+            for k, v in zip(missing, values):
+                if v is not None:
+                    found[k] = json.loads(v)
+                    self._put(k, found[k], now)
+                    shared += 1
+            CACHE_HITS.labels(tier="valkey").inc(shared)
+        return found
+
+    async def store(self, r, results: Dict[str, Dict]) -> None:
+        if self.size <= 0 or not results:
+            return
+        now = time.monotonic()
+        for k, res in results.items():
+            self._put(k, res, now)
+        if self.shared:
+            pipe = r.pipeline(transaction=False)
+            for k, res in results.items():
+                pipe.set(k, json.dumps(res), ex=self.ttl)
+            self.trips += 1
+            try:
+                await pipe.execute()
+            except RedisConnError:
+                pass
+
+def make_executor() -> Optional[Executor]:
+    """Where `classify` runs; None means inline on the event loop."""
+    if EXECUTOR == "inline":
+        return None
+    if EXECUTOR == "process":
+        # one model per worker process; fork is unsafe once torch is loaded
+        ctx = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(WORKERS, mp_context=ctx, initializer=warm_up)
+    return ThreadPoolExecutor(WORKERS, thread_name_prefix="classify")
+
+# ─────────────────────────────────────────
+async def read_stage(r, grp: str, consumer: str, batcher: AdaptiveBatcher,
+                     out_q: asyncio.Queue,
+                     reclaimer: Optional[Reclaimer] = None,
+                     inflight: Optional[set] = None,
+                     ready: Optional[Awaitable] = None) -> None:
+    buffer: List = []   # (mid, fields, arrival time)
+    inflight = set() if inflight is None else inflight  # read, not yet routed
+    if ready is not None:
+        await ready     # nothing goes pending before it can be classified
 
     while True:
         try:
-            msgs = await r.xreadgroup(grp, consumer, {SOURCE: ">"}, count=BATCH, block=500)
-            if msgs:
-                buffer.extend(msgs[0][1])
+            claimed = await reclaimer.claim(r, inflight) if reclaimer else []
+            now = time.monotonic()
+            if claimed:
+                # a dead replica's backlog goes ahead of new reads
+                buffer.extend((mid, f, now) for mid, f in claimed)
+                inflight.update(mid for mid, _ in claimed)
+            else:
+                msgs = await r.xreadgroup(
+                    grp, consumer, {SOURCE: ">"},
+                    count=max(1, batcher.size - len(buffer)),
+                    block=batcher.block_ms(buffer, now),
+                )
+                now = time.monotonic()
+                if msgs:
+                    entries = stream_replies(msgs)[0][1]
+                    buffer.extend((mid, f, now) for mid, f in entries)
+                    inflight.update(mid for mid, _ in entries)
 
-            if len(buffer) < BATCH:
+            if not batcher.due(buffer, now):
                 continue
 
-            mids, raw_docs = zip(*buffer[:BATCH])
-            buffer = buffer[BATCH:]
-
+            taken, buffer = buffer[:batcher.size], buffer[batcher.size:]
+            for *_, arrived in taken:
+                QUEUE_WAIT.observe(now - arrived)
+            mids = [mid for mid, _, _ in taken]
             docs = [
                 {
                     "id": d["id"],
                     "title": d["title"],
                     "body": d.get("body", d.get("text", "")),
                 }
-                for d in raw_docs
+                for _, d, _ in taken
             ]
-            docs = classify(docs)
-
-            pipe = r.pipeline()
-            for d in docs:
-                stream = f"topic:{d['topic']}"
-                payload = json.dumps(
-                    {
-                        "id": d["id"],
-                        "title": d["title"],
-                        "summary": d.get("summary", ""),
-                        "body": d.get("body", ""),
-                        "tags": [d["topic"]],
-                        "topic": d["topic"],
-                    }
-                )
-                pipe.xadd(stream, {"data": payload})
-                pipe.xtrim(stream, maxlen=10_000)
-                OUT_MSG.labels(topic=d["topic"]).inc()
-            await pipe.execute()
+            # blocks while classification is QUEUE_DEPTH batches behind
+            await out_q.put((mids, docs))
+
+        except RedisConnError:
+            r = await rconn()
+
+
+async def classify_stage(r, pool: Optional[Executor], batcher: AdaptiveBatcher,
+                         cache: ClassifyCache,
+                         in_q: asyncio.Queue, out_q: asyncio.Queue,
+                         ready: Optional[Awaitable] = None) -> None:
+    loop = asyncio.get_running_loop()
+    if ready is not None:
+        await ready
+        MODEL_READY.set(1)
+    while True:
+        mids, docs = await in_q.get()
+        trips = cache.trips
+        keys = [cache.key(clf_text(d)) for d in docs]
+        known = await cache.lookup(r, keys)
+
+        # run the model once per distinct uncached text
+        todo = {k: d for k, d in zip(keys, docs) if k not in known}
+        if todo:
+            CACHE_MISSES.inc(len(todo))
+            batch = list(todo.values())
+            tic = time.perf_counter()
+            if pool is None:
+                batch = classify(batch)
+            else:
+                batch = await loop.run_in_executor(pool, classify, batch)
+            latency = time.perf_counter() - tic
+            LAT.observe(latency)
+            batcher.observe(len(batch), latency)
+            fresh = {k: {"topic": d["topic"], "scores": d["scores"]}
+                     for k, d in zip(todo, batch)}
+            await cache.store(r, fresh)
+            known.update(fresh)
+
+        for k, d in zip(keys, docs):
+            d.update(known[k])
+        await out_q.put((mids, docs, cache.trips - trips))
+        in_q.task_done()
+
 
-            #  Ack + trim source
-            await r.xack(SOURCE, grp, *mids)
+async def route(r, grp: str, mids: List[str], docs: List[Dict[str, str]]) -> None:
+    global first_ack
+    # MULTI needs every key in one slot; a cluster gets one pipeline per node
+    pipe = r.pipeline(transaction=not CLUSTER)
+    routed: Dict[str, int] = {}
+    for d in docs:
+        topics = doc_topics(d)
+        scores = d.get("scores", {})
+        payload = json.dumps(
+            {
+                "id": d["id"],
+                "title": d["title"],
+                "summary": d.get("summary", ""),
+                "body": d.get("body", ""),
+                "tags": topics,
+                "scores": {t: round(scores[t], 4) for t in topics if t in scores},
+                "topic": d["topic"],
+            }
+        )
+        for topic in topics:
+            pipe.xadd(topic_stream(topic, d["id"]), {"data": payload},
+                      maxlen=TOPIC_MAXLEN, approximate=True)
+            routed[topic] = routed.get(topic, 0) + 1
+
+    #  Ack + cheap trim of the source ride along; exact trim is periodic
+    pipe.xack(SOURCE, grp, *mids)
+    pipe.xtrim(SOURCE, maxlen=NEWS_RAW_MAXLEN, approximate=True)
+    pipe.xlen(SOURCE)
+    res = await pipe.execute()
+    if first_ack is None:
+        first_ack = time.monotonic() - STARTED
+        FIRST_ACK.set(first_ack)
+        print(f"[enrich] first ack {first_ack:.1f}s after start")
+    # counted once written: write_stage retries a batch whose execute failed
+    for topic, n in routed.items():
+        OUT_MSG.labels(topic=topic).inc(n)
+    TRIM_OPS.inc()
+    IN_MSG.inc(len(docs))
+    BACKLOG.set(res[-1])
+
+
+async def write_stage(r, grp: str, in_q: asyncio.Queue,
+                      inflight: Optional[set] = None) -> None:
+    while True:
+        mids, docs, trips = await in_q.get()    # cache calls so far
+        while True:
+            trips += 1
+            try:
+                await route(r, grp, mids, docs)
+                break
+            except RedisConnError:
+                r = await rconn()
+        ROUND_TRIPS.observe(trips)
+        if inflight is not None:
+            inflight.difference_update(mids)
+        in_q.task_done()
+
+
+async def trim_stage(r) -> None:
+    """Exact `MAXLEN` trim of the source, off the per‑batch path."""
+    while True:
+        await asyncio.sleep(TRIM_INTERVAL)
+        try:
             await r.xtrim(SOURCE, maxlen=NEWS_RAW_MAXLEN, approximate=False)
             TRIM_OPS.inc()
-            IN_MSG.inc(len(docs))
-            BACKLOG.set(await r.xlen(SOURCE))
-
         except RedisConnError:
             r = await rconn()
 
+# ─────────────────────────────────────────
+async def main() -> None:
+    start_http_server(9110)
+    r = await rconn()
+
+    grp, consumer = "cg_enrich", f"enrich-{os.getpid()}"
+    try:
+        await r.xgroup_create(SOURCE, grp, id="0", mkstream=True)
+    except redis.ResponseError:
+        pass  # group may already exist
+
+    batcher = AdaptiveBatcher()
+    pool = make_executor()
+    # the model loads while the group is joined; reads wait for it
+    ready = asyncio.get_running_loop().run_in_executor(pool, warm_up)
+    batches: asyncio.Queue = asyncio.Queue(QUEUE_DEPTH)
+    results: asyncio.Queue = asyncio.Queue(QUEUE_DEPTH)
+    reclaimer = Reclaimer(SOURCE, grp, consumer)
+    inflight: set = set()
+    reader = asyncio.create_task(
+        read_stage(r, grp, consumer, batcher, batches, reclaimer, inflight,
+                   ready))
+    stages = [
+        asyncio.create_task(classify_stage(r, pool, batcher, ClassifyCache(),
+                                           batches, results, ready)),
+        asyncio.create_task(write_stage(r, grp, results, inflight)),
+        asyncio.create_task(trim_stage(r)),
+    ]
+    try:
+        done, _ = await asyncio.wait([reader, *stages],
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if reader in done and not any(t.done() for t in stages):
+            # reader stopped: let batches already read finish routing
+            drain = asyncio.ensure_future(
+                asyncio.gather(batches.join(), results.join()))
+            await asyncio.wait([drain, *stages],
+                               return_when=asyncio.FIRST_COMPLETED)
+            drain.cancel()
+        # a stage that failed while draining explains more than the reader
+        for t in (*stages, reader):
+            if t.done():
+                t.result()
+    finally:
+        for t in (reader, *stages):
+            t.cancel()
+        await asyncio.gather(reader, *stages, return_exceptions=True)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,14 +1,8 @@
 import asyncio, json, os, random, time
-import redis.asyncio as redis
 from prometheus_client import Counter, Histogram, start_http_server
 
-VALKEY_URL = os.getenv("VALKEY_URL", "redis://valkey:6379")
-REDIS = None
-async def rconn():
-    global REDIS
-    if REDIS is None or REDIS.closed:
-        REDIS = await redis.from_url(VALKEY_URL, decode_responses=True)
-    return REDIS
+from agents.client import connect as rconn
+
 
 STREAM = "news_raw"
 ARTICLES = [{"title": f"Article {i}", "body": "Lorem ipsum"} for i in range(1000)]
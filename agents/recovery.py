@@ -0,0 +1,91 @@
+"""
+Pending‑entry recovery for consumer groups.
+
+Consumers are named per process (`enrich-<pid>`, `fanout-<pid>`), so a
+replica that dies leaves its delivered‑but‑unacked entries in the
+group's PEL and its name in the group forever.  A `Reclaimer` is driven
+from the consumer's own read loop:
+
+* every `RECLAIM_INTERVAL` seconds it sweeps the PEL with XAUTOCLAIM,
+  taking over entries idle for `RECLAIM_MIN_IDLE_MS` in batches of
+  `RECLAIM_COUNT`; the caller processes them like freshly read ones;
+* after a full sweep it deletes consumers that own nothing and have
+  been idle for `RECLAIM_DEAD_MS`, and exports the PEL size.
+
+Entries trimmed from the stream while pending come back without fields;
+they are acked so they stop counting as pending.  XAUTOCLAIM also hands
+a consumer its *own* idle entries, so a consumer that holds entries in
+memory for a while (enrich's batch queues) passes their ids as `busy`
+and gets only the others back.
+"""
+from __future__ import annotations
+import os
+import time
+from typing import Container, List, Tuple
+
+from prometheus_client import Counter, Gauge
+
+RECLAIM_INTERVAL = float(os.getenv("RECLAIM_INTERVAL", "30"))       # seconds
+RECLAIM_MIN_IDLE_MS = int(os.getenv("RECLAIM_MIN_IDLE_MS", "60000"))
+RECLAIM_COUNT = int(os.getenv("RECLAIM_COUNT", "100"))
+RECLAIM_DEAD_MS = int(os.getenv("RECLAIM_DEAD_MS", "600000"))
+
+PENDING = Gauge("stream_pending_entries",
+                "Entries delivered to a group but not yet acked",
+                ["stream", "group"])
+RECLAIMED = Counter("stream_reclaimed_total",
+                    "Pending entries taken over from stale consumers",
+                    ["stream", "group"])
+REAPED = Counter("stream_consumers_deleted_total",
+                 "Idle consumers without pending entries removed",
+                 ["stream", "group"])
+
+
+class Reclaimer:
+    """Periodic XAUTOCLAIM sweep for one stream / group / consumer."""
+
+    def __init__(self, stream: str, group: str, consumer: str,
+                 interval: float = RECLAIM_INTERVAL,
+                 min_idle_ms: int = RECLAIM_MIN_IDLE_MS,
+                 count: int = RECLAIM_COUNT,
+                 dead_ms: int = RECLAIM_DEAD_MS) -> None:
+        self.stream, self.group, self.consumer = stream, group, consumer
+        self.interval, self.min_idle_ms = interval, min_idle_ms
+        self.count, self.dead_ms = count, dead_ms
+        self.cursor = "0-0"
+        # nothing a fresh consumer could claim is older than its start
+        self.next_at = time.monotonic() + interval
+
+    async def claim(self, r, busy: Container[str] = ()) -> List[Tuple[str, dict]]:
+        """Stale entries now owned by this consumer; [] when no sweep is due.
+
+        A sweep spans several calls when the PEL holds more than `count`
+        stale entries, so the caller keeps its normal batch size.  Ids in
+        *busy* are still being processed here and are left out.
+        """
+        if time.monotonic() < self.next_at:
+            return []
+        res = await r.xautoclaim(self.stream, self.group, self.consumer,
+                                 self.min_idle_ms, start_id=self.cursor,
+                                 count=self.count)
+        self.cursor, entries = res[0], res[1]
+        live = [(mid, f) for mid, f in entries if f and mid not in busy]
+        gone = [mid for mid, f in entries if not f]
+        if gone:
+            await r.xack(self.stream, self.group, *gone)
+        if live:
+            RECLAIMED.labels(stream=self.stream, group=self.group).inc(len(live))
+
+        if self.cursor == "0-0":            # sweep complete
+            self.next_at = time.monotonic() + self.interval
+            await self.reap(r)
+            info = await r.xpending(self.stream, self.group)
+            PENDING.labels(stream=self.stream, group=self.group).set(info["pending"])
+        return live
+
+    async def reap(self, r) -> None:
+        for c in await r.xinfo_consumers(self.stream, self.group):
+            if (c["name"] != self.consumer and c["pending"] == 0
+                    and c["idle"] >= self.dead_ms):
+                await r.xgroup_delconsumer(self.stream, self.group, c["name"])
+                REAPED.labels(stream=self.stream, group=self.group).inc()
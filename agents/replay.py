@@ -2,19 +2,13 @@ import os, csv, asyncio, redis.asyncio as redis
 from redis.exceptions import ConnectionError as RedisConnError
 from prometheus_client import Counter, start_http_server
 
-VALKEY = os.getenv("VALKEY_URL", "redis://valkey:6379")
+from agents.client import connect as redis_ready
+
 CSV    = os.getenv("REPLAY_FILE", "data/news_sample.csv")
 RPS    = float(os.getenv("REPLAY_RATE", "250"))
 
 MSG = Counter("producer_msgs_total", "", ["topic"])
 
-async def redis_ready():
-    while True:
-        try:
-            r = await redis.from_url(VALKEY, decode_responses=True)
-            await r.ping(); return r
-        except Exception: await asyncio.sleep(1)
-
 async def main():
     start_http_server(9114)           # expose producer counter
     csv_path = os.getenv("REPLAY_FILE", CSV)
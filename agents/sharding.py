@@ -0,0 +1,35 @@
+"""
+Topic stream naming, optionally partitioned into shards.
+
+With `TOPIC_SHARDS=1` (default) each topic is the single stream
+`topic:<t>`.  With N > 1 it is split into `topic:<t>:0` … `topic:<t>:N-1`;
+an article always lands on shard `crc32(id) % N`, so one hot topic is
+spread over N keys that fan‑out replicas drain in parallel through the
+per‑stream consumer groups.  Every writer and reader must agree on N —
+the gateway reads the same variable.
+"""
+from __future__ import annotations
+import os
+import zlib
+from typing import List
+
+TOPIC_SHARDS = int(os.getenv("TOPIC_SHARDS", "1"))
+
+
+def topic_streams(topic: str, shards: int = TOPIC_SHARDS) -> List[str]:
+    """Every stream holding *topic*'s articles."""
+    if shards <= 1:
+        return [f"topic:{topic}"]
+    return [f"topic:{topic}:{n}" for n in range(shards)]
+
+
+def topic_stream(topic: str, doc_id, shards: int = TOPIC_SHARDS) -> str:
+    """The stream article *doc_id* is written to."""
+    if shards <= 1:
+        return f"topic:{topic}"
+    return f"topic:{topic}:{zlib.crc32(str(doc_id).encode()) % shards}"
+
+
+def shard_maxlen(maxlen: int, shards: int = TOPIC_SHARDS) -> int:
+    """Per‑shard MAXLEN keeping roughly *maxlen* entries per topic."""
+    return max(1, -(-maxlen // max(1, shards)))
@@ -21,7 +21,9 @@ import redis.asyncio as redis
 from redis.exceptions import ConnectionError as RedisConnError
 from prometheus_client import Counter, Histogram, Gauge, start_http_server
 
-VALKEY_URL = os.getenv("VALKEY_URL", "redis://valkey:6379")
+from agents.client import connect as rconn
+from agents.cluster import user_key
+
 
 # ─── Auto‑scaling knobs ──────────────────────────────────────────────
 POP_RATE = float(os.getenv("POP_RATE", 0.05))          # pops per user per sec
@@ -36,19 +38,6 @@ FEED_BACK = Gauge("feed_backlog",
 TARGET_RPS = Gauge("reader_target_rps",              "Dynamic target pops/s")
 AVG_BACK = Gauge("avg_feed_backlog",               "Mean backlog / user")
 
-# ─── Helpers ─────────────────────────────────────────────────────────
-
-
-async def rconn(retries=30, delay=1.0) -> redis.Redis:
-    for _ in range(retries):
-        try:
-            r = await redis.from_url(VALKEY_URL, decode_responses=True)
-            await r.ping()
-            return r
-        except Exception:
-            await asyncio.sleep(delay)
-    raise RuntimeError("Valkey unavailable")
-
 # ─── Main loop ───────────────────────────────────────────────────────
 
 
@@ -88,7 +77,7 @@ async def main(argv=None):
 
             # ── pick user & consume ──────────────────────────────────
             uid = random.randint(0, latest_uid) if latest_uid else 0
-            key = f"feed:{uid}"
+            key = user_key("feed", uid)
 
             with POP_LAT.time():
                 item = await r.brpop(key, timeout=1)
@@ -3,19 +3,9 @@ import redis.asyncio as redis
 from redis.exceptions import ConnectionError as RedisConnError
 from prometheus_client import Counter, start_http_server
 
-VALKEY_URL = os.getenv("VALKEY_URL", "redis://valkey:6379")
+from agents.client import connect as rconn
+from agents.cluster import CLUSTER, user_key
 
-async def rconn(retries=30, delay=1.0):
-    "Retry until Valkey answers PING."
-    for _ in range(retries):
-        try:
-            r = await redis.from_url(VALKEY_URL, decode_responses=True)
-            await r.ping()
-            return r
-        except Exception as e:
-            print("[common] Valkey not ready:", e)
-            await asyncio.sleep(delay)
-    raise RuntimeError("Valkey never became available")
 
 TOPICS = ["politics", "business", "technology", "sports", "health", "climate", "science", "education", "entertainment", "finance"]
 RATE = float(os.getenv("SEED_RATE","0.5"))
@@ -31,12 +21,14 @@ async def main():
     try:
         while True:
             try:
-                if await r.exists(f"user:{uid}"):
+                if await r.exists(user_key("user", uid)):
                     skipped += 1
                 else:
                     ints = random.sample(TOPICS, k=random.randint(2,4))
-                    pipe = r.pipeline(transaction=True)
-                    pipe.json().set(f"user:{uid}", "$", {"interests": ints})
+                    # the keys span slots on a cluster: no MULTI there; the
+                    # exists() check above keeps a retried user idempotent
+                    pipe = r.pipeline(transaction=not CLUSTER)
+                    pipe.json().set(user_key("user", uid), "$", {"interests": ints})
                     for t in ints:
                         pipe.zadd(f"user:topic:{t}", {uid: 0})
                     pipe.set("latest_uid", uid)
@@ -1,11 +1,8 @@
 from __future__ import annotations
 
-import os
 from datetime import datetime, timezone
-import redis.asyncio as redis
 
-def redis_client() -> redis.Redis:
-    return redis.Redis(host=os.getenv("VALKEY_HOST", "localhost"), decode_responses=True)
+# Valkey connections: agents/client.py
 
 
 def reltime(raw_id: str) -> str:
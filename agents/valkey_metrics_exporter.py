@@ -3,6 +3,7 @@
 #  • Adds network byte counters  (in/out)
 #  • Adds dataset memory gauge
 #  • Keeps fragmentation, RSS, latency hist, etc.
+#  • Cluster URLs (redis+cluster://) sum INFO over all primaries
 # ─────────────────────────────────────────────────────────────────────
 from __future__ import annotations
 import asyncio
@@ -16,7 +17,9 @@ from prometheus_client import (
 )
 from redis.exceptions import ConnectionError as RedisConnError
 
-VALKEY_URL = os.getenv("VALKEY_URL", "redis://valkey:6379")
+from agents.client import connect
+from agents.cluster import CLUSTER
+
 SCRAPE_PORT = int(os.getenv("SCRAPE_PORT", 9121))
 PING_SAMPLES = int(os.getenv("LAT_PINGS_PER_LOOP", 5))
 
@@ -48,17 +51,14 @@ LAT_HIST = Histogram(
 
 _last: Dict[str, int] = dict()
 
-# ─────────────────────────────────────────────────────────────────────
-
+# INFO fields read below; summed across primaries on a cluster
+INFO_FIELDS = (
+    "connected_clients", "used_memory", "used_memory_rss",
+    "used_memory_dataset", "total_commands_processed", "keyspace_hits",
+    "keyspace_misses", "total_net_input_bytes", "total_net_output_bytes",
+)
 
-async def connect() -> redis.Redis:
-    while True:
-        try:
-            r = await redis.from_url(VALKEY_URL, decode_responses=True)
-            await r.ping()
-            return r
-        except Exception:
-            await asyncio.sleep(1)
+# ─────────────────────────────────────────────────────────────────────
 
 
 def _inc(counter: Counter, key: str, new_val: int) -> None:
@@ -68,10 +68,19 @@ def _inc(counter: Counter, key: str, new_val: int) -> None:
     _last[key] = new_val
 
 
+async def read_info(r: redis.Redis) -> Dict[str, Any]:
+    if not CLUSTER:
+        return await r.info()
+    res = await r.info(target_nodes=r.PRIMARIES)
+    # one node answers with its INFO, several with {node: INFO}
+    per_node = [res] if "used_memory" in res else list(res.values())
+    return {k: sum(int(info[k]) for info in per_node) for k in INFO_FIELDS}
+
+
 async def scrape(r: redis.Redis) -> None:
     while True:
         try:
-            info: Dict[str, Any] = await r.info()
+            info: Dict[str, Any] = await read_info(r)
 
             # Gauges
             CLIENTS.set(int(info["connected_clients"]))
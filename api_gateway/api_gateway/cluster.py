@@ -0,0 +1,51 @@
+"""Standalone or cluster Valkey, picked by ``VALKEY_URL``.
+
+Mirrors ``agents/cluster.py`` (the gateway image ships without the
+agents): ``redis+cluster://`` / ``rediss+cluster://`` / ``valkey+cluster://``
+URLs get a ``RedisCluster`` client, and per-user keys are hash-tagged
+``<kind>:{uid}`` in that mode so they match what fan-out writes.
+"""
+from __future__ import annotations
+
+import binascii
+import os
+
+import redis.asyncio as redis
+
+CLUSTER_SCHEMES = {"redis+cluster": "redis", "rediss+cluster": "rediss",
+                   "valkey+cluster": "redis"}
+SLOTS = 16384
+
+
+def is_cluster(url: str) -> bool:
+    return url.partition("://")[0] in CLUSTER_SCHEMES
+
+
+CLUSTER = is_cluster(os.getenv("VALKEY_URL", ""))
+
+
+async def connect(url: str, **kwargs):
+    kwargs.setdefault("decode_responses", True)
+    scheme, _, rest = url.partition("://")
+    if scheme in CLUSTER_SCHEMES:
+        r = redis.RedisCluster.from_url(f"{CLUSTER_SCHEMES[scheme]}://{rest}",
+                                        **kwargs)
+        await r.initialize()
+        return r
+    return await redis.from_url(url, **kwargs)
+
+
+def user_key(kind: str, uid) -> str:
+    """``<kind>:<uid>``, hash-tagged on the uid in cluster mode."""
+    return f"{kind}:{{{uid}}}" if CLUSTER else f"{kind}:{uid}"
+
+
+def key_slot(key: str) -> int:
+    """Cluster hash slot of *key* (CRC16/XMODEM, honouring ``{tag}``)."""
+    raw = key.encode()
+    start = raw.find(b"{")
+    if start != -1:
+        end = raw.find(b"}", start + 1)
+        if end > start + 1:
+            raw = raw[start + 1:end]
+    return binascii.crc_hqx(raw, 0) % SLOTS
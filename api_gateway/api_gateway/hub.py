@@ -0,0 +1,379 @@
+"""One shared XREAD for every websocket of the gateway.
+
+Instead of each socket blocking its own Valkey connection on
+``XREAD … COUNT 1``, sockets register the streams they tail with the
+process-wide :class:`StreamHub`.  The hub keeps one cursor per watched
+stream and runs a reader task per *chunk* of up to ``GATEWAY_HUB_CHUNK``
+streams (per hash slot on a cluster), each issuing one blocking
+``XREAD`` over its whole chunk.  New entries are handed to the queue of
+every socket watching the stream, so a stream followed by thousands of
+browsers is read once.
+
+A socket joins with the ids its backlog ended at.  When the hub has
+already read past them, the gap is paged in with ``XRANGE … COUNT``
+(at most a queue's worth at a time), each page as the socket asks for
+its next batch, so a long gap neither floods the queue nor loses
+entries; when the hub is behind, entries the socket already has are
+filtered out.  Streams
+added to a running chunk are picked up when its current ``XREAD``
+returns – after at most ``GATEWAY_HUB_BLOCK_MS`` – without losing
+entries.  :meth:`StreamHub.as_stream` offers the same tail as an
+:class:`~.stream.IStream` (the server-sent event endpoints use it).
+
+Each socket's queue holds at most ``GATEWAY_SEND_QUEUE`` entries, so a
+slow browser cannot make the gateway buffer without bound.  What happens
+when it overflows is ``GATEWAY_SLOW_POLICY``:
+
+* ``drop_oldest`` – the oldest queued entries are discarded;
+* ``notice`` – the whole queue is discarded and the socket is told how
+  many new items it missed (it can reload them over HTTP);
+* ``disconnect`` – the next read raises :class:`SlowConsumer` and the
+  gateway closes the socket.
+
+| Variable               | Default       |                                 |
+|------------------------|---------------|---------------------------------|
+| `GATEWAY_HUB_CHUNK`    | `500`         | streams per XREAD               |
+| `GATEWAY_HUB_BLOCK_MS` | `100`         | XREAD block (new-stream pickup delay) |
+| `GATEWAY_HUB_COUNT`    | `100`         | entries per stream per XREAD    |
+| `GATEWAY_SEND_QUEUE`   | `1000`        | entries queued per socket       |
+| `GATEWAY_SLOW_POLICY`  | `drop_oldest` | `drop_oldest`, `notice` or `disconnect` |
+| `GATEWAY_BACKLOG_CACHE`| `200`         | newest entries kept per cached stream (0 = off) |
+
+Backlogs asked for through :meth:`StreamHub.backlog` (topic sockets and event streams)
+are served from a ring of the newest ``GATEWAY_BACKLOG_CACHE`` entries
+of the stream while the hub tails it: the ring is filled by one
+``XREVRANGE`` once a second socket watches the stream, extended by the
+hub's own reads and dropped when the last socket leaves.  Entries are
+kept as read – the article is the JSON text enrich stored – so a
+backlog from the ring is sent without touching Valkey or the JSON
+parser.  Anything the ring cannot cover is read from Valkey.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+
+from prometheus_client import Counter, Histogram
+
+from .cluster import key_slot
+
+HUB_CHUNK = int(os.getenv("GATEWAY_HUB_CHUNK", "500"))
+HUB_BLOCK_MS = int(os.getenv("GATEWAY_HUB_BLOCK_MS", "100"))
+HUB_COUNT = int(os.getenv("GATEWAY_HUB_COUNT", "100"))
+SEND_QUEUE = int(os.getenv("GATEWAY_SEND_QUEUE", "1000"))
+SLOW_POLICY = os.getenv("GATEWAY_SLOW_POLICY", "drop_oldest")
+SLOW_POLICIES = ("drop_oldest", "notice", "disconnect")
+BACKLOG_CACHE = int(os.getenv("GATEWAY_BACKLOG_CACHE", "200"))
+
+QUEUE_DEPTH = Histogram("gateway_send_queue_depth",
+                        "Entries queued for a socket when it takes a batch",
+                        buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000))
+DROPPED = Counter("gateway_dropped_entries_total",
+                  "Entries discarded for sockets that fell behind", ["policy"])
+BACKLOGS = Counter("gateway_backlog_cache_total",
+                   "Stream backlogs served from the hub's ring or Valkey",
+                   ["result"])
+
+
+def stream_order(entry_id: str):
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+async def newest_id(r, stream: str) -> str:
+    """Id of *stream*'s newest entry – ``0-0`` while it is empty."""
+    newest = await r.xrevrange(stream, "+", "-", count=1)
+    return newest[0][0] if newest else "0-0"
+
+
+class SlowConsumer(Exception):
+    """A socket's queue overflowed under the ``disconnect`` policy."""
+
+
+class Subscription:
+    """One socket's view of the hub: batches of new entries, oldest first.
+
+    With a *window* (seconds) each batch also takes in whatever arrives
+    that long after its first entry.  Under the ``notice`` policy a batch
+    may be empty; :meth:`take_missed` then says how many entries were
+    dropped.
+
+    Streams in :attr:`behind` are paged in by *catch_up* (``await
+    catch_up(sub, stream)``) whenever the queue runs empty; their live
+    entries are skipped until it removes them.
+    """
+
+    def __init__(self, last: dict[str, str], window: float = 0.0,
+                 limit: int = SEND_QUEUE, policy: str = SLOW_POLICY,
+                 catch_up=None) -> None:
+        if policy not in SLOW_POLICIES:
+            raise ValueError(f"unknown slow-consumer policy {policy!r}")
+        self.last = dict(last)
+        self.behind: set[str] = set()
+        self.catch_up = catch_up
+        self.window = window
+        self.limit = limit
+        self.policy = policy
+        self.items: deque = deque()
+        self.missed = 0
+        self.overflowed = False
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def put(self, stream: str, entries: list, live: bool = True) -> None:
+        if live and stream in self.behind:
+            return                        # its pages will cover them
+        floor = stream_order(self.last[stream])
+        fresh = [e for e in entries if stream_order(e[0]) > floor]
+        if not fresh:
+            return
+        self.last[stream] = fresh[-1][0]
+        self.items.extend(fresh)
+        excess = len(self.items) - self.limit
+        if excess > 0:
+            if self.policy == "drop_oldest":
+                for _ in range(excess):
+                    self.items.popleft()
+            else:
+                excess = len(self.items)
+                self.missed += excess
+                self.overflowed = self.policy == "disconnect"
+                self.items.clear()
+            DROPPED.labels(policy=self.policy).inc(excess)
+        self.ready.set()
+
+    def close(self) -> None:
+        """End the iteration (the socket went away)."""
+        self.closed = True
+        self.ready.set()
+
+    def take_missed(self) -> int:
+        """Entries dropped under the ``notice`` policy since the last call."""
+        missed, self.missed = self.missed, 0
+        return missed
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> list:
+        while not (self.items or self.missed or self.closed):
+            if self.behind:
+                await self.catch_up(self, next(iter(self.behind)))
+                continue
+            self.ready.clear()
+            await self.ready.wait()
+        if self.closed:
+            raise StopAsyncIteration
+        if self.overflowed:
+            raise SlowConsumer(f"{self.missed} entries behind")
+        if self.window and self.items:
+            await asyncio.sleep(self.window)
+        QUEUE_DEPTH.observe(len(self.items))
+        entries = sorted(self.items, key=lambda e: stream_order(e[0]))
+        self.items.clear()
+        return entries
+
+
+class _Ring:
+    """Newest entries of one watched stream, oldest first."""
+
+    def __init__(self, newest_first: list, size: int, complete: bool) -> None:
+        self.entries: deque = deque(reversed(newest_first), maxlen=size)
+        self.complete = complete and len(newest_first) <= size  # whole stream
+
+    def newest_id(self) -> str:
+        return self.entries[-1][0] if self.entries else "0-0"
+
+    def add(self, entries: list) -> None:
+        floor = stream_order(self.newest_id())
+        for entry in entries:
+            if stream_order(entry[0]) > floor:
+                if len(self.entries) == self.entries.maxlen:
+                    self.complete = False
+                self.entries.append(entry)
+
+    def newest(self, count: int):
+        """Newest *count* entries, newest first; None if they are not all here."""
+        if count > len(self.entries) and not self.complete:
+            return None
+        return list(itertools.islice(reversed(self.entries), count))
+
+
+class _Chunk:
+    def __init__(self, slot) -> None:
+        self.slot = slot
+        self.streams: dict[str, None] = {}        # insertion-ordered set
+
+
+class _HubStream:
+    """:class:`~.stream.IStream` over a hub, under a fixed slow-consumer policy."""
+
+    def __init__(self, hub: StreamHub, policy: str | None) -> None:
+        self.hub = hub
+        self.policy = policy
+
+    def subscribe(self, channel: str, last_id: str | None = None):
+        return self.hub.subscribe(channel, last_id, self.policy)
+
+
+class StreamHub:
+    """Multiplexes the live tails of all sockets onto a few XREADs.
+
+    Created inside the event loop whose tasks will read for it.
+    """
+
+    def __init__(self, r, cluster: bool = False, chunk: int = HUB_CHUNK,
+                 block_ms: int = HUB_BLOCK_MS, count: int = HUB_COUNT,
+                 limit: int = SEND_QUEUE, policy: str = SLOW_POLICY,
+                 cache: int = BACKLOG_CACHE) -> None:
+        self.r = r
+        self.cluster = cluster
+        self.chunk = chunk
+        self.block_ms = block_ms
+        self.count = count
+        self.limit = limit
+        self.policy = policy
+        self.cache = cache
+        self.cursor: dict[str, str] = {}          # newest id read per stream
+        self.subs: dict[str, set[Subscription]] = {}
+        self.chunk_of: dict[str, _Chunk] = {}
+        self.chunks: list[_Chunk] = []
+        self.rings: dict[str, _Ring] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    def stats(self) -> dict[str, int]:
+        return {"streams": len(self.cursor), "readers": len(self.chunks),
+                "subscriptions": len({s for subs in self.subs.values()
+                                      for s in subs}),
+                "rings": len(self.rings)}
+
+    async def close(self) -> None:
+        """Stop every reader (sockets still watching get no more entries)."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def backlog(self, stream: str, count: int) -> list:
+        """Newest *count* entries of *stream*, newest first (like XREVRANGE)."""
+        ring = self.rings.get(stream)
+        if ring is not None and (entries := ring.newest(count)) is not None:
+            BACKLOGS.labels(result="hit").inc()
+            return entries
+        BACKLOGS.labels(result="miss").inc()
+        size = max(count, self.cache)
+        entries = await self.r.xrevrange(stream, "+", "-", count=size)
+        # only a watched stream is kept current by the readers; the ring
+        # must not start behind the cursor or their reads leave a hole
+        if self.cache and stream in self.cursor and (
+                stream_order(entries[0][0] if entries else "0-0")
+                >= stream_order(self.cursor[stream])):
+            self.rings[stream] = _Ring(entries, self.cache, len(entries) < size)
+        return entries[:count]
+
+    def as_stream(self, policy: str | None = None) -> _HubStream:
+        """The hub as an :class:`~.stream.IStream` whose tails use *policy*."""
+        if policy is not None and policy not in SLOW_POLICIES:
+            raise ValueError(f"unknown slow-consumer policy {policy!r}")
+        return _HubStream(self, policy)
+
+    async def subscribe(self, channel: str, last_id: str | None = None,
+                        policy: str | None = None):
+        """:class:`~.stream.IStream` over the hub: batches of *channel*.
+
+        *policy* overrides the hub's slow-consumer policy for this tail.
+        """
+        if last_id is None:
+            last_id = await newest_id(self.r, channel)
+        async with self.watch({channel: last_id}, policy=policy) as sub:
+            async for entries in sub:
+                if entries:
+                    yield entries
+
+    @asynccontextmanager
+    async def watch(self, last: dict[str, str], window: float = 0.0,
+                    policy: str | None = None):
+        """Subscribe to the streams in *last* (stream → newest id sent)."""
+        sub = Subscription(last, window, self.limit, policy or self.policy,
+                           self._catch_up)
+        try:
+            for stream in last:
+                self._join(sub, stream)
+            yield sub
+        finally:
+            for stream in last:
+                self._leave(sub, stream)
+
+    def _join(self, sub: Subscription, stream: str) -> None:
+        if stream in self.cursor and (stream_order(self.cursor[stream])
+                                      > stream_order(sub.last[stream])):
+            sub.behind.add(stream)        # paged in by _catch_up
+        if stream not in self.cursor:
+            self.cursor[stream] = sub.last[stream]
+            self.subs[stream] = set()
+            self._assign(stream)
+        self.subs[stream].add(sub)
+
+    async def _catch_up(self, sub: Subscription, stream: str) -> None:
+        # one page of what the cursor is ahead of *sub*; once it is not,
+        # the stream goes live – checked without yielding, so no entry
+        # falls in between
+        cursor = self.cursor.get(stream)
+        if cursor is not None and (stream_order(cursor)
+                                   > stream_order(sub.last[stream])):
+            page = await self.r.xrange(stream, f"({sub.last[stream]}",
+                                       cursor, count=sub.limit)
+            if page:
+                sub.put(stream, page, live=False)
+            else:                         # trimmed: nothing up to the cursor
+                sub.last[stream] = cursor
+            return
+        sub.behind.discard(stream)
+
+    def _leave(self, sub: Subscription, stream: str) -> None:
+        subs = self.subs.get(stream)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self.subs[stream], self.cursor[stream]
+            self.rings.pop(stream, None)
+            del self.chunk_of.pop(stream).streams[stream]
+
+    def _assign(self, stream: str) -> None:
+        slot = key_slot(stream) if self.cluster else None
+        for chunk in self.chunks:
+            if chunk.slot == slot and len(chunk.streams) < self.chunk:
+                break
+        else:
+            chunk = _Chunk(slot)
+            self.chunks.append(chunk)
+            task = asyncio.create_task(self._read(chunk))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        chunk.streams[stream] = None
+        self.chunk_of[stream] = chunk
+
+    async def _read(self, chunk: _Chunk) -> None:
+        try:
+            while chunk.streams:
+                try:
+                    msgs = await self.r.xread(
+                        {s: self.cursor[s] for s in chunk.streams},
+                        block=self.block_ms, count=self.count)
+                except Exception as exc:
+                    print(f"[hub] xread failed: {exc!r}")
+                    await asyncio.sleep(1)
+                    continue
+                for stream, entries in msgs or ():
+                    if not entries or stream not in self.cursor:
+                        continue                  # unwatched meanwhile
+                    self.cursor[stream] = entries[-1][0]
+                    if ring := self.rings.get(stream):
+                        ring.add(entries)
+                    for sub in self.subs[stream]:
+                        sub.put(stream, entries)
+        finally:
+            self.chunks.remove(chunk)
@@ -1,20 +1,49 @@
-from fastapi import FastAPI, WebSocket, Depends
+from fastapi import FastAPI, WebSocket, Depends, Query, Request, Response
 from starlette.websockets import WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import StreamingResponse
+from contextlib import aclosing, asynccontextmanager
+import asyncio
+import heapq
+import itertools
 import os
 import json
-import redis.asyncio as redis
+import re
+
+from prometheus_client import (CONTENT_TYPE_LATEST, Counter, Histogram,
+                               generate_latest)
+
+from .cluster import CLUSTER, connect, user_key
+from .hub import SlowConsumer, StreamHub, newest_id, stream_order
+from .pages import MAX_AGE, etag, not_modified, respond
+from .stream import IStream
+
+PULL_TOPICS_KEY = "fanout:pull_topics"   # topics fan-out leaves to readers
+SEEN_LIMIT = 1000                        # doc ids remembered per socket
+# ?batch=1 sockets: live entries within this long of a frame's first
+# one share that frame
+BATCH_WINDOW = float(os.getenv("GATEWAY_BATCH_WINDOW_MS", "25")) / 1000
+TOPIC_SHARDS = int(os.getenv("TOPIC_SHARDS", "1"))  # must match the agents
+PAGE_MAX = int(os.getenv("GATEWAY_PAGE_MAX", "500"))  # ?limit= cap
+BACKLOG_MAX = int(os.getenv("GATEWAY_BACKLOG_MAX", "1000"))  # ?backlog= cap
+STREAM_ID = r"^\d+(-\d+)?$"
+STREAM_ID_RE = re.compile(STREAM_ID)
+
+SEND_SECONDS = Histogram("gateway_send_seconds",
+                         "Time to hand one live batch to a websocket")
+SLOW_CLOSED = Counter("gateway_slow_disconnects_total",
+                      "Websockets closed for falling too far behind")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global rdb
+    global rdb, hub
     if rdb is None:
-        rdb = await redis.from_url(
-            os.getenv("VALKEY_URL", "redis://localhost:6379"),
-            decode_responses=True,
-        )
+        rdb = await connect(os.getenv("VALKEY_URL", "redis://localhost:6379"))
+    # its readers are tasks of the loop serving the app
+    hub = StreamHub(rdb, cluster=CLUSTER)
     yield
+    await hub.close()
+    hub = None
 
 app = FastAPI(lifespan=lifespan)
 
@@ -35,6 +64,7 @@ app.add_middleware(
 
 
 rdb = None
+hub = None
 
 
 def get_rdb():
@@ -42,43 +72,244 @@ def get_rdb():
     return rdb
 
 
+def get_hub() -> StreamHub:
+    """The process-wide hub tailing streams for every socket."""
+    assert hub is not None, "StreamHub not started"
+    return hub
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/user/{uid}")
 async def user(uid: str, r=Depends(get_rdb)):
-    data = await r.json().get(f"user:{uid}")
+    data = await r.json().get(user_key("user", uid))
     if not data:
         return {"interests": []}
     return {"interests": data.get("interests", [])}
 
 
+def topic_streams(topic: str) -> list[str]:
+    """Streams holding *topic* – ``topic:<t>`` or its ``topic:<t>:<n>`` shards."""
+    if TOPIC_SHARDS <= 1:
+        return [f"topic:{topic}"]
+    return [f"topic:{topic}:{n}" for n in range(TOPIC_SHARDS)]
+
+
+async def pull_streams(r, uid: str) -> list[str]:
+    """Topic streams the user follows that fan-out does not push (pull mode)."""
+    pulled = await r.smembers(PULL_TOPICS_KEY)
+    if not pulled:
+        return []
+    user = await r.json().get(user_key("user", uid)) or {}
+    return [s for t in user.get("interests", []) if t in pulled
+            for s in topic_streams(t)]
+
+
+async def merged_backlog(r, streams: list[str], count: int, read=None):
+    """Newest *count* entries across *streams* (k-way merge by stream id).
+
+    Returns the entries oldest first plus the id each stream's live tail
+    resumes after: the newest one read, or – with no backlog asked for or
+    an empty read – the stream's newest id, so a tail never replays the
+    whole stream.  *read* (``read(stream, count)``, newest first) replaces
+    ``XREVRANGE`` – the hub's cached :meth:`~StreamHub.backlog` for topic
+    pages.
+    """
+    if read is None:
+        def read(stream, n):
+            return r.xrevrange(stream, "+", "-", count=n)
+    if count > 0:
+        per_stream = await asyncio.gather(*(read(s, count) for s in streams))
+    else:
+        per_stream = [[] for _ in streams]
+    heads = {s: e[0][0] for s, e in zip(streams, per_stream) if e}
+    empty = [s for s in streams if s not in heads]
+    heads.update(zip(empty, await asyncio.gather(
+        *(newest_id(r, s) for s in empty))))
+    last = {s: heads[s] for s in streams}
+    newest = heapq.merge(*per_stream, key=lambda e: stream_order(e[0]),
+                         reverse=True)
+    entries = list(itertools.islice(newest, count))
+    entries.reverse()
+    return entries, last
+
+
+async def page_entries(r, streams: list[str], count: int,
+                       before: str | None = None, top=None):
+    """Up to *count* entries across *streams*, newest first.
+
+    Reads below *before* (exclusive) or, without it, from each stream's
+    id in *top* down.  Entries of different streams can share an id, so
+    a page never ends between them: ``before=<last id>`` is then a safe
+    cursor for the next page.
+    """
+    bounds = {s: f"({before}" if before else top[s] for s in streams}
+    per_stream = await asyncio.gather(
+        *(r.xrevrange(s, bounds[s], "-", count=count)
+          for s in streams if bounds[s])
+    )
+    newest = heapq.merge(*per_stream, key=lambda e: stream_order(e[0]),
+                         reverse=True)
+    entries = list(itertools.islice(newest, count))
+    if entries and len(entries) == count:
+        entries.extend(itertools.takewhile(
+            lambda e: e[0] == entries[-1][0], newest))
+    return entries
+
+
+def remember(seen, doc) -> bool:
+    """Record *doc*'s id in *seen*; False when it was already there."""
+    if seen is None or not isinstance(doc, dict) or "id" not in doc:
+        return True
+    if doc["id"] in seen:
+        return False
+    seen[doc["id"]] = None
+    if len(seen) > SEEN_LIMIT:
+        seen.pop(next(iter(seen)))
+    return True
+
+
+def decode(payloads, seen=None):
+    """Yield decoded docs, skipping ids already in *seen* (when given)."""
+    for payload in payloads:
+        doc = json.loads(payload) if isinstance(payload, str) else payload
+        if remember(seen, doc):
+            yield doc
+
+
+def raw_json(payloads, seen=None):
+    """Yield payloads as JSON text, stored strings passed through verbatim.
+
+    A string is only parsed when *seen* needs its id.
+    """
+    for payload in payloads:
+        if isinstance(payload, str):
+            if seen is None or remember(seen, json.loads(payload)):
+                yield payload
+        elif remember(seen, payload):
+            yield json.dumps(payload)
+
+
+def frame(texts) -> str:
+    """A ``?batch=1`` frame: the JSON array of *texts*."""
+    return "[" + ",".join(texts) + "]"
+
+
+async def hydrate(r, entries):
+    """Return feed payloads, resolving reference entries in one MGET.
+
+    Fan-out in reference mode (``FANOUT_PAYLOAD=ref``) stores each article
+    once under ``doc:<id>`` and only writes ``{"ref": id}`` to the feed
+    stream.  References whose document has expired are skipped.
+    """
+    refs = [data["ref"] for _id, data in entries if "ref" in data]
+    docs = {}
+    if refs:
+        keys = [f"doc:{i}" for i in refs]
+        # doc keys spread over every slot; the cluster client splits them
+        values = await (r.mget_nonatomic(keys) if CLUSTER else r.mget(keys))
+        docs = dict(zip(refs, values))
+    out = []
+    for _id, data in entries:
+        if "ref" in data:
+            payload = docs.get(data["ref"])
+            if payload is None:
+                continue
+        else:
+            payload = data.get("data") or data
+        out.append(payload)
+    return out
+
+
+def topic_raw(data) -> str:
+    """*data*'s article as JSON text – enrich stores it serialized already."""
+    payload = data.get("data")
+    return json.dumps(data) if payload is None else payload
+
+
+async def send_feed(ws: WebSocket, payloads, seen, batch: bool) -> None:
+    if not batch:
+        for doc in decode(payloads, seen):
+            await ws.send_json(doc)
+    elif texts := list(raw_json(payloads, seen)):
+        await ws.send_text(frame(texts))
+
+
+async def send_topic(ws: WebSocket, entries, batch: bool) -> None:
+    # topic articles go out as stored, never parsed
+    if not batch:
+        for _id, data in entries:
+            await ws.send_text(topic_raw(data))
+    elif entries:
+        await ws.send_text(frame(topic_raw(data) for _id, data in entries))
+
+
+async def live(ws: WebSocket, hub: StreamHub, last, batch: bool, send) -> None:
+    """Tail *last* through *hub* with ``send(entries)`` until the client leaves.
+
+    Entries a slow socket lost under the ``notice`` policy are announced
+    as ``{"notice": "missed", "count": N}`` before the next batch; under
+    ``disconnect`` the socket is closed with 1013 (try again later).
+    """
+    async with hub.watch(last, BATCH_WINDOW if batch else 0) as batches:
+        async def closed():
+            while (await ws.receive())["type"] != "websocket.disconnect":
+                pass
+            batches.close()
+
+        watcher = asyncio.create_task(closed())
+        try:
+            async for entries in batches:
+                if missed := batches.take_missed():
+                    note = {"notice": "missed", "count": missed}
+                    if batch:
+                        await ws.send_text(frame([json.dumps(note)]))
+                    else:
+                        await ws.send_json(note)
+                if entries:
+                    with SEND_SECONDS.time():
+                        await send(entries)
+        except SlowConsumer:
+            SLOW_CLOSED.inc()
+            await ws.close(code=1013)
+        finally:
+            watcher.cancel()
+            # a receive() that failed (socket already closed) is retrieved
+            # here rather than logged as never retrieved
+            await asyncio.gather(watcher, return_exceptions=True)
+
+
 @app.websocket("/ws/feed/{uid}")
 async def feed_ws(
     ws: WebSocket,
     uid: str,
-    backlog: int = 100,
+    backlog: int = Query(100, ge=0, le=BACKLOG_MAX),
+    batch: bool = False,
     r=Depends(get_rdb),
+    hub: StreamHub = Depends(get_hub),
 ):
     await ws.accept()
     # We now stream from the *immutable* per-user stream produced by fan-out
     # instead of popping the feed list (which the reader service consumes).
-    stream = f"feed_stream:{uid}"
+    # Topics fan-out runs in pull mode are merged in here on read; the
+    # same article may then arrive twice, so those feeds dedupe by id.
+    # With ?batch=1 every frame is a JSON array of articles: the backlog
+    # in one frame, live entries coalesced over BATCH_WINDOW.
+    streams = [user_key("feed_stream", uid)] + await pull_streams(r, uid)
+    seen = {} if len(streams) > 1 else None
     try:
         # –– backlog (latest → oldest, capped by ?backlog=N) –––––––––
-        entries = await r.xrevrange(stream, "+", "-", count=backlog)
-        for _id, data in reversed(entries):
-            payload = data.get("data") or data
-            await ws.send_json(json.loads(payload) if isinstance(payload, str) else payload)
+        entries, last = await merged_backlog(r, streams, backlog)
+        await send_feed(ws, await hydrate(r, entries), seen, batch)
 
-        # –– live tail using XREAD –––––––––––––––––
-        last_id = "$"
-        while True:
-            msgs = await r.xread({stream: last_id}, block=0, count=1)
-            if not msgs:
-                continue
-            _, entries = msgs[0]
-            for _id, data in entries:
-                last_id = _id
-                payload = data.get("data") or data
-                await ws.send_json(json.loads(payload) if isinstance(payload, str) else payload)
+        # –– live tail via the shared XREAD hub –––––––––––––––––
+        async def send(entries):
+            await send_feed(ws, await hydrate(r, entries), seen, batch)
+
+        await live(ws, hub, last, batch, send)
     except WebSocketDisconnect:
         pass
 
@@ -87,37 +318,215 @@ async def feed_ws(
 async def topic_ws(
     ws: WebSocket,
     slug: str,
-    backlog: int = 50,
+    backlog: int = Query(50, ge=0, le=BACKLOG_MAX),
+    batch: bool = False,
     r=Depends(get_rdb),
+    hub: StreamHub = Depends(get_hub),
 ):
     await ws.accept()
-    key = f"topic:{slug}"
+    # A sharded topic is merged by stream id, exactly like a pull-mode feed.
+    # Popular pages are opened by many sockets at once, so the backlog
+    # comes from the hub's ring of the streams it already tails.
+    streams = topic_streams(slug)
     try:
-        entries = await r.xrevrange(key, "+", "-", count=backlog)
-        for _id, data in reversed(entries):
-            payload = data.get("data")
-            if payload is None:
-                await ws.send_json(data)
-            else:
-                try:
-                    await ws.send_json(json.loads(payload))
-                except Exception:
-                    await ws.send_json(payload)
-        last_id = "$"
-        while True:
-            msgs = await r.xread({key: last_id}, block=0, count=1)
-            if not msgs:
-                continue
-            _, entries = msgs[0]
-            for _id, data in entries:
-                last_id = _id
-                payload = data.get("data")
-                if payload is None:
-                    await ws.send_json(data)
-                else:
-                    try:
-                        await ws.send_json(json.loads(payload))
-                    except Exception:
-                        await ws.send_json(payload)
+        entries, last = await merged_backlog(r, streams, backlog, hub.backlog)
+        await send_topic(ws, entries, batch)
+        await live(ws, hub, last, batch,
+                   lambda entries: send_topic(ws, entries, batch))
     except WebSocketDisconnect:
         pass
+
+
+# ──────────────────────────  HTTP pages  ────────────────────────────
+# For the first paint and for clients that poll instead of holding a
+# socket: {"items": [...newest first], "next": <before= of the next
+# page or null>}.  The ETag of the first page is the newest id of each
+# stream, read by HEAD_ID so no article crosses the wire; an older page
+# is fixed by its cursor, so its 304 reads no stream at all (a feed page
+# still looks up the user's pull topics to know its streams).
+HEAD_ID = """
+local newest = redis.call('XREVRANGE', KEYS[1], '+', '-', 'COUNT', 1)
+if newest[1] then return newest[1][1] end
+return false
+"""
+
+
+async def page(request: Request, r, streams: list[str], limit: int,
+               before: str | None, cache: str, render) -> Response:
+    top = None
+    if before is None:
+        head = r.register_script(HEAD_ID)
+        heads = await asyncio.gather(*(head(keys=[s]) for s in streams))
+        top = dict(zip(streams, heads))
+        tag = etag(*streams, limit, *top.values())
+    else:
+        tag = etag(*streams, limit, before)
+    if not_modified(request, tag):
+        return respond(request, None, tag, cache)
+    entries = await page_entries(r, streams, limit, before, top)
+    cursor = entries[-1][0] if len(entries) >= limit else None
+    body = ('{"items":' + frame(await render(entries))
+            + ',"next":' + json.dumps(cursor) + "}")
+    return respond(request, body, tag, cache)
+
+
+@app.get("/feed/{uid}")
+async def feed_page(
+    uid: str,
+    request: Request,
+    limit: int = Query(50, ge=1, le=PAGE_MAX),
+    before: str | None = Query(None, pattern=STREAM_ID),
+    r=Depends(get_rdb),
+):
+    streams = [user_key("feed_stream", uid)] + await pull_streams(r, uid)
+    seen = {} if len(streams) > 1 else None
+
+    async def render(entries):
+        return list(raw_json(await hydrate(r, entries), seen))
+
+    return await page(request, r, streams, limit, before,
+                      "private, no-cache", render)
+
+
+@app.get("/topic/{slug}")
+async def topic_page(
+    slug: str,
+    request: Request,
+    limit: int = Query(50, ge=1, le=PAGE_MAX),
+    before: str | None = Query(None, pattern=STREAM_ID),
+    r=Depends(get_rdb),
+):
+    async def render(entries):
+        return [topic_raw(data) for _id, data in entries]
+
+    # shared caches may answer repeated polls of a public topic
+    return await page(request, r, topic_streams(slug), limit, before,
+                      f"public, max-age={MAX_AGE}", render)
+
+
+# ─────────────────────────  Server-sent events  ─────────────────────
+# Lighter than a websocket for a read-only feed, and resumable: the id
+# of every batch's last event is where the client stands in the stream –
+# the stream id itself, or one id per stream, comma-separated, for a
+# merged feed.  A browser reconnecting with Last-Event-ID gets just the
+# entries it missed instead of the backlog again.  That is why event
+# streams tail the hub under the ``disconnect`` policy (``SSE_POLICY``)
+# whatever GATEWAY_SLOW_POLICY says: dropping entries would move the
+# client's id past them for good, while a closed stream is resumed
+# without a gap.
+SSE_POLICY = "disconnect"
+
+
+
+def resume_ids(header: str | None, streams: list[str]):
+    """Per-stream ids from a Last-Event-ID; None to start with a backlog.
+
+    When the streams changed since (the user's pull topics), every
+    stream resumes from the oldest id given – at worst re-sending some.
+    """
+    ids = (header or "").split(",")
+    if not all(STREAM_ID_RE.match(i) for i in ids):
+        return None
+    if len(ids) != len(streams):
+        ids = [min(ids, key=stream_order)] * len(streams)
+    return dict(zip(streams, ids))
+
+
+def sse_chunk(texts, event_id: str) -> str:
+    """One ``data:`` event per text; the last one carries *event_id*."""
+    events = ["data: " + t.replace("\n", "\ndata: ") + "\n\n" for t in texts]
+    if events:
+        events[-1] = f"id: {event_id}\n" + events[-1]
+    else:
+        events = [f"id: {event_id}\n\n"]   # moves Last-Event-ID only
+    return "".join(events)
+
+
+async def follow(source: IStream, last: dict[str, str]):
+    """``(stream, entries)`` batches of every stream in *last* after its id."""
+    if len(last) == 1:
+        [(stream, since)] = last.items()
+        async with aclosing(source.subscribe(stream, since)) as batches:
+            async for entries in batches:
+                yield stream, entries
+        return
+    queue: asyncio.Queue = asyncio.Queue(1)
+
+    async def forward(stream, since):
+        try:
+            async with aclosing(source.subscribe(stream, since)) as batches:
+                async for entries in batches:
+                    await queue.put((stream, entries))
+        except Exception as exc:
+            await queue.put((None, exc))
+
+    tasks = [asyncio.create_task(forward(s, i)) for s, i in last.items()]
+    try:
+        while True:
+            stream, entries = await queue.get()
+            if stream is None:
+                raise entries
+            yield stream, entries
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def event_stream(request: Request, r, source: IStream, streams: list[str],
+                 backlog: int, render, read=None) -> StreamingResponse:
+    resume = resume_ids(request.headers.get("last-event-id"), streams)
+
+    async def events():
+        last = resume
+        if last is None:
+            entries, last = await merged_backlog(r, streams, backlog, read)
+            yield sse_chunk(await render(entries),
+                            ",".join(last[s] for s in streams))
+        try:
+            async with aclosing(follow(source, dict(last))) as batches:
+                async for stream, entries in batches:
+                    last[stream] = entries[-1][0]
+                    yield sse_chunk(await render(entries),
+                                    ",".join(last[s] for s in streams))
+        except SlowConsumer:
+            SLOW_CLOSED.inc()           # the client resumes on reconnect
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
+
+
+@app.get("/sse/feed/{uid}")
+async def feed_sse(
+    uid: str,
+    request: Request,
+    backlog: int = Query(100, ge=0, le=BACKLOG_MAX),
+    r=Depends(get_rdb),
+    hub: StreamHub = Depends(get_hub),
+):
+    # pull topics in a fixed order, so ids keep their place in the event id
+    streams = ([user_key("feed_stream", uid)]
+               + sorted(await pull_streams(r, uid)))
+    seen = {} if len(streams) > 1 else None
+
+    async def render(entries):
+        return list(raw_json(await hydrate(r, entries), seen))
+
+    return event_stream(request, r, hub.as_stream(SSE_POLICY), streams,
+                        backlog, render)
+
+
+@app.get("/sse/topic/{slug}")
+async def topic_sse(
+    slug: str,
+    request: Request,
+    backlog: int = Query(50, ge=0, le=BACKLOG_MAX),
+    r=Depends(get_rdb),
+    hub: StreamHub = Depends(get_hub),
+):
+    async def render(entries):
+        return [topic_raw(data) for _id, data in entries]
+
+    return event_stream(request, r, hub.as_stream(SSE_POLICY),
+                        topic_streams(slug), backlog, render, hub.backlog)
@@ -0,0 +1,92 @@
+"""HTTP caching and compression for the gateway's paged reads.
+
+``GET /feed/{uid}`` and ``GET /topic/{slug}`` answer with weak ETags
+derived from stream ids only, so a poller sending ``If-None-Match`` gets
+a 304 before any article is read or serialized.  Bodies of at least
+``GATEWAY_COMPRESS_MIN`` bytes are sent brotli-compressed when the
+client accepts ``br`` and the ``brotli`` package is installed, gzip
+otherwise.
+
+| Variable               | Default |                                      |
+|------------------------|---------|--------------------------------------|
+| `GATEWAY_COMPRESS_MIN` | `1024`  | smallest body worth compressing      |
+| `GATEWAY_HTTP_MAX_AGE` | `2`     | seconds a shared cache may reuse a topic page |
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN = int(os.getenv("GATEWAY_COMPRESS_MIN", "1024"))
+MAX_AGE = int(os.getenv("GATEWAY_HTTP_MAX_AGE", "2"))
+# fast levels: pages are compressed per request, not ahead of time
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+def etag(*parts) -> str:
+    """Weak ETag over *parts* (it holds for every content coding)."""
+    digest = hashlib.blake2b("\n".join(map(str, parts)).encode(),
+                             digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def not_modified(request: Request, tag: str) -> bool:
+    """Whether *request*'s ``If-None-Match`` matches *tag* (weak comparison)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = tag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == opaque
+               for t in header.split(","))
+
+
+def accepted(request: Request) -> set[str]:
+    """Content codings in *request*'s ``Accept-Encoding`` (``q=0`` excluded)."""
+    out = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if name.strip():
+            out.add(name.strip().lower())
+    return out
+
+
+def encode(request: Request, body: bytes) -> tuple[bytes, str | None]:
+    """*body* compressed for *request*, with its content coding (or None)."""
+    if len(body) < COMPRESS_MIN:
+        return body, None
+    codings = accepted(request)
+    if brotli is not None and "br" in codings:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if "gzip" in codings:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def respond(request: Request, body: str | None, tag: str,
+            cache: str) -> Response:
+    """A JSON page – or a bodyless 304 when *body* is None."""
+    headers = {"ETag": tag, "Cache-Control": cache, "Vary": "Accept-Encoding"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    data, coding = encode(request, body.encode())
+    if coding:
+        headers["Content-Encoding"] = coding
+    return Response(data, media_type="application/json", headers=headers)
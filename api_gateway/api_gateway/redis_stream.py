@@ -1,50 +1,47 @@
 from __future__ import annotations
 
-import json
 import os
 from typing import AsyncIterator, Any
 import redis.asyncio as redis
 
+from .cluster import connect
 from .stream import IStream
 
 class RedisStream(IStream):
-    def __init__(self, url: str | None = None) -> None:
+    """Tails a channel on a connection of its own (one XREAD per subscriber).
+
+    Inside the gateway use the shared :class:`~.hub.StreamHub` instead.
+    """
+    def __init__(self, url: str | None = None, count: int = 100) -> None:
         self.url = url or os.getenv("VALKEY_URL", "redis://localhost:6379")
+        self.count = count
         self._conn: redis.Redis | None = None
 
     async def _conn_ready(self) -> redis.Redis:
         if self._conn is None:
-            self._conn = await redis.from_url(self.url, decode_responses=True)
+            self._conn = await connect(self.url)
         return self._conn
 
-    async def subscribe(self, channel: str) -> AsyncIterator[Any]:
+    async def subscribe(self, channel: str,
+                        last_id: str | None = None) -> AsyncIterator[list[Any]]:
         r = await self._conn_ready()
-        if channel.startswith("topic:"):
-            last_id = "$"
+        if channel.startswith(("topic:", "feed_stream:")):
+            last_id = last_id or "$"
             while True:
-                msgs = await r.xread({channel: last_id}, block=0, count=1)
+                msgs = await r.xread({channel: last_id}, block=0,
+                                     count=self.count)
                 if not msgs:
                     continue
                 _, entries = msgs[0]
-                for entry_id, data in entries:
-                    last_id = entry_id
-                    payload = data.get("data")
-                    if payload is None:
-                        yield data
-                    else:
-                        try:
-                            yield json.loads(payload)
-                        except Exception:
-                            yield payload
+                last_id = entries[-1][0]
+                yield entries
         elif channel.startswith("feed:"):
+            # a popped list has no ids to resume from
             while True:
                 item = await r.brpop(channel, timeout=0)
                 if item is None:
                     continue
                 _, value = item
-                try:
-                    yield json.loads(value)
-                except Exception:
-                    yield value
+                yield [(None, {"data": value})]
         else:
             raise ValueError(f"unknown channel {channel}")
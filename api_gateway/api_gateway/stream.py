@@ -1,5 +1,11 @@
 from typing import AsyncIterator, Protocol, Any
 
 class IStream(Protocol):
-    async def subscribe(self, channel: str) -> AsyncIterator[Any]:
+    def subscribe(self, channel: str,
+                  last_id: str | None = None) -> AsyncIterator[list[Any]]:
+        """Batches of ``(id, fields)`` entries of *channel*, oldest first.
+
+        Starts after *last_id* – a client resuming where it left off – or
+        with the entries added from now on when it is None.
+        """
         ...
@@ -2,18 +2,35 @@ import asyncio
 import pytest
 from typing import Any, AsyncIterator
 
+
+def stream_order(entry_id: str):
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
 class DummyStream:
-    def __init__(self, items):
-        self.items = items
+    """IStream over fixed batches of ``(id, fields)`` entries per channel.
+
+    Only the Protocol's ``subscribe(channel, last_id)`` – no hub extras.
+    """
+    def __init__(self, batches):
+        self.batches = batches
+        self.calls = []
 
-    async def subscribe(self, channel: str) -> AsyncIterator[Any]:
-        for item in self.items:
+    async def subscribe(self, channel: str,
+                        last_id: str | None = None) -> AsyncIterator[list[Any]]:
+        self.calls.append((channel, last_id))
+        for batch in self.batches.get(channel, []):
             await asyncio.sleep(0)
-            yield item
+            fresh = [e for e in batch if last_id is None
+                     or stream_order(e[0]) > stream_order(last_id)]
+            if fresh:
+                yield fresh
 
 @pytest.fixture
 def dummy_stream():
-    return DummyStream([
-        {"text": "hello"},
-        {"text": "world"},
-    ])
+    return DummyStream({
+        "feed_stream:0": [[("1-0", {"data": '{"text": "hello"}'})],
+                          [("3-0", {"data": '{"text": "world"}'})]],
+        "topic:news": [[("2-0", {"data": '{"text": "news"}'})]],
+    })
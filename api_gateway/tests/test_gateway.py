@@ -1,5 +1,7 @@
 import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
 import asyncio
 
 import api_gateway.api_gateway.main as main
@@ -23,6 +25,8 @@ class DummyRedis:
             return []
         self.sent = True
         return [(list(a[0].keys())[0], [("2", {"data": "{\"text\": \"world\"}"})])]
+    async def smembers(self, key):
+        return set()
     async def lrange(self, *a):
         return ['{"text": "hello"}']
     async def brpop(self, *a, timeout=0):
@@ -42,17 +46,69 @@ def set_redis(monkeypatch):
 
 @pytest.mark.asyncio
 async def test_feed_endpoint():
-    client = TestClient(main.app)
-    with client.websocket_connect('/ws/feed/0') as ws:
-        assert ws.receive_json() == {'text': 'hello'}
-        assert ws.receive_json() == {'text': 'world'}
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/feed/0') as ws:
+            assert ws.receive_json() == {'text': 'hello'}
+            assert ws.receive_json() == {'text': 'world'}
 
 @pytest.mark.asyncio
 async def test_topic_endpoint():
-    client = TestClient(main.app)
-    with client.websocket_connect('/ws/topic/news') as ws:
-        assert ws.receive_json() == {'text': 'hello'}
-        assert ws.receive_json() == {'text': 'world'}
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/topic/news') as ws:
+            assert ws.receive_json() == {'text': 'hello'}
+            assert ws.receive_json() == {'text': 'world'}
+
+
+def test_sockets_share_the_hub_of_the_app():
+    with TestClient(main.app) as client:
+        hub = main.hub
+        with client.websocket_connect('/ws/feed/0') as ws:
+            ws.receive_json()
+        with client.websocket_connect('/ws/topic/news') as ws:
+            ws.receive_json()
+            assert main.hub is hub
+    assert main.hub is None and not hub.tasks
+
+
+@pytest.mark.parametrize("fails", [True, False])
+@pytest.mark.asyncio
+async def test_live_awaits_its_close_watcher(fails):
+    errors = []
+    asyncio.get_running_loop().set_exception_handler(
+        lambda loop, context: errors.append(context))
+    r = PageRedis(**{"topic:news": articles(1, 2, 3)})
+    hub = main.StreamHub(r, block_ms=1, limit=1, policy="disconnect")
+
+    class Socket:
+        code = None
+        async def receive(self):
+            if fails:
+                raise RuntimeError("socket closed")
+            await asyncio.Event().wait()
+        async def close(self, code=1000):
+            self.code = code
+
+    ws = Socket()
+    # awaited directly: a wrapping task would give the watcher a loop
+    # iteration to finish in after live() returned
+    await main.live(ws, hub, {"topic:news": "0-0"}, False, None)
+    # the watcher is finished (and its exception retrieved) on return
+    assert not [t for t in asyncio.all_tasks()
+                if t.get_coro().__qualname__.endswith("closed")]
+    assert ws.code == 1013 and errors == []
+    await hub.close()
+
+
+@pytest.mark.parametrize("backlog", ["-1", str(main.BACKLOG_MAX + 1)])
+def test_backlog_out_of_bounds_is_refused(backlog):
+    with TestClient(main.app) as client:
+        for path in ('/ws/feed/0', '/ws/topic/news'):
+            with pytest.raises(WebSocketDisconnect) as closed:
+                with client.websocket_connect(f'{path}?backlog={backlog}'):
+                    pass
+            assert closed.value.code == 1008
+        for path in ('/sse/feed/0', '/sse/topic/news'):
+            assert client.get(f'{path}?backlog={backlog}').status_code == 422
 
 
 def test_get_user():
@@ -69,8 +125,393 @@ def test_get_user_missing():
     assert resp.json() == {'interests': []}
 
 
+def test_metrics_endpoint():
+    client = TestClient(main.app)
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain')
+
+
 def test_websockets_installed():
     """Ensure the websockets library is available for uvicorn."""
     import importlib.util
 
     assert importlib.util.find_spec("websockets") is not None
+
+
+class RefRedis(DummyRedis):
+    """Feed stream written by fan-out in reference mode."""
+    async def xrevrange(self, *a, count=100):
+        return [("3", {"ref": "gone"}), ("1", {"ref": "a1"})]
+    async def xread(self, *a, block=0, count=1):
+        if self.sent:
+            await asyncio.sleep(0)
+            return []
+        self.sent = True
+        return [(list(a[0].keys())[0], [("4", {"ref": "a2"})])]
+    async def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+
+def test_feed_endpoint_hydrates_refs():
+    main.rdb = RefRedis({
+        "doc:a1": '{"text": "hello"}',
+        "doc:a2": '{"text": "world"}',
+    })
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/feed/0') as ws:
+            assert ws.receive_json() == {'text': 'hello'}
+            assert ws.receive_json() == {'text': 'world'}
+
+
+class PullRedis(DummyRedis):
+    """'news' is a pull-mode topic: merged into the feed on read."""
+    async def smembers(self, key):
+        return {"news"}
+    async def xrevrange(self, key, *a, count=100):
+        return {
+            "feed_stream:0": [("5-0", {"data": '{"id": "a"}'})],
+            "topic:news": [("6-0", {"data": '{"id": "b"}'}),
+                           ("4-0", {"data": '{"id": "a"}'})],
+        }[key]
+    async def xread(self, streams, block=0, count=1):
+        if self.sent:
+            await asyncio.sleep(0)
+            return []
+        self.sent = True
+        assert streams == {"feed_stream:0": "5-0", "topic:news": "6-0"}
+        return [("feed_stream:0", [("7-0", {"data": '{"text": "world"}'})])]
+
+
+def test_feed_endpoint_merges_pull_topics():
+    main.rdb = PullRedis({"user:0": {"interests": ["news", "sports"]}})
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/feed/0') as ws:
+            assert ws.receive_json() == {'id': 'a'}
+            assert ws.receive_json() == {'id': 'b'}   # duplicate 'a' skipped
+            assert ws.receive_json() == {'text': 'world'}
+
+
+class ShardRedis(DummyRedis):
+    """'news' split into two shards; entries interleave by stream id."""
+    async def xrevrange(self, key, *a, count=100):
+        return {
+            "topic:news:0": [("7-0", {"data": '{"id": "c"}'}),
+                             ("3-0", {"data": '{"id": "a"}'})],
+            "topic:news:1": [("5-0", {"data": '{"id": "b"}'})],
+        }[key][:count]
+    async def xread(self, streams, block=0, count=1):
+        if self.sent:
+            await asyncio.sleep(0)
+            return []
+        self.sent = True
+        assert streams == {"topic:news:0": "7-0", "topic:news:1": "5-0"}
+        return [("topic:news:1", [("9-0", {"data": '{"id": "e"}'})]),
+                ("topic:news:0", [("8-0", {"data": '{"id": "d"}'})])]
+
+
+def test_topic_endpoint_merges_shards(monkeypatch):
+    monkeypatch.setattr(main, "TOPIC_SHARDS", 2)
+    main.rdb = ShardRedis()
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/topic/news?backlog=2') as ws:
+            assert ws.receive_json() == {'id': 'b'}   # newest two, oldest first
+            assert ws.receive_json() == {'id': 'c'}
+            assert ws.receive_json() == {'id': 'd'}   # tail sorted by id
+            assert ws.receive_json() == {'id': 'e'}
+
+
+class ClusterShardRedis(ShardRedis):
+    """Cluster mode: every shard is tailed by its own single-stream XREAD."""
+    def __init__(self, *a):
+        super().__init__(*a)
+        self.tailed = set()
+    async def xread(self, streams, block=0, count=1):
+        assert len(streams) == 1
+        (stream, last_id), = streams.items()
+        if stream in self.tailed:
+            await asyncio.sleep(0)
+            return []
+        self.tailed.add(stream)
+        new = {"topic:news:0": ("7-0", "8-0", "d"),
+               "topic:news:1": ("5-0", "9-0", "e")}[stream]
+        assert last_id == new[0]
+        return [(stream, [(new[1], {"data": '{"id": "%s"}' % new[2]})])]
+
+
+def test_topic_endpoint_cluster_tails_each_shard(monkeypatch):
+    monkeypatch.setattr(main, "TOPIC_SHARDS", 2)
+    monkeypatch.setattr(main, "CLUSTER", True)
+    main.rdb = ClusterShardRedis()
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/topic/news?backlog=2') as ws:
+            assert [ws.receive_json() for _ in range(4)] == [
+                {'id': 'b'}, {'id': 'c'}, {'id': 'd'}, {'id': 'e'}]
+
+
+def test_feed_endpoint_batched_frames():
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/feed/0?batch=1') as ws:
+            # stored payloads are forwarded as-is, one array per frame
+            assert ws.receive_text() == '[{"text": "hello"}]'
+            assert ws.receive_text() == '[{"text": "world"}]'
+
+
+def test_topic_endpoint_batched_frames(monkeypatch):
+    monkeypatch.setattr(main, "TOPIC_SHARDS", 2)
+    main.rdb = ShardRedis()
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/topic/news?batch=1') as ws:
+            assert ws.receive_json() == [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+            assert ws.receive_json() == [{'id': 'd'}, {'id': 'e'}]
+
+
+def test_feed_batched_frames_dedupe_pull_topics():
+    main.rdb = PullRedis({"user:0": {"interests": ["news"]}})
+    with TestClient(main.app) as client:
+        with client.websocket_connect('/ws/feed/0?batch=1') as ws:
+            assert ws.receive_text() == '[{"id": "a"},{"id": "b"}]'
+            assert ws.receive_json() == [{'text': 'world'}]
+
+
+class PageRedis(DummyRedis):
+    """Streams answering XREVRANGE with (exclusive) bounds like Valkey."""
+    def __init__(self, data=None, **streams):
+        super().__init__(data)
+        self.streams = streams
+        self.ranges = []
+        self.heads = []
+    async def smembers(self, key):
+        return {"news"} if "topic:news" in self.streams else set()
+    def register_script(self, source):
+        assert source == main.HEAD_ID
+        async def head(keys):
+            self.heads.append(keys[0])
+            entries = self.streams.get(keys[0])
+            return entries[-1][0] if entries else None
+        return head
+    async def xrevrange(self, key, hi="+", lo="-", count=None):
+        self.ranges.append((key, hi, count))
+        order = main.stream_order
+        entries = self.streams.get(key, [])[::-1]
+        if hi.startswith("("):
+            entries = [e for e in entries if order(e[0]) < order(hi[1:])]
+        elif hi != "+":
+            entries = [e for e in entries if order(e[0]) <= order(hi)]
+        return entries[:count]
+    async def xrange(self, key, lo, hi, count=None):
+        order = main.stream_order
+        return [e for e in self.streams.get(key, [])
+                if order(lo[1:]) < order(e[0]) <= order(hi)][:count]
+    async def xread(self, streams, block=0, count=1):
+        order = main.stream_order
+        out = [(s, [e for e in self.streams.get(s, [])
+                    if order(e[0]) > order(last)][:count])
+               for s, last in streams.items()]
+        out = [(s, e) for s, e in out if e]
+        if not out:
+            await asyncio.sleep(block / 1000)
+        return out
+
+
+def articles(*ids, doc=0):
+    return [(f"{n}-0", {"data": f'{{"id": {n + doc}}}'}) for n in ids]
+
+
+@pytest.mark.asyncio
+async def test_backlog_zero_tails_from_the_newest_entry():
+    r = PageRedis(**{"topic:news": articles(1, 2, 3)})
+    entries, last = await main.merged_backlog(
+        r, ["topic:news", "topic:empty"], 0)
+    assert entries == []
+    assert last == {"topic:news": "3-0", "topic:empty": "0-0"}
+    hub = main.StreamHub(r, block_ms=1)
+    async with hub.watch(last) as sub:
+        r.streams["topic:news"] += articles(4)
+        assert [i for i, _ in await anext(sub)] == ["4-0"]
+    await hub.close()
+
+
+def test_topic_page_follows_cursors():
+    main.rdb = PageRedis(**{"topic:news": articles(1, 2, 3, 4, 5)})
+    client = TestClient(main.app)
+    pages, before = [], ""
+    while before is not None:
+        query = f"&before={before}" if before else ""
+        body = client.get(f'/topic/news?limit=2{query}').json()
+        pages.append([doc["id"] for doc in body["items"]])
+        before = body["next"]
+    assert pages == [[5, 4], [3, 2], [1]]
+    assert client.get('/topic/news?before=oops').status_code == 422
+
+
+def test_page_etag_answers_304_without_reading_articles():
+    r = main.rdb = PageRedis(**{"topic:news": articles(1, 2)})
+    client = TestClient(main.app)
+    first = client.get('/topic/news')
+    assert first.headers['cache-control'].startswith('public')
+    r.ranges.clear()
+    r.heads.clear()
+    again = client.get('/topic/news',
+                       headers={'If-None-Match': first.headers['etag']})
+    assert again.status_code == 304 and again.content == b''
+    assert r.heads == ["topic:news"] and r.ranges == []  # the newest id only
+    r.streams["topic:news"] += articles(3)
+    assert client.get('/topic/news', headers={
+        'If-None-Match': first.headers['etag']}).status_code == 200
+
+    old = client.get('/topic/news?before=3-0')
+    r.ranges.clear()
+    r.heads.clear()
+    assert client.get('/topic/news?before=3-0', headers={
+        'If-None-Match': old.headers['etag']}).status_code == 304
+    assert r.ranges == [] and r.heads == []
+
+
+def test_feed_page_keeps_equal_ids_together_and_compresses(monkeypatch):
+    main.rdb = PageRedis(
+        {"user:0": {"interests": ["news"]}},
+        **{"feed_stream:0": articles(1, 2),
+           "topic:news": articles(2, 3, doc=10)})
+    client = TestClient(main.app)
+    first = client.get('/feed/0?limit=2')
+    assert first.headers['cache-control'] == 'private, no-cache'
+    # 2-0 is in both streams: the page runs past the limit to keep them
+    ids = [d["id"] for d in first.json()["items"]]
+    assert ids[0] == 13 and sorted(ids[1:]) == [2, 12]
+    rest = client.get('/feed/0?limit=2&before=2-0').json()
+    assert rest == {"items": [{"id": 1}], "next": None}
+
+    monkeypatch.setattr("api_gateway.api_gateway.pages.COMPRESS_MIN", 1)
+    resp = client.get('/feed/0', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in resp.headers['vary']
+    assert len(resp.json()["items"]) == 4
+    plain = client.get('/feed/0', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'content-encoding' not in plain.headers
+
+
+def test_resume_ids_and_event_chunks():
+    streams = ["feed_stream:0", "topic:news"]
+    assert main.resume_ids(None, streams) is None
+    assert main.resume_ids("5-0,oops", streams) is None
+    assert main.resume_ids("5-0,7-1", streams) == {
+        "feed_stream:0": "5-0", "topic:news": "7-1"}
+    # pull topics changed: resume everything from the oldest position
+    assert main.resume_ids("9-0,5-0,7-0", streams) == {
+        "feed_stream:0": "5-0", "topic:news": "5-0"}
+    assert main.sse_chunk(['{"a": 1}', '{"b": 2}'], "7-0") == (
+        'data: {"a": 1}\n\nid: 7-0\ndata: {"b": 2}\n\n')
+    assert main.sse_chunk([], "7-0") == "id: 7-0\n\n"
+
+
+def per_stream(chunks, streams, ids):
+    """Events of a merged stream credited to the stream whose id moved.
+
+    The streams race each other, so only this – and the final ids – is
+    deterministic.
+    """
+    resumed = {}
+    for chunk in chunks:
+        head, data = chunk.split("\n", 1)
+        moved = head.removeprefix("id: ").split(",")
+        [n] = [n for n in range(len(ids)) if moved[n] != ids[n]]
+        resumed.setdefault(streams[n], []).append((moved[n], data))
+        ids = moved
+    return resumed, ids
+
+
+@pytest.mark.asyncio
+async def test_topic_sse_backlog_then_resume():
+    r = PageRedis(**{"topic:news": articles(1, 2, 3)})
+    hub = main.StreamHub(r, block_ms=1)
+
+    async def first_chunk(last_event_id=None):
+        headers = [(b"last-event-id", last_event_id.encode())] \
+            if last_event_id else []
+        resp = await main.topic_sse("news", Request({"type": "http",
+                                                    "headers": headers}),
+                                    backlog=2, r=r, hub=hub)
+        assert resp.media_type == "text/event-stream"
+        chunk = await anext(resp.body_iterator)
+        await resp.body_iterator.aclose()
+        return chunk
+
+    assert await first_chunk() == (
+        'data: {"id": 2}\n\nid: 3-0\ndata: {"id": 3}\n\n')
+    r.streams["topic:news"] += articles(4, 5)
+    # only what was missed, not the backlog again
+    assert await first_chunk("3-0") == (
+        'data: {"id": 4}\n\nid: 5-0\ndata: {"id": 5}\n\n')
+    assert hub.stats()["streams"] == 0
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_topic_sse_resumes_over_a_gap_longer_than_the_queue():
+    r = PageRedis(**{"topic:news": articles(1, 2, 3, 4, 5, 6)})
+    # the app-wide policy would drop entries; event streams must not
+    hub = main.StreamHub(r, block_ms=1, limit=2, policy="drop_oldest")
+    async with hub.watch({"topic:news": "0-0"}):  # another reader
+        while hub.cursor["topic:news"] != "6-0":
+            await asyncio.sleep(0.001)
+        request = Request({"type": "http",
+                           "headers": [(b"last-event-id", b"1-0")]})
+        resp = await main.topic_sse("news", request, r=r, hub=hub)
+        chunks = [await asyncio.wait_for(anext(resp.body_iterator), 1)
+                  for _ in range(3)]
+        await resp.body_iterator.aclose()
+    assert chunks == [
+        'data: {"id": 2}\n\nid: 3-0\ndata: {"id": 3}\n\n',
+        'data: {"id": 4}\n\nid: 5-0\ndata: {"id": 5}\n\n',
+        'id: 6-0\ndata: {"id": 6}\n\n',
+    ]
+    assert hub.stats()["streams"] == 0
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_feed_sse_resumes_each_merged_stream():
+    r = PageRedis({"user:0": {"interests": ["news"]}},
+                  **{"feed_stream:0": articles(1, 2, 4),
+                     "topic:news": articles(3, 5, doc=10)})
+    hub = main.StreamHub(r, block_ms=1)
+    request = Request({"type": "http",
+                       "headers": [(b"last-event-id", b"2-0,3-0")]})
+    resp = await main.feed_sse("0", request, r=r, hub=hub)
+    chunks = [await anext(resp.body_iterator) for _ in range(2)]
+    await resp.body_iterator.aclose()
+    assert per_stream(chunks, ["feed_stream:0", "topic:news"],
+                      ["2-0", "3-0"]) == (
+        {"feed_stream:0": [("4-0", 'data: {"id": 4}\n\n')],
+         "topic:news": [("5-0", 'data: {"id": 15}\n\n')]},
+        ["4-0", "5-0"])
+    assert hub.stats()["streams"] == 0
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_event_stream_over_a_plain_istream(dummy_stream):
+    async def render(entries):
+        return [data["data"] for _id, data in entries]
+
+    def events(last_event_id, streams):
+        request = Request({"type": "http", "headers": [
+            (b"last-event-id", last_event_id.encode())]})
+        resp = main.event_stream(request, None, dummy_stream, streams, 100,
+                                 render)
+        return resp.body_iterator
+
+    assert [c async for c in events("1-0", ["feed_stream:0"])] == [
+        'id: 3-0\ndata: {"text": "world"}\n\n']
+    merged = events("1-0,0-0", ["feed_stream:0", "topic:news"])
+    chunks = [await asyncio.wait_for(anext(merged), 1) for _ in range(2)]
+    await merged.aclose()
+    assert per_stream(chunks, ["feed_stream:0", "topic:news"],
+                      ["1-0", "0-0"]) == (
+        {"feed_stream:0": [("3-0", 'data: {"text": "world"}\n\n')],
+         "topic:news": [("2-0", 'data: {"text": "news"}\n\n')]},
+        ["3-0", "2-0"])
+    assert dummy_stream.calls == [("feed_stream:0", "1-0"),
+                                  ("feed_stream:0", "1-0"),
+                                  ("topic:news", "0-0")]
@@ -0,0 +1,264 @@
+import asyncio
+import pytest
+
+from api_gateway.api_gateway import hub as hub_mod
+from api_gateway.api_gateway.hub import (
+    SlowConsumer, StreamHub, Subscription, stream_order,
+)
+
+
+class StreamsRedis:
+    """In-memory streams answering XREAD / XRANGE like Valkey."""
+    def __init__(self, **streams):
+        self.streams = {k: list(v) for k, v in streams.items()}
+        self.reads = []
+        self.revranges = 0
+        self.ranges = []
+
+    def add(self, stream, entry_id, doc):
+        self.streams.setdefault(stream, []).append((entry_id, {"id": doc}))
+
+    async def xread(self, streams, block=0, count=1):
+        self.reads.append(dict(streams))
+        out = []
+        for s, last in streams.items():
+            new = [e for e in self.streams.get(s, [])
+                   if stream_order(e[0]) > stream_order(last)][:count]
+            if new:
+                out.append((s, new))
+        if not out:
+            await asyncio.sleep(block / 1000)
+        return out
+
+    async def xrevrange(self, stream, hi, lo, count=None):
+        self.revranges += 1
+        return self.streams.get(stream, [])[::-1][:count]
+
+    async def xrange(self, stream, lo, hi, count=None):
+        assert lo.startswith("(")
+        self.ranges.append((lo, hi, count))
+        return [e for e in self.streams.get(stream, [])
+                if stream_order(lo[1:]) < stream_order(e[0])
+                <= stream_order(hi)][:count]
+
+
+async def next_batch(sub):
+    return [(i, d["id"]) for i, d in await asyncio.wait_for(sub.__anext__(), 1)]
+
+
+@pytest.mark.asyncio
+async def test_sockets_on_one_stream_share_a_read():
+    r = StreamsRedis()
+    hub = StreamHub(r, block_ms=1)
+    async with hub.watch({"topic:a": "0-0"}) as one, \
+            hub.watch({"topic:a": "0-0"}) as two:
+        r.add("topic:a", "1-0", "x")
+        assert await next_batch(one) == [("1-0", "x")]
+        assert await next_batch(two) == [("1-0", "x")]
+        assert hub.stats() == {"streams": 1, "readers": 1, "subscriptions": 2,
+                               "rings": 0}
+        assert all(read == {"topic:a": "0-0"} or read == {"topic:a": "1-0"}
+                   for read in r.reads)
+    assert hub.stats()["streams"] == 0
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_late_socket_catches_up_from_its_backlog():
+    r = StreamsRedis()
+    hub = StreamHub(r, block_ms=1)
+    async with hub.watch({"topic:a": "0-0"}) as early:
+        r.add("topic:a", "1-0", "x")
+        r.add("topic:a", "2-0", "y")
+        assert len(await next_batch(early)) == 2
+        # backlog of the late socket ended at 1-0; the hub is at 2-0
+        async with hub.watch({"topic:a": "1-0"}) as late:
+            assert await next_batch(late) == [("2-0", "y")]
+            r.add("topic:a", "3-0", "z")
+            assert await next_batch(late) == [("3-0", "z")]
+            assert await next_batch(early) == [("3-0", "z")]
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_gap_longer_than_the_queue_is_paged_in():
+    r = StreamsRedis()
+    hub = StreamHub(r, block_ms=1, limit=2, policy="disconnect")
+    async with hub.watch({"topic:a": "0-0"}, policy="drop_oldest") as early:
+        for n in range(1, 7):
+            r.add("topic:a", f"{n}-0", n)
+        while hub.cursor["topic:a"] != "6-0":
+            await asyncio.sleep(0.001)
+        async with hub.watch({"topic:a": "1-0"}) as late:
+            assert await next_batch(late) == [("2-0", 2), ("3-0", 3)]
+            r.add("topic:a", "7-0", 7)            # read live meanwhile
+            assert await next_batch(late) == [("4-0", 4), ("5-0", 5)]
+            assert await next_batch(late) == [("6-0", 6)]
+            assert await next_batch(late) == [("7-0", 7)]
+            assert not late.behind
+        # one page per batch, never more than the queue holds (7-0 came
+        # live or in a last page, depending on when the reader got it)
+        assert r.ranges[:3] == [("(1-0", "6-0", 2), ("(3-0", "6-0", 2),
+                                ("(5-0", "6-0", 2)]
+        assert all(count == 2 for *_, count in r.ranges)
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_multi_stream_batches_sorted_by_id():
+    r = StreamsRedis()
+    hub = StreamHub(r, block_ms=1)
+    async with hub.watch({"feed:1": "0-0", "topic:a": "0-0"}) as sub:
+        r.add("topic:a", "2-0", "b")
+        r.add("feed:1", "1-0", "a")
+        r.add("feed:1", "3-0", "c")
+        await asyncio.sleep(0.01)
+        assert await next_batch(sub) == [("1-0", "a"), ("2-0", "b"),
+                                         ("3-0", "c")]
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_streams_are_chunked_and_split_by_slot():
+    r = StreamsRedis()
+    hub = StreamHub(r, chunk=2, block_ms=1)
+    async with hub.watch({f"feed:{i}": "0-0" for i in range(5)}):
+        await asyncio.sleep(0.01)
+        assert hub.stats()["readers"] == 3
+        assert max(len(read) for read in r.reads) == 2
+
+    r = StreamsRedis()
+    hub = StreamHub(r, cluster=True, block_ms=1)
+    streams = {"feed:{1}": "0-0", "feed_stream:{1}": "0-0", "feed:{2}": "0-0"}
+    async with hub.watch(streams):
+        await asyncio.sleep(0.01)
+        assert hub.stats()["readers"] == 2
+        assert {frozenset(read) for read in r.reads} == {
+            frozenset({"feed:{1}", "feed_stream:{1}"}), frozenset({"feed:{2}"})}
+    await asyncio.sleep(0.01)
+    assert hub.chunks == []
+    assert hub_mod.key_slot("feed:{1}") == hub_mod.key_slot("x{1}")
+
+
+@pytest.mark.asyncio
+async def test_window_coalesces_entries_into_one_batch():
+    r = StreamsRedis()
+    hub = StreamHub(r, block_ms=1)
+    async with hub.watch({"topic:a": "0-0"}, window=0.05) as sub:
+        r.add("topic:a", "1-0", "x")
+        first = asyncio.ensure_future(next_batch(sub))
+        await asyncio.sleep(0.02)
+        r.add("topic:a", "2-0", "y")
+        assert await first == [("1-0", "x"), ("2-0", "y")]
+    await hub.close()
+
+
+def entries(*ids):
+    return [(i, {"id": i}) for i in ids]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_newest_entries():
+    sub = Subscription({"s": "0-0"}, limit=2, policy="drop_oldest")
+    sub.put("s", entries("1-0", "2-0", "3-0"))
+    sub.put("s", entries("4-0"))
+    assert [i for i, _ in await sub.__anext__()] == ["3-0", "4-0"]
+    assert sub.take_missed() == 0
+
+
+@pytest.mark.asyncio
+async def test_notice_policy_reports_missed_entries():
+    sub = Subscription({"s": "0-0"}, limit=2, policy="notice")
+    sub.put("s", entries("1-0", "2-0"))
+    sub.put("s", entries("3-0"))                  # overflow: all three go
+    assert await sub.__anext__() == []
+    assert sub.take_missed() == 3
+    sub.put("s", entries("4-0"))
+    assert [i for i, _ in await sub.__anext__()] == ["4-0"]
+    assert sub.take_missed() == 0
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_raises_and_close_ends_iteration():
+    sub = Subscription({"s": "0-0"}, limit=1, policy="disconnect")
+    sub.put("s", entries("1-0", "2-0"))
+    with pytest.raises(SlowConsumer):
+        await sub.__anext__()
+
+    sub = Subscription({"s": "0-0"})
+    sub.close()
+    assert [batch async for batch in sub] == []
+    with pytest.raises(ValueError):
+        Subscription({"s": "0-0"}, policy="block")
+
+
+@pytest.mark.asyncio
+async def test_backlog_of_a_watched_stream_comes_from_its_ring():
+    r = StreamsRedis()
+    for n in range(1, 6):
+        r.add("topic:a", f"{n}-0", n)
+    hub = StreamHub(r, block_ms=1, cache=4)
+    assert [i for i, _ in await hub.backlog("topic:a", 2)] == ["5-0", "4-0"]
+    async with hub.watch({"topic:a": "5-0"}):
+        await hub.backlog("topic:a", 2)           # fills the ring
+        assert r.revranges == 2 and hub.stats()["rings"] == 1
+        r.add("topic:a", "6-0", 6)
+        await asyncio.sleep(0.01)                 # the reader extends it
+        assert [i for i, _ in await hub.backlog("topic:a", 4)] == [
+            "6-0", "5-0", "4-0", "3-0"]
+        assert r.revranges == 2
+        await hub.backlog("topic:a", 5)           # more than it holds
+        assert r.revranges == 3
+    assert hub.stats()["rings"] == 0
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_ring_of_a_short_stream_covers_any_count():
+    r = StreamsRedis()
+    r.add("topic:a", "1-0", 1)
+    hub = StreamHub(r, block_ms=1, cache=4)
+    async with hub.watch({"topic:a": "1-0"}):
+        await hub.backlog("topic:a", 50)
+        assert len(await hub.backlog("topic:a", 50)) == 1
+        assert r.revranges == 1
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_resumes_after_last_id():
+    r = StreamsRedis()
+    for n in range(1, 4):
+        r.add("topic:a", f"{n}-0", n)
+    hub = StreamHub(r, block_ms=1)
+    resumed = hub.subscribe("topic:a", "1-0")
+    assert [i for i, _ in await anext(resumed)] == ["2-0", "3-0"]
+    fresh = hub.subscribe("topic:a")              # from now on
+    pending = asyncio.ensure_future(anext(fresh))
+    await asyncio.sleep(0.01)
+    r.add("topic:a", "4-0", 4)
+    assert [i for i, _ in await asyncio.wait_for(pending, 1)] == ["4-0"]
+    assert [i for i, _ in await anext(resumed)] == ["4-0"]
+    await resumed.aclose()
+    await fresh.aclose()
+    assert hub.stats()["streams"] == 0
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_view_tails_under_its_own_policy():
+    r = StreamsRedis()
+    hub = StreamHub(r, block_ms=1, limit=1, policy="drop_oldest")
+    strict = hub.as_stream("disconnect").subscribe("topic:a", "0-0")
+    lenient = hub.as_stream().subscribe("topic:a", "0-0")
+    pending = [asyncio.ensure_future(anext(s)) for s in (strict, lenient)]
+    await asyncio.sleep(0.01)
+    r.add("topic:a", "1-0", 1)
+    r.add("topic:a", "2-0", 2)                    # one read, over the limit
+    with pytest.raises(SlowConsumer):
+        await asyncio.wait_for(pending[0], 1)
+    assert [i for i, _ in await asyncio.wait_for(pending[1], 1)] == ["2-0"]
+    await lenient.aclose()
+    with pytest.raises(ValueError):
+        hub.as_stream("block")
+    await hub.close()
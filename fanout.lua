@@ -1,4 +1,51 @@
--- KEYS[1] = topic stream key
--- ARGV[1] = max_len
-redis.call('XTRIM', KEYS[1], 'MAXLEN', tonumber(ARGV[1]))
-return 1
+-- Batched fan-out: deliver a whole batch of articles to a chunk of
+-- subscribers in one server-side step.
+--
+-- KEYS    = per-subscriber quads: seen key, previous seen key (bloom_daily
+--           only, otherwise the same key again), feed:<uid>, feed_stream:<uid>
+-- ARGV[1] = feed max length
+-- ARGV[2] = seen-key TTL (seconds)
+-- ARGV[3] = feed_stream field name ("data" for full JSON, "ref" for doc ids)
+-- ARGV[4] = dedup backend: "set", "bloom" or "bloom_daily"
+-- ARGV[5] = Bloom capacity, ARGV[6] = Bloom error rate
+-- ARGV[7..] = doc_id, payload pairs (oldest first)
+--
+-- Returns one {pushed, feed_len} pair per subscriber, in KEYS order.
+local max_len = tonumber(ARGV[1])
+local seen_ttl = tonumber(ARGV[2])
+local field = ARGV[3]
+local dedup = ARGV[4]
+local capacity, err = ARGV[5], ARGV[6]
+local out = {}
+
+local function is_new(seen, prev, id)
+  if dedup == 'set' then
+    -- SADD returns 1 when the member wasn't present
+    return redis.call('SADD', seen, id) == 1
+  end
+  if dedup == 'bloom_daily' and redis.call('BF.EXISTS', prev, id) == 1 then
+    return false
+  end
+  local added = redis.call('BF.INSERT', seen, 'CAPACITY', capacity,
+                           'ERROR', err, 'ITEMS', id)
+  return added[1] == 1
+end
+
+for i = 1, #KEYS, 4 do
+  local seen, prev, list, stream = KEYS[i], KEYS[i + 1], KEYS[i + 2], KEYS[i + 3]
+  local pushed = 0
+  for j = 7, #ARGV, 2 do
+    if is_new(seen, prev, ARGV[j]) then
+      redis.call('LPUSH', list, ARGV[j + 1])
+      redis.call('XADD', stream, 'MAXLEN', max_len, '*', field, ARGV[j + 1])
+      pushed = pushed + 1
+    end
+  end
+  if pushed > 0 then
+    redis.call('EXPIRE', seen, seen_ttl, 'NX')
+    redis.call('LTRIM', list, 0, max_len - 1)
+  end
+  out[#out + 1] = {pushed, redis.call('LLEN', list)}
+end
+
+return out
@@ -1,12 +1,17 @@
 import os, sys, types
+import pytest
 
 class DummyMetric:
     def inc(self, *a, **k):
         pass
     def set(self, *a, **k):
         pass
+    def observe(self, *a, **k):
+        pass
     def labels(self, *a, **k):
         return self
+    def set_function(self, fn):
+        pass
     def time(self):
         class Ctx:
             def __enter__(self):
@@ -20,6 +25,8 @@ dummy_prom = types.SimpleNamespace(
     Histogram=lambda *a, **k: DummyMetric(),
     Gauge=lambda *a, **k: DummyMetric(),
     start_http_server=lambda *a, **k: None,
+    generate_latest=lambda *a, **k: b"",
+    CONTENT_TYPE_LATEST="text/plain; version=0.0.4; charset=utf-8",
 )
 
 dummy_asyncio = types.ModuleType("redis.asyncio")
@@ -31,7 +38,17 @@ class DummyExc(Exception):
 
 dummy_asyncio.ResponseError = DummyExc
 
-dummy_exceptions = types.SimpleNamespace(ConnectionError=DummyExc, ResponseError=DummyExc)
+dummy_exceptions = types.SimpleNamespace(ConnectionError=DummyExc, ResponseError=DummyExc,
+                                         TimeoutError=DummyExc)
+
+class DummyRetry:
+    def __init__(self, *a, **k):
+        pass
+
+dummy_retry = types.ModuleType("redis.asyncio.retry")
+dummy_retry.Retry = DummyRetry
+dummy_backoff = types.ModuleType("redis.backoff")
+dummy_backoff.ExponentialBackoff = DummyRetry
 
 dummy_redis = types.ModuleType("redis")
 dummy_redis.asyncio = dummy_asyncio
@@ -73,6 +90,17 @@ def pytest_configure(config):
     sys.modules.setdefault("redis", dummy_redis)
     sys.modules.setdefault("redis.asyncio", dummy_asyncio)
     sys.modules.setdefault("redis.exceptions", dummy_exceptions)
+    sys.modules.setdefault("redis.asyncio.retry", dummy_retry)
+    sys.modules.setdefault("redis.backoff", dummy_backoff)
     sys.modules.setdefault("prometheus_client", dummy_prom)
     sys.modules.setdefault("transformers", dummy_transformers)
 
+
+
+@pytest.fixture(autouse=True)
+def fresh_valkey_client():
+    """agents/client.py caches one client per process; not across tests."""
+    yield
+    client = sys.modules.get("agents.client")
+    if client is not None:
+        client._client = None
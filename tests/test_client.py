@@ -0,0 +1,154 @@
+import sys, importlib
+import asyncio
+import types
+import pytest
+
+
+def load_mod(monkeypatch, **env):
+    env.setdefault("VALKEY_POOL_TIMEOUT", "0")    # plain from_url pool
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    sys.modules.pop("agents.client", None)
+    return importlib.import_module("agents.client")
+
+
+class Stub:
+    def __init__(self):
+        self.pings = 0
+    async def ping(self):
+        self.pings += 1
+
+
+@pytest.mark.asyncio
+async def test_pool_options(monkeypatch):
+    mod = load_mod(monkeypatch, VALKEY_MAX_CONNECTIONS="32", VALKEY_PROTOCOL="2",
+                   VALKEY_HEALTH_CHECK="15", VALKEY_KEEPALIVE="0")
+    seen = {}
+    async def from_url(url, **kwargs):
+        seen.update(kwargs, url=url)
+        return Stub()
+    monkeypatch.setattr(mod.cluster.redis, "from_url", from_url)
+    await mod.connect("redis://h:1")
+    assert seen["url"] == "redis://h:1"
+    assert seen["max_connections"] == 32
+    assert seen["protocol"] == 2
+    assert seen["health_check_interval"] == 15
+    assert seen["socket_keepalive"] is False
+    assert seen["decode_responses"] is True
+    assert "retry" in seen and seen["retry_on_error"]
+
+
+@pytest.mark.asyncio
+async def test_full_pool_waits_for_a_connection(monkeypatch):
+    monkeypatch.delenv("VALKEY_POOL_TIMEOUT", raising=False)
+    sys.modules.pop("agents.client", None)
+    mod = importlib.import_module("agents.client")
+    assert mod.POOL_TIMEOUT == 2
+    seen = {}
+
+    class Pool:
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            seen.update(kwargs, url=url)
+            return cls()
+
+    class Client:
+        @staticmethod
+        async def from_pool(pool):
+            seen["pool"] = pool
+            return Stub()
+
+    monkeypatch.setattr(mod.cluster.redis, "BlockingConnectionPool", Pool,
+                        raising=False)
+    monkeypatch.setattr(mod.cluster.redis, "Redis", Client, raising=False)
+    await mod.connect("redis://h:1")
+    assert seen["url"] == "redis://h:1" and isinstance(seen["pool"], Pool)
+    assert seen["timeout"] == 2 and seen["max_connections"] == 256
+    assert "pool_timeout" not in seen
+
+
+@pytest.mark.asyncio
+async def test_connect_shares_one_client(monkeypatch):
+    mod = load_mod(monkeypatch)
+    made = []
+    async def from_url(url, **kwargs):
+        made.append(Stub())
+        return made[-1]
+    monkeypatch.setattr(mod.cluster.redis, "from_url", from_url)
+    a = await mod.connect()
+    b = await mod.connect()
+    assert a is b and len(made) == 1 and a.pings == 2
+
+
+@pytest.mark.asyncio
+async def test_connect_backs_off(monkeypatch, caplog):
+    mod = load_mod(monkeypatch, VALKEY_BACKOFF_BASE="0.1", VALKEY_BACKOFF_CAP="0.5")
+    calls = {"n": 0}
+    async def from_url(url, **kwargs):
+        calls["n"] += 1
+        if calls["n"] < 6:
+            raise OSError("refused")
+        return Stub()
+    monkeypatch.setattr(mod.cluster.redis, "from_url", from_url)
+    monkeypatch.setattr(mod.random, "uniform", lambda lo, hi: hi)
+    delays = []
+    async def sleep(d):
+        delays.append(d)
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    with caplog.at_level("WARNING", logger="valkey"):
+        await mod.connect()
+    assert delays == [0.2, 0.4, 0.5, 0.5, 0.5]        # doubling, capped
+    assert [r.getMessage() for r in caplog.records][0] == (
+        "[valkey] not ready (OSError('refused')); retry in 0.20s")
+
+
+@pytest.mark.asyncio
+async def test_connect_gives_up(monkeypatch):
+    mod = load_mod(monkeypatch)
+    async def from_url(url, **kwargs):
+        raise OSError("refused")
+    monkeypatch.setattr(mod.cluster.redis, "from_url", from_url)
+    async def sleep(d):
+        pass
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    with pytest.raises(OSError):
+        await mod.connect(retries=3)
+
+
+def test_stream_replies(monkeypatch):
+    mod = load_mod(monkeypatch)
+    entries = [("1-0", {"a": "1"}), ("2-0", {"a": "2"})]
+    assert mod.stream_replies([["s", entries]]) == [["s", entries]]   # RESP2
+    assert mod.stream_replies({"s": [entries]}) == [("s", entries)]    # RESP3
+    assert mod.stream_replies(None) == []
+
+
+def test_pool_usage(monkeypatch):
+    mod = load_mod(monkeypatch)
+    pool = types.SimpleNamespace(_in_use_connections={1, 2},
+                                 _available_connections=[3], max_connections=8)
+    assert mod.pool_usage(types.SimpleNamespace(connection_pool=pool)) == {
+        "in_use": 2, "idle": 1, "max": 8}
+
+    class Cluster:
+        def get_nodes(self):
+            return [types.SimpleNamespace(_connections=[1, 2, 3], _free=[3],
+                                          max_connections=8)] * 2
+    assert mod.pool_usage(Cluster()) == {"in_use": 4, "idle": 2, "max": 16}
+    assert mod.pool_usage() == {"in_use": 0, "idle": 0, "max": 0}   # no client yet
+
+
+def test_pool_usage_without_private_sets(monkeypatch):
+    mod = load_mod(monkeypatch)
+    pool = types.SimpleNamespace(_created_connections=5, max_connections=8)
+    assert mod.pool_usage(types.SimpleNamespace(connection_pool=pool)) == {
+        "in_use": 5, "idle": 0, "max": 8}
+    pool = types.SimpleNamespace(_available_connections=[1, 2],
+                                 _created_connections=5, max_connections=8)
+    assert mod.pool_usage(types.SimpleNamespace(connection_pool=pool)) == {
+        "in_use": 3, "idle": 2, "max": 8}
+
+    class Cluster:
+        def get_nodes(self):
+            return [types.SimpleNamespace(max_connections=8)]
+    assert mod.pool_usage(Cluster()) == {"in_use": 0, "idle": 0, "max": 8}
@@ -0,0 +1,72 @@
+import sys, importlib
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def drop_module():
+    yield
+    sys.modules.pop("agents.cluster", None)     # re-read VALKEY_URL next time
+
+
+def load_mod(monkeypatch, url):
+    monkeypatch.setenv("VALKEY_URL", url)
+    sys.modules.pop("agents.cluster", None)
+    return importlib.import_module("agents.cluster")
+
+
+def test_standalone_keys_unchanged(monkeypatch):
+    mod = load_mod(monkeypatch, "redis://valkey:6379")
+    assert not mod.CLUSTER
+    assert mod.user_key("feed", 42) == "feed:42"
+
+
+def test_cluster_keys_hash_tagged(monkeypatch):
+    mod = load_mod(monkeypatch, "redis+cluster://valkey-1:6379")
+    assert mod.CLUSTER
+    assert mod.user_key("feed", 42) == "feed:{42}"
+    slots = {mod.key_slot(mod.user_key(k, 42))
+             for k in ("feed", "feed_stream", "feed_seen", "user")}
+    assert slots == {mod.key_slot("42")}
+
+
+def test_key_slot(monkeypatch):
+    mod = load_mod(monkeypatch, "redis://valkey:6379")
+    assert mod.key_slot("123456789") == 12739           # CLUSTER KEYSLOT
+    assert mod.key_slot("{user1000}.following") == mod.key_slot("user1000")
+    assert mod.key_slot("foo{}{bar}") != mod.key_slot("bar")   # empty tag: whole key
+
+
+def test_by_slot_keeps_order(monkeypatch):
+    mod = load_mod(monkeypatch, "redis://valkey:6379")
+    uids = [str(i) for i in range(100)]
+    groups = mod.by_slot(uids, lambda u: f"feed:{{{u}}}")
+    assert sorted(u for g in groups for u in g) == sorted(uids)
+    for g in groups:
+        assert len({mod.key_slot(u) for u in g}) == 1
+        assert g == sorted(g, key=int)
+
+
+@pytest.mark.asyncio
+async def test_connect_picks_client(monkeypatch):
+    mod = load_mod(monkeypatch, "redis://valkey:6379")
+    made = []
+
+    class FakeCluster:
+        @classmethod
+        def from_url(cls, url, **kw):
+            made.append(("cluster", url, kw))
+            return cls()
+        async def initialize(self):
+            made.append("initialized")
+
+    async def from_url(url, **kw):
+        made.append(("plain", url, kw))
+        return "plain"
+
+    monkeypatch.setattr(mod.redis, "RedisCluster", FakeCluster, raising=False)
+    monkeypatch.setattr(mod.redis, "from_url", from_url)
+    assert await mod.connect("redis://h:1") == "plain"
+    assert isinstance(await mod.connect("valkey+cluster://h:7001"), FakeCluster)
+    assert made == [("plain", "redis://h:1", {"decode_responses": True}),
+                    ("cluster", "redis://h:7001", {"decode_responses": True}),
+                    "initialized"]
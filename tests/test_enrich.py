@@ -1,4 +1,4 @@
-import sys, importlib
+import sys, importlib, json, pathlib, subprocess, types
 import asyncio
 import pytest
 
@@ -34,7 +34,7 @@ def test_device_auto(monkeypatch, available, expected):
     dummy.cuda = types.SimpleNamespace(is_available=lambda: available)
     monkeypatch.setitem(sys.modules, "torch", dummy)
     mod = load_module(monkeypatch)
-    assert mod.DEVICE == expected
+    assert mod.select_device() == expected
 
 @pytest.mark.asyncio
 async def test_rconn(monkeypatch):
@@ -42,7 +42,7 @@ async def test_rconn(monkeypatch):
     class Stub:
         async def ping(self):
             pass
-    async def fake_from_url(url, decode_responses=True):
+    async def fake_from_url(url, **kwargs):
         return Stub()
     monkeypatch.setattr(mod.redis, "from_url", fake_from_url)
     conn = await mod.rconn()
@@ -55,7 +55,7 @@ async def test_rconn_retry(monkeypatch):
         async def ping(self):
             pass
     calls = {"n": 0}
-    async def fake_from_url(url, decode_responses=True):
+    async def fake_from_url(url, **kwargs):
         calls["n"] += 1
         if calls["n"] == 1:
             raise Exception("fail")
@@ -112,16 +112,27 @@ async def test_stream_trim(monkeypatch):
         async def xlen(self, name):
             return len(self.streams.get(name, []))
 
-        def pipeline(self):
+        def pipeline(self, transaction=True):
+            outer = self
+
             class P:
+                def __init__(self):
+                    self.ops = []
+
                 def xadd(self, *a, **k):
                     pass
 
+                def xack(self, *a, **k):
+                    self.ops.append(outer.xack(*a, **k))
+
                 def xtrim(self, *a, **k):
-                    pass
+                    self.ops.append(outer.xtrim(*a, **k))
+
+                def xlen(self, name):
+                    self.ops.append(outer.xlen(name))
 
                 async def execute(self):
-                    pass
+                    return [await op for op in self.ops]
 
             return P()
 
@@ -201,16 +212,27 @@ async def test_backlog_gauge_drop(monkeypatch):
         async def xlen(self, name):
             return len(self.streams.get(name, []))
 
-        def pipeline(self):
+        def pipeline(self, transaction=True):
+            outer = self
+
             class P:
+                def __init__(self):
+                    self.ops = []
+
                 def xadd(self, *a, **k):
                     pass
 
+                def xack(self, *a, **k):
+                    self.ops.append(outer.xack(*a, **k))
+
                 def xtrim(self, *a, **k):
-                    pass
+                    self.ops.append(outer.xtrim(*a, **k))
+
+                def xlen(self, name):
+                    self.ops.append(outer.xlen(name))
 
                 async def execute(self):
-                    pass
+                    return [await op for op in self.ops]
 
             return P()
 
@@ -227,3 +249,702 @@ async def test_backlog_gauge_drop(monkeypatch):
 
     assert recorded[-1] == await dummy.xlen(mod.SOURCE)
     assert recorded[-1] < 6000
+
+
+def test_batcher_deadline_and_resize(monkeypatch):
+    mod = load_module(monkeypatch)
+    b = mod.AdaptiveBatcher(size=8, lo=2, hi=64, max_wait=0.25, target=1.0)
+
+    buf = [("1", {}, 10.0)]
+    assert not b.due(buf, 10.125)
+    assert b.block_ms(buf, 10.125) == 125
+    assert b.due(buf, 10.25)                # oldest waited max_wait
+
+    b.observe(8, 2.0)                       # 0.25 s/doc → ideal 4
+    assert b.size == 6
+    b.observe(3, 0.03)                      # partial batch: never grows
+    assert b.size == 6
+    b.observe(6, 0.06)                      # 0.01 s/doc → ideal 100
+    assert b.size == 53
+    b.observe(53, 0.053)
+    assert b.size == 64                     # clamped to hi
+
+
+@pytest.mark.asyncio
+async def test_partial_batch_flushed_on_deadline(monkeypatch):
+    monkeypatch.setenv("ENRICH_MAX_WAIT_MS", "0")
+    mod = load_module(monkeypatch)
+
+    class DummyRedis:
+        def __init__(self):
+            self.reads = 0
+            self.routed = 0
+        async def xgroup_create(self, *a, **k):
+            pass
+        async def xreadgroup(self, grp, consumer, streams, count=1, block=0):
+            self.reads += 1
+            if self.reads == 1:
+                return [(mod.SOURCE, [(str(i), {"id": i, "title": "t", "body": "b"})
+                                      for i in range(3)])]
+            raise RuntimeError("stop")
+        async def xack(self, *a, **k):
+            pass
+        async def xtrim(self, *a, **k):
+            pass
+        async def xlen(self, name):
+            return 0
+        def pipeline(self, transaction=True):
+            outer = self
+            class P:
+                def xadd(self, *a, **k):
+                    outer.routed += 1
+                def xack(self, *a, **k):
+                    pass
+                def xtrim(self, *a, **k):
+                    pass
+                def xlen(self, name):
+                    pass
+                async def execute(self):
+                    return [0]
+            return P()
+
+    dummy = DummyRedis()
+    async def fake_rconn():
+        return dummy
+    monkeypatch.setattr(mod, "rconn", fake_rconn)
+    monkeypatch.setattr(mod, "start_http_server", lambda *a, **k: None)
+    with pytest.raises(RuntimeError):
+        await mod.main()
+    assert dummy.routed == 3        # 3 < ENRICH_BATCH, still classified
+
+
+@pytest.mark.asyncio
+async def test_reads_overlap_classification(monkeypatch):
+    monkeypatch.setenv("ENRICH_EXECUTOR", "thread")
+    mod = load_module(monkeypatch)
+    import threading
+    second_read = threading.Event()
+    overlapped = []
+
+    def slow_classifier(texts, *a, **k):
+        # only returns promptly if the loop kept reading meanwhile
+        overlapped.append(second_read.wait(timeout=2))
+        return [{"labels": ["tech"]} for _ in texts]
+
+    monkeypatch.setattr(mod, "classifier", slow_classifier)
+
+    class DummyRedis:
+        def __init__(self):
+            self.reads = 0
+            self.acked = []
+        async def xgroup_create(self, *a, **k):
+            pass
+        async def xreadgroup(self, grp, consumer, streams, count=1, block=0):
+            self.reads += 1
+            if self.reads == 1:
+                return [(mod.SOURCE, [(str(i), {"id": i, "title": "t", "body": "b"})
+                                      for i in range(count)])]
+            if self.reads == 2:
+                second_read.set()
+                await asyncio.sleep(0.01)
+                return []
+            raise RuntimeError("stop")
+        async def xack(self, stream, grp, *mids):
+            self.acked += mids
+        async def xtrim(self, *a, **k):
+            pass
+        async def xlen(self, name):
+            return 0
+        def pipeline(self, transaction=True):
+            outer = self
+            class P:
+                def __init__(self):
+                    self.ops = []
+                def xadd(self, *a, **k):
+                    pass
+                def xack(self, *a, **k):
+                    self.ops.append(outer.xack(*a, **k))
+                def xtrim(self, *a, **k):
+                    pass
+                def xlen(self, name):
+                    self.ops.append(outer.xlen(name))
+                async def execute(self):
+                    return [await op for op in self.ops]
+            return P()
+
+    dummy = DummyRedis()
+    async def fake_rconn():
+        return dummy
+    monkeypatch.setattr(mod, "rconn", fake_rconn)
+    monkeypatch.setattr(mod, "start_http_server", lambda *a, **k: None)
+    with pytest.raises(RuntimeError):
+        await mod.main()
+    assert overlapped == [True]
+    assert len(dummy.acked) == mod.BATCH     # drained before exiting
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_skip_model(monkeypatch):
+    monkeypatch.setenv("ENRICH_EXECUTOR", "inline")
+    mod = load_module(monkeypatch)
+    calls = []
+
+    def counting_classifier(texts, *a, **k):
+        calls.append(len(texts))
+        return [{"labels": ["tech", "sports"], "scores": [0.9, 0.1]}
+                for _ in texts]
+
+    monkeypatch.setattr(mod, "classifier", counting_classifier)
+    batcher = mod.AdaptiveBatcher(target=0)
+    cache = mod.ClassifyCache(size=10, ttl=60, shared=False)
+    in_q, out_q = asyncio.Queue(), asyncio.Queue()
+    task = asyncio.create_task(
+        mod.classify_stage(None, None, batcher, cache, in_q, out_q))
+
+    dup = [{"id": i, "title": "same", "body": "text"} for i in range(3)]
+    await in_q.put((["1", "2", "3"], dup))
+    await in_q.put((["4"], [{"id": 4, "title": "same", "body": "text"}]))
+    first = await out_q.get()
+    second = await out_q.get()
+    task.cancel()
+
+    assert calls == [1]                       # one distinct text, one model run
+    assert [d["topic"] for d in first[1]] == ["tech"] * 3
+    assert second[1][0]["topic"] == "tech"
+    assert second[1][0]["scores"] == {"tech": 0.9, "sports": 0.1}
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl_lru_and_shared(monkeypatch):
+    mod = load_module(monkeypatch)
+
+    class KV:
+        def __init__(self):
+            self.data, self.ex = {}, {}
+        async def mget(self, keys):
+            return [self.data.get(k) for k in keys]
+        def pipeline(self, transaction=True):
+            outer = self
+            class P:
+                def set(self, k, v, ex=None):
+                    outer.data[k], outer.ex[k] = v, ex
+                async def execute(self):
+                    pass
+            return P()
+
+    kv = KV()
+    clock = {"now": 100.0}
+    monkeypatch.setattr(mod.time, "monotonic", lambda: clock["now"])
+    a, b = mod.ClassifyCache.key("a"), mod.ClassifyCache.key("b")
+    res = {"topic": "tech", "scores": {"tech": 1.0}}
+
+    writer = mod.ClassifyCache(size=1, ttl=30, shared=True)
+    await writer.store(kv, {a: res, b: res})
+    assert list(writer.entries) == [b]        # LRU evicted a
+    assert kv.ex == {a: 30, b: 30}
+
+    reader = mod.ClassifyCache(size=10, ttl=30, shared=True)
+    assert await reader.lookup(kv, [a, a]) == {a: res}   # from Valkey
+    kv.data.clear()
+    assert await reader.lookup(kv, [a]) == {a: res}      # now local
+    clock["now"] += 31
+    assert await reader.lookup(kv, [a]) == {}            # expired
+
+
+def test_embed_backend_precomputes_labels(monkeypatch):
+    mod = load_module(monkeypatch)
+    labels = ["sports", "health", "finance"]
+    encoded = []
+
+    def fake_encode(texts):
+        # one axis per label word; documents mention their topic
+        encoded.append(len(texts))
+        return [[1.0 if l in t else 0.01 for l in labels] for t in texts]
+
+    monkeypatch.setattr(mod, "hf_encoder", lambda *a, **k: fake_encode)
+    clf = mod.EmbedClassifier(fake_encode, labels)
+    assert encoded == [3]                     # hypotheses encoded once
+
+    out = clf(["finance news today", "sports final"], labels)
+    out += clf(["health check"], labels)
+    assert encoded == [3, 2, 1]               # one pass per batch after that
+    assert [o["labels"][0] for o in out] == ["finance", "sports", "health"]
+    assert all(abs(sum(o["scores"]) - 1) < 1e-5 for o in out)
+    assert out[0]["scores"] == sorted(out[0]["scores"], reverse=True)
+
+    embed = mod.load_classifier("embed")
+    assert isinstance(embed, mod.EmbedClassifier)
+
+
+def test_token_budget_groups_and_restores_order(monkeypatch):
+    monkeypatch.setenv("ENRICH_TOKEN_BUDGET", "12")
+    mod = load_module(monkeypatch)
+    assert mod.token_batches([10, 2, 3, 2, 20], 12) == [[1, 3, 2], [0], [4]]
+
+    calls = []
+
+    def echo_classifier(texts, labels, batch_size=None, **k):
+        calls.append((len(texts), batch_size))
+        return [{"labels": [t.split()[0]], "scores": [1.0]} for t in texts]
+
+    monkeypatch.setattr(mod, "classifier", echo_classifier)
+    docs = [{"title": t, "body": "x " * n}
+            for t, n in (("long", 8), ("a", 0), ("b", 1), ("c", 0))]
+    out = mod.classify(docs)
+    assert [d["topic"] for d in out] == ["long", "a", "b", "c"]
+    assert calls == [(3, 3), (1, 1)]          # short docs share one pass
+
+
+def test_int8_model_exported_once(monkeypatch, tmp_path):
+    mod = load_module(monkeypatch)
+    import pickle, types
+    quantized = []
+
+    class FakeAuto:
+        @staticmethod
+        def from_pretrained(name):
+            return types.SimpleNamespace(eval=lambda: {"name": name})
+
+    def quantize_dynamic(model, layers, dtype=None):
+        quantized.append(model["name"])
+        return dict(model, int8=True)
+
+    def save(obj, path):
+        with open(path, "wb") as fp:
+            pickle.dump(obj, fp)
+
+    def load(path, weights_only=True):
+        with open(path, "rb") as fp:
+            return pickle.load(fp)
+
+    fake_torch = types.SimpleNamespace(
+        __version__="2.2.1", save=save, load=load,
+        nn=types.SimpleNamespace(Linear=object), qint8="qint8",
+        ao=types.SimpleNamespace(quantization=types.SimpleNamespace(
+            quantize_dynamic=quantize_dynamic)),
+    )
+    monkeypatch.setitem(sys.modules, "torch", fake_torch)
+    monkeypatch.setattr(sys.modules["transformers"],
+                        "AutoModelForSequenceClassification", FakeAuto,
+                        raising=False)
+
+    first = mod.quantized_model("org/model", cache_dir=str(tmp_path))
+    second = mod.quantized_model("org/model", cache_dir=str(tmp_path))
+    assert first == second == {"name": "org/model", "int8": True}
+    assert quantized == ["org/model"]         # second start reads the cache
+    assert [p.name for p in tmp_path.iterdir()] == ["org--model-int8-torch2.2.1.pt"]
+
+
+def test_int8_backend_wires_quantized_model_into_pipeline(monkeypatch,
+                                                          tmp_path):
+    """``load_classifier("int8")`` serves the quantized model, cached.
+
+    A seeded linear scorer stands in for the NLI model and the fake
+    ``quantize_dynamic`` rounds its weights to int8 steps, so this only
+    checks the wiring – the real model's parity is
+    :func:`test_int8_parity_with_real_model`.
+    """
+    monkeypatch.setenv("HF_HOME", str(tmp_path))
+    mod = load_module(monkeypatch)
+    import types, zlib
+    import numpy as np
+
+    dims = 64
+    weights = np.random.default_rng(7).normal(
+        size=(len(mod.TOPICS), dims)).astype(np.float32)
+    # each topic's own words pull towards it
+    for i, topic in enumerate(mod.TOPICS):
+        weights[i, zlib.crc32(topic.encode()) % dims] += 4
+
+    class Linear:
+        def __init__(self, w):
+            self.w = w
+
+    def features(text):
+        vec = np.zeros(dims, dtype=np.float32)
+        for word in text.lower().split():
+            vec[zlib.crc32(word.strip(".,").encode()) % dims] += 1
+        return vec
+
+    served = []
+
+    def fake_pipeline(task, model=None, tokenizer=None, device=-1):
+        model = Linear(weights) if isinstance(model, str) else model
+        served.append(model)
+
+        def clf(texts, labels, multi_label=False, **k):
+            out = []
+            for t in texts:
+                z = model.w @ features(t)
+                scores = np.exp(z - z.max()) / np.exp(z - z.max()).sum()
+                order = np.argsort(-scores)
+                out.append({"labels": [labels[j] for j in order],
+                            "scores": [float(scores[j]) for j in order]})
+            return out
+        return clf
+
+    quantized = []
+
+    def quantize_dynamic(model, layers, dtype=None):
+        scale = np.abs(model.w).max() / 127
+        quantized.append(Linear(np.round(model.w / scale) * scale))
+        return quantized[-1]
+
+    saved = {}
+
+    def save(obj, path):
+        saved[path] = obj
+        open(path, "wb").close()
+
+    def load(path, weights_only=True):
+        # saved under its temp name, renamed on disk
+        [obj] = [v for k, v in saved.items() if k.startswith(path)]
+        return obj
+
+    class FakeAuto:
+        @staticmethod
+        def from_pretrained(name):
+            return types.SimpleNamespace(eval=lambda: Linear(weights))
+
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(
+        __version__="2.2.1", save=save, load=load,
+        cuda=types.SimpleNamespace(is_available=lambda: False),
+        nn=types.SimpleNamespace(Linear=object), qint8="qint8",
+        ao=types.SimpleNamespace(quantization=types.SimpleNamespace(
+            quantize_dynamic=quantize_dynamic))))
+    transformers = sys.modules["transformers"]
+    monkeypatch.setattr(transformers, "pipeline", fake_pipeline)
+    monkeypatch.setattr(transformers, "AutoModelForSequenceClassification",
+                        FakeAuto, raising=False)
+    monkeypatch.setattr(transformers, "AutoTokenizer", FakeAuto, raising=False)
+
+    texts = [
+        "Parliament debates politics of the new budget",
+        "Central bank finance chiefs hold rates as business slows",
+        "Chipmaker unveils technology for faster science labs",
+        "Underdogs win the sports final with a late goal",
+        "Hospitals report health gains from new vaccine",
+        "Record heat puts climate targets under pressure",
+        "Schools expand education programme for tutoring",
+        "Streaming entertainment series breaks records",
+    ]
+    ref = mod.load_classifier("zeroshot")(texts, mod.TOPICS)
+    fast = mod.load_classifier("int8")(texts, mod.TOPICS)
+    assert len(quantized) == 1 and served[-1] is quantized[0]
+    assert [pathlib.Path(p).parent for p in saved] == [tmp_path / "enrich"]
+    assert [o["labels"][0] for o in fast] == [o["labels"][0] for o in ref]
+    assert max(abs(a["scores"][0] - b["scores"][0])
+               for a, b in zip(ref, fast)) < 0.05
+    mod.load_classifier("int8")                 # from the saved file now
+    assert len(quantized) == 1 and served[-1] is quantized[0]
+
+
+def test_int8_parity_with_real_model():
+    """The real int8 model agrees with fp32 (``bench_enrich.py quantized``).
+
+    Runs in a fresh interpreter: this suite stubs ``transformers``.
+    """
+    # the suite's torch stub would satisfy importorskip: look on disk
+    if importlib.machinery.PathFinder.find_spec("torch") is None:
+        pytest.skip("torch is not installed")
+    done = subprocess.run(
+        [sys.executable, "tools/bench_enrich.py", "quantized",
+         "--min-agreement", "0.9"],
+        cwd=pathlib.Path(__file__).resolve().parents[1],
+        capture_output=True, text=True, timeout=1800)
+    assert done.returncode == 0, done.stdout + done.stderr
+
+
+@pytest.mark.asyncio
+async def test_model_loads_lazily_after_group_join(monkeypatch):
+    events = []
+
+    def fake_pipeline(task, *a, **kw):
+        events.append("load")
+
+        def clf(texts, *a, **k):
+            events.append(("classify", len(texts)))
+            return [{"labels": ["tech"]} for _ in texts]
+        return clf
+
+    mod = load_module(monkeypatch)
+    monkeypatch.setattr("transformers.pipeline", fake_pipeline)
+    assert mod.classifier is None and events == []    # import stays cheap
+
+    class DummyRedis:
+        def __init__(self):
+            self.reads = 0
+        async def xgroup_create(self, *a, **k):
+            events.append("group")
+        async def xreadgroup(self, grp, consumer, streams, count=1, block=0):
+            self.reads += 1
+            if self.reads == 1:
+                events.append("read")
+                return [(mod.SOURCE, [(str(i), {"id": i, "title": "t", "body": "b"})
+                                      for i in range(count)])]
+            raise RuntimeError("stop")
+        async def xack(self, *a, **k):
+            events.append("ack")
+        async def xtrim(self, *a, **k):
+            pass
+        async def xlen(self, name):
+            return 0
+        def pipeline(self, transaction=True):
+            outer = self
+            class P:
+                def __init__(self):
+                    self.ops = []
+                def xadd(self, *a, **k):
+                    pass
+                def xack(self, *a, **k):
+                    self.ops.append(outer.xack(*a, **k))
+                def xtrim(self, *a, **k):
+                    pass
+                def xlen(self, name):
+                    self.ops.append(outer.xlen(name))
+                async def execute(self):
+                    return [await op for op in self.ops]
+            return P()
+
+    dummy = DummyRedis()
+    async def fake_rconn():
+        return dummy
+    monkeypatch.setattr(mod, "rconn", fake_rconn)
+    monkeypatch.setattr(mod, "start_http_server", lambda *a, **k: None)
+    with pytest.raises(RuntimeError):
+        await mod.main()
+    # nothing is read (left pending) before the model and its warm-up
+    # batch are done; then the read batch (identical texts → 1 distinct)
+    assert events == ["group", "load", ("classify", 1), "read",
+                      ("classify", 1), "ack"]
+    assert mod.first_ack is not None
+
+
+@pytest.mark.asyncio
+async def test_slow_classify_does_not_reclaim_own_entries(monkeypatch):
+    mod = load_module(monkeypatch)
+    from agents.recovery import Reclaimer
+    monkeypatch.setattr(mod, "classifier", lambda texts, *a, **k: [
+        {"labels": ["tech"], "scores": [1.0]} for _ in texts])
+    routed = []
+
+    class PelRedis:
+        """XAUTOCLAIM returns every unacked entry, our own included."""
+        def __init__(self):
+            self.pel, self.reads = {}, 0
+        async def xreadgroup(self, grp, consumer, streams, count=1, block=0):
+            self.reads += 1
+            if self.reads == 1:
+                entries = [("1-0", {"id": 1, "title": "t", "body": "b"})]
+                self.pel.update(entries)
+                return [(mod.SOURCE, entries)]
+            await asyncio.sleep(0.001)
+            return []
+        async def xautoclaim(self, stream, grp, consumer, min_idle,
+                             start_id="0-0", count=100):
+            return ["0-0", list(self.pel.items()), []]
+        async def xpending(self, stream, grp):
+            return {"pending": len(self.pel)}
+        async def xinfo_consumers(self, stream, grp):
+            return []
+        def pipeline(self, transaction=True):
+            outer = self
+            class P:
+                def xadd(self, stream, fields, **k):
+                    routed.append(json.loads(fields["data"])["id"])
+                def xack(self, stream, grp, *mids):
+                    for mid in mids:
+                        outer.pel.pop(mid, None)
+                def __getattr__(self, name):
+                    return lambda *a, **k: None
+                async def execute(self):
+                    return [0]
+            return P()
+
+    r = PelRedis()
+    ready = asyncio.Event()
+    batcher = mod.AdaptiveBatcher(size=1, target=0)
+    batches, results = asyncio.Queue(2), asyncio.Queue(2)
+    inflight = set()
+    stages = [
+        asyncio.create_task(mod.read_stage(
+            r, "cg", "me", batcher, batches,
+            Reclaimer(mod.SOURCE, "cg", "me", interval=0, min_idle_ms=0),
+            inflight)),
+        # the model is still loading: batches wait in the queues
+        asyncio.create_task(mod.classify_stage(
+            r, None, batcher, mod.ClassifyCache(size=0), batches, results,
+            ready.wait())),
+        asyncio.create_task(mod.write_stage(r, "cg", results, inflight)),
+    ]
+    await asyncio.sleep(0.05)                  # many sweeps meanwhile
+    ready.set()
+    while not routed:
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.05)
+    for t in stages:
+        t.cancel()
+    await asyncio.gather(*stages, return_exceptions=True)
+    assert routed == [1]
+    assert not inflight and not r.pel
+
+
+@pytest.mark.asyncio
+async def test_route_single_round_trip(monkeypatch):
+    monkeypatch.setenv("ENRICH_TRIM_INTERVAL", "0")
+    mod = load_module(monkeypatch)
+    calls = []
+
+    class PipeOnly:
+        """No direct commands: anything outside the pipeline would fail."""
+        def pipeline(self, transaction=True):
+            class P:
+                def __getattr__(self, name):
+                    return lambda *a, **k: calls.append((name, a, k))
+                async def execute(self):
+                    calls.append(("execute",))
+                    return [None] * (len(calls) - 1) + [42]
+            return P()
+
+    docs = [{"id": 1, "title": "t", "body": "b", "topic": "tech"}]
+    await mod.route(PipeOnly(), "cg", ["1-0"], docs)
+    assert [c[0] for c in calls] == ["xadd", "xack", "xtrim", "xlen", "execute"]
+    assert calls[0][2] == {"maxlen": mod.TOPIC_MAXLEN, "approximate": True}
+    assert calls[2][2] == {"maxlen": mod.NEWS_RAW_MAXLEN, "approximate": True}
+
+    trims = []
+
+    class TrimOnly:
+        async def xtrim(self, name, maxlen=None, approximate=True):
+            trims.append((name, maxlen, approximate))
+            if len(trims) == 2:
+                raise RuntimeError("stop")
+
+    with pytest.raises(RuntimeError):
+        await mod.trim_stage(TrimOnly())
+    assert trims[0] == (mod.SOURCE, mod.NEWS_RAW_MAXLEN, False)
+
+
+@pytest.mark.asyncio
+async def test_round_trips_count_cache_and_route_calls(monkeypatch):
+    monkeypatch.setenv("ENRICH_EXECUTOR", "inline")
+    mod = load_module(monkeypatch)
+    monkeypatch.setattr(mod, "classifier", lambda texts, *a, **k: [
+        {"labels": ["tech"], "scores": [1.0]} for _ in texts])
+    observed = []
+    monkeypatch.setattr(mod, "ROUND_TRIPS", types.SimpleNamespace(
+        observe=observed.append))
+    executes = []
+
+    class KV:
+        async def mget(self, keys):
+            return [None] * len(keys)
+        def pipeline(self, transaction=True):
+            class P:
+                def __getattr__(self, name):
+                    return lambda *a, **k: None
+                async def execute(self):
+                    executes.append(1)
+                    return [0]
+            return P()
+
+    kv = KV()
+    cache = mod.ClassifyCache(size=10, ttl=60, shared=True)
+    batches, results = asyncio.Queue(), asyncio.Queue()
+    stages = [asyncio.create_task(mod.classify_stage(
+                  kv, None, mod.AdaptiveBatcher(target=0), cache,
+                  batches, results)),
+              asyncio.create_task(mod.write_stage(kv, "cg", results))]
+    doc = {"id": 1, "title": "t", "body": "b"}
+    await batches.put((["1-0"], [dict(doc)]))
+    await batches.put((["2-0"], [dict(doc)]))   # local LRU hit: no MGET/SET
+    while len(observed) < 2:
+        await asyncio.sleep(0)
+    for t in stages:
+        t.cancel()
+    # MGET + SET pipeline + route, then the route alone
+    assert observed == [3, 1]
+    assert len(executes) == 3
+
+
+@pytest.mark.asyncio
+async def test_retried_route_counts_messages_once(monkeypatch):
+    mod = load_module(monkeypatch)
+    counted = {"in": 0, "out": 0}
+
+    class Count:
+        def __init__(self, key):
+            self.key = key
+        def labels(self, **k):
+            return self
+        def inc(self, n=1):
+            counted[self.key] += n
+
+    monkeypatch.setattr(mod, "IN_MSG", Count("in"))
+    monkeypatch.setattr(mod, "OUT_MSG", Count("out"))
+    fails = [mod.RedisConnError("reset")]
+
+    class Flaky:
+        def pipeline(self, transaction=True):
+            class P:
+                def __getattr__(self, name):
+                    return lambda *a, **k: None
+                async def execute(self):
+                    if fails:
+                        raise fails.pop()
+                    return [0]
+            return P()
+
+    r = Flaky()
+
+    async def reconnect():
+        return r
+    monkeypatch.setattr(mod, "rconn", reconnect)
+    results = asyncio.Queue()
+    writer = asyncio.create_task(mod.write_stage(r, "cg", results))
+    await results.put((["1-0"], [{"id": 1, "title": "t", "topic": "tech"}],
+                       0))
+    await asyncio.wait_for(results.join(), 1)
+    writer.cancel()
+    assert not fails and counted == {"in": 1, "out": 1}
+
+
+@pytest.mark.asyncio
+async def test_multi_label_routes_each_passing_topic(monkeypatch):
+    monkeypatch.setenv("ENRICH_MULTI_LABEL", "1")
+    monkeypatch.setenv("ENRICH_THRESHOLD", "0.5")
+    mod = load_module(monkeypatch)
+    seen = {}
+
+    def multi_classifier(texts, labels, multi_label=False, **k):
+        seen["multi_label"] = multi_label
+        return [{"labels": ["climate", "finance", "sports"],
+                 "scores": [0.91, 0.64, 0.02]} for _ in texts]
+
+    monkeypatch.setattr(mod, "classifier", multi_classifier)
+    docs = mod.classify([{"id": 7, "title": "Climate finance", "body": "b"}])
+    assert seen["multi_label"] is True        # one call scores all labels
+
+    added = []
+
+    class P:
+        def xadd(self, stream, fields, **k):
+            added.append((stream, json.loads(fields["data"])))
+        def __getattr__(self, name):
+            return lambda *a, **k: None
+        async def execute(self):
+            return [0]
+
+    class R:
+        def pipeline(self, transaction=True):
+            return P()
+
+    await mod.route(R(), "cg", ["1-0"], docs)
+    assert [s for s, _ in added] == ["topic:climate", "topic:finance"]
+    payload = added[0][1]
+    assert payload["tags"] == ["climate", "finance"]
+    assert payload["scores"] == {"climate": 0.91, "finance": 0.64}
+    assert payload["topic"] == "climate"
+
+    low = {"topic": "sports", "scores": {"sports": 0.3, "health": 0.2}}
+    assert mod.doc_topics(low) == ["sports"]  # nothing passes: best topic
@@ -1,4 +1,4 @@
-import sys, importlib
+import sys, importlib, types
 import asyncio
 import pytest
 
@@ -24,7 +24,7 @@ class DummyRedis:
     async def llen(self, key):
         return len(self.lists.get(key, []))
 
-async def fake_from_url(url, decode_responses=True):
+async def fake_from_url(url, **kwargs):
     return DummyRedis()
 
 def load_module(monkeypatch):
@@ -69,12 +69,16 @@ class TrimRedis(DummyRedis):
         pass
     async def xreadgroup(self, grp, consumer, streams, count=32, block=50):
         if self.read:
-            return []
+            raise RuntimeError("stop")
         self.read = True
         key = list(streams.keys())[0]
         return [(key, self.entries.copy())]
     async def zrange(self, *a):
         return []
+    async def sadd(self, *a):
+        pass
+    async def srem(self, *a):
+        pass
     async def evalsha(self, sha, numkeys, *args):
         max_len = int(args[-1])
         if len(self.entries) > max_len:
@@ -99,10 +103,277 @@ async def test_stream_trim(monkeypatch):
     monkeypatch.setattr(mod, "load_sha", fake_load_sha)
     monkeypatch.setattr(mod, "TOPICS", ["t"])
     monkeypatch.setattr(mod, "start_http_server", lambda *a, **k: None)
-    async def stop(*_a, **_k):
-        raise RuntimeError("stop")
-    monkeypatch.setattr(asyncio, "sleep", stop)
     with pytest.raises(RuntimeError):
         await mod.main()
     assert len(dummy.entries) < 200
 
+
+
+@pytest.mark.asyncio
+async def test_fanout_lua_chunks(monkeypatch):
+    monkeypatch.setenv("FANOUT_CHUNK", "2")
+    mod = load_module(monkeypatch)
+
+    class LuaRedis:
+        def __init__(self):
+            self.calls = []
+        async def evalsha(self, sha, numkeys, *args):
+            keys, argv = args[:numkeys], args[numkeys:]
+            self.calls.append((keys, argv))
+            return [[1, 1] for _ in range(numkeys // 4)]
+
+    dummy = LuaRedis()
+    batch = [("a", '{"id": "a"}'), ("b", '{"id": "b"}')]
+    await mod.fanout_lua(dummy, "sha", ["0", "1", "2", "3", "4"], batch)
+
+    assert len(dummy.calls) == 3
+    keys, argv = dummy.calls[0]
+    assert keys == ("feed_seen:0", "feed_seen:0", "feed:0", "feed_stream:0",
+                    "feed_seen:1", "feed_seen:1", "feed:1", "feed_stream:1")
+    assert argv == (mod.FEED_MAX_LEN, mod.SEEN_TTL, "data", "set",
+                    mod.BLOOM_CAPACITY, mod.BLOOM_ERROR, "a", '{"id": "a"}', "b", '{"id": "b"}')
+
+
+@pytest.mark.asyncio
+async def test_fanout_lua_cluster_slots(monkeypatch):
+    mod = load_module(monkeypatch)
+    from agents import cluster
+    monkeypatch.setattr(cluster, "CLUSTER", True)
+    monkeypatch.setattr(mod, "CLUSTER", True)
+
+    class LuaRedis:
+        def __init__(self):
+            self.calls = []
+        async def evalsha(self, sha, numkeys, *args):
+            self.calls.append(args[:numkeys])
+            return [[1, 1] for _ in range(numkeys // 4)]
+
+    dummy = LuaRedis()
+    uids = [str(i) for i in range(50)]
+    await mod.fanout_lua(dummy, "sha", uids, [("a", '{"id": "a"}')])
+
+    assert ("feed_seen:{0}", "feed_seen:{0}", "feed:{0}", "feed_stream:{0}") in (
+        keys[:4] for keys in dummy.calls)
+    delivered = []
+    for keys in dummy.calls:
+        assert len({cluster.key_slot(k) for k in keys}) == 1   # no CROSSSLOT
+        delivered += [k[len("feed:{"):-1] for k in keys[2::4]]
+    assert sorted(delivered, key=int) == uids
+
+
+class PipeRedis:
+    """Tiny in-memory stand-in for the commands fanout_pipeline queues."""
+    def __init__(self):
+        self.sets, self.lists, self.streams = {}, {}, {}
+        self.executed = 0
+    def pipeline(self, transaction=True):
+        outer = self
+        class P:
+            def __init__(self):
+                self.ops = []
+            def sadd(self, key, member):
+                self.ops.append(lambda: outer._sadd(key, member))
+            def expire(self, *a, **k):
+                self.ops.append(lambda: True)
+            def lpush(self, key, *values):
+                self.ops.append(lambda: outer._lpush(key, values))
+            def ltrim(self, key, start, end):
+                self.ops.append(lambda: outer.lists[key].__delitem__(slice(end + 1, None)))
+            def xadd(self, key, fields, maxlen=None, approximate=True):
+                self.ops.append(lambda: outer.streams.setdefault(key, []).append(fields))
+            def llen(self, key):
+                self.ops.append(lambda: len(outer.lists.get(key, [])))
+            async def execute(self):
+                outer.executed += 1
+                return [op() for op in self.ops]
+        return P()
+    def _sadd(self, key, member):
+        s = self.sets.setdefault(key, set())
+        if member in s:
+            return 0
+        s.add(member)
+        return 1
+    def _lpush(self, key, values):
+        lst = self.lists.setdefault(key, [])
+        for v in values:
+            lst.insert(0, v)
+        return len(lst)
+
+
+@pytest.mark.asyncio
+async def test_fanout_pipeline_dedup(monkeypatch):
+    monkeypatch.setenv("FANOUT_CHUNK", "2")
+    monkeypatch.setenv("FEED_LEN", "2")
+    mod = load_module(monkeypatch)
+    dummy = PipeRedis()
+    uids = ["0", "1", "2"]
+
+    await mod.fanout_pipeline(dummy, uids, [("a", "A"), ("b", "B"), ("c", "C")])
+    assert dummy.executed == 4          # 2 chunks × (dedup + writes)
+    assert dummy.lists["feed:2"] == ["C", "B"]
+
+    await mod.fanout_pipeline(dummy, uids, [("a", "A")])
+    assert dummy.executed == 6          # dedup only, nothing to write
+    assert len(dummy.streams["feed_stream:0"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_hot_topic_not_blocked_by_cold(monkeypatch):
+    mod = load_module(monkeypatch)
+
+    class TwoTopics(TrimRedis):
+        def __init__(self):
+            super().__init__()
+            self.acked = []
+        async def xreadgroup(self, grp, consumer, streams, count=32, block=50):
+            key = list(streams.keys())[0]
+            if key == "topic:cold":
+                await asyncio.Event().wait()     # never produces anything
+            return await super().xreadgroup(grp, consumer, streams, count, block)
+        async def xack(self, stream, grp, *mids):
+            self.acked.append((stream, len(mids)))
+
+    dummy = TwoTopics()
+    async def fake_rconn():
+        return dummy
+    monkeypatch.setattr(mod, "rconn", fake_rconn)
+    monkeypatch.setattr(mod, "TOPICS", ["cold", "hot"])
+    monkeypatch.setattr(mod, "start_http_server", lambda *a, **k: None)
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(mod.main(), timeout=1)
+    assert dummy.acked == [("topic:hot", 200)]
+
+
+@pytest.mark.asyncio
+async def test_ref_mode_stores_doc_once(monkeypatch):
+    monkeypatch.setenv("FANOUT_PAYLOAD", "ref")
+    mod = load_module(monkeypatch)
+
+    class DocRedis(PipeRedis):
+        def __init__(self):
+            super().__init__()
+            self.docs = {}
+        def pipeline(self, transaction=True):
+            p = super().pipeline(transaction)
+            p.set = lambda key, val, ex=None: p.ops.append(
+                lambda: self.docs.__setitem__(key, (val, ex)))
+            return p
+
+    dummy = DocRedis()
+    batch = await mod.store_docs(dummy, [("a", '{"id": "a", "body": "long"}')])
+    assert batch == [("a", "a")]
+    assert dummy.docs == {"doc:a": ('{"id": "a", "body": "long"}', mod.DOC_TTL)}
+
+    await mod.fanout_pipeline(dummy, ["0", "1"], batch)
+    assert dummy.lists["feed:1"] == ["a"]
+    assert dummy.streams["feed_stream:1"] == [{"ref": "a"}]
+
+
+@pytest.mark.parametrize("name", ["set", "bloom", "bloom_daily"])
+def test_dedup_backend_env(monkeypatch, name):
+    monkeypatch.setenv("FANOUT_DEDUP", name)
+    mod = load_module(monkeypatch)
+    assert mod.DEDUP.name == name
+
+
+def test_daily_bloom_rotation(monkeypatch):
+    monkeypatch.setenv("FANOUT_DEDUP", "bloom_daily")
+    mod = load_module(monkeypatch)
+    monkeypatch.setattr(mod.time, "time", lambda: 3 * mod.SEEN_TTL + 5)
+    assert mod.DEDUP.keys("7") == ("feed_bloom:7:3", "feed_bloom:7:2")
+
+    class P:
+        def __init__(self):
+            self.cmds = []
+        def execute_command(self, *args):
+            self.cmds.append(args[0])
+    pipe = P()
+    mod.DEDUP.queue(pipe, mod.DEDUP.keys("7"), "doc")
+    assert pipe.cmds == ["BF.EXISTS", "BF.INSERT"]
+    assert mod.DEDUP.is_new([0, [1]])
+    assert not mod.DEDUP.is_new([1, [1]])      # seen yesterday
+    assert not mod.DEDUP.is_new([0, [0]])      # seen today
+
+
+@pytest.mark.asyncio
+async def test_pull_mode_skips_push(monkeypatch):
+    monkeypatch.setenv("FANOUT_PULL_THRESHOLD", "2")
+    mod = load_module(monkeypatch)
+
+    class Crowded(TrimRedis):
+        def __init__(self):
+            super().__init__()
+            self.pull = set()
+        async def zrange(self, *a):
+            return ["0", "1", "2"]
+        async def sadd(self, key, member):
+            self.pull.add(member)
+
+    dummy = Crowded()
+    async def fake_rconn():
+        return dummy
+    async def never(*a, **k):
+        raise AssertionError("pull-mode topic must not be pushed")
+    monkeypatch.setattr(mod, "rconn", fake_rconn)
+    monkeypatch.setattr(mod, "deliver", never)
+    def counted(**labels):
+        raise AssertionError("pull-mode topic counted as pushed")
+    monkeypatch.setattr(mod, "OUT", types.SimpleNamespace(labels=counted))
+    monkeypatch.setattr(mod, "TOPICS", ["t"])
+    monkeypatch.setattr(mod, "start_http_server", lambda *a, **k: None)
+    with pytest.raises(RuntimeError, match="stop"):
+        await mod.main()
+    assert dummy.pull == {"t"}
+
+
+@pytest.mark.asyncio
+async def test_reclaimed_entries_fanned_out(monkeypatch):
+    monkeypatch.setenv("RECLAIM_INTERVAL", "0")
+    monkeypatch.delitem(sys.modules, "agents.recovery")   # restored afterwards
+    mod = load_module(monkeypatch)
+
+    class Stale(TrimRedis):
+        def __init__(self):
+            super().__init__()
+            self.acked = []
+        async def zrange(self, *a):
+            return ["0"]
+        async def xautoclaim(self, stream, grp, consumer, min_idle, **k):
+            if self.acked:
+                return ["0-0", [], []]
+            return ["0-0", [("9-0", {"data": '{"id": "old"}'})], []]
+        async def xpending(self, *a):
+            return {"pending": 0}
+        async def xinfo_consumers(self, *a):
+            return []
+        async def xack(self, stream, grp, *mids):
+            self.acked += mids
+
+    dummy = Stale()
+    delivered = []
+    async def fake_rconn():
+        return dummy
+    async def fake_deliver(r, sha, uids, batch):
+        delivered.append(batch)
+    monkeypatch.setattr(mod, "rconn", fake_rconn)
+    monkeypatch.setattr(mod, "deliver", fake_deliver)
+    monkeypatch.setattr(mod, "TOPICS", ["t"])
+    monkeypatch.setattr(mod, "start_http_server", lambda *a, **k: None)
+    with pytest.raises(RuntimeError, match="stop"):
+        await mod.main()
+    assert delivered[0] == [("old", '{"id": "old"}')]   # before new reads
+    assert dummy.acked[0] == "9-0"
+
+
+def test_topic_shards(monkeypatch):
+    monkeypatch.setenv("TOPIC_SHARDS", "4")
+    sys.modules.pop("agents.sharding", None)
+    shards = importlib.import_module("agents.sharding")
+    streams = shards.topic_streams("politics")
+    assert streams == [f"topic:politics:{n}" for n in range(4)]
+    placed = {shards.topic_stream("politics", i) for i in range(100)}
+    assert placed == set(streams)                     # every shard used
+    assert shards.topic_stream("politics", 42) == shards.topic_stream("politics", "42")
+    assert shards.shard_maxlen(10_000) == 2_500
+    assert shards.topic_streams("politics", shards=1) == ["topic:politics"]
+    sys.modules.pop("agents.sharding", None)
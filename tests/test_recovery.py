@@ -0,0 +1,74 @@
+import importlib
+import sys
+
+import pytest
+
+
+def load_module(monkeypatch, **env):
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    sys.modules.pop("agents.recovery", None)
+    return importlib.import_module("agents.recovery")
+
+
+class PelRedis:
+    """Stream group whose PEL holds entries of a dead consumer."""
+
+    def __init__(self, pel):
+        self.pel = pel                      # [(mid, fields or None)]
+        self.acked, self.deleted = [], []
+        self.consumers = [
+            {"name": "enrich-1", "pending": 0, "idle": 900_000},   # dead
+            {"name": "enrich-2", "pending": 3, "idle": 900_000},   # still owns work
+            {"name": "enrich-3", "pending": 0, "idle": 10},        # alive
+            {"name": "me", "pending": 0, "idle": 900_000},
+        ]
+
+    async def xautoclaim(self, stream, grp, consumer, min_idle, start_id="0-0",
+                         count=100):
+        start = 0 if start_id == "0-0" else int(start_id)
+        part = self.pel[start:start + count]
+        nxt = start + count
+        return [str(nxt) if nxt < len(self.pel) else "0-0", part, []]
+
+    async def xack(self, stream, grp, *mids):
+        self.acked += mids
+
+    async def xpending(self, stream, grp):
+        return {"pending": len(self.pel) - len(self.acked)}
+
+    async def xinfo_consumers(self, stream, grp):
+        return self.consumers
+
+    async def xgroup_delconsumer(self, stream, grp, name):
+        self.deleted.append(name)
+
+
+@pytest.mark.asyncio
+async def test_reclaim_sweeps_in_batches(monkeypatch):
+    mod = load_module(monkeypatch)
+    pel = [("1-0", {"id": "a"}), ("2-0", None), ("3-0", {"id": "c"})]
+    r = PelRedis(pel)
+    rec = mod.Reclaimer("news_raw", "cg", "me", interval=0, count=2,
+                        dead_ms=600_000)
+
+    first = await rec.claim(r)
+    assert first == [("1-0", {"id": "a"})]
+    assert r.acked == ["2-0"]               # trimmed entry just acked
+    assert r.deleted == []                  # sweep not finished yet
+
+    second = await rec.claim(r)
+    assert second == [("3-0", {"id": "c"})]
+    assert rec.cursor == "0-0"
+    assert r.deleted == ["enrich-1"]        # idle and owns nothing
+
+
+@pytest.mark.asyncio
+async def test_reclaim_waits_for_interval(monkeypatch):
+    mod = load_module(monkeypatch)
+    r = PelRedis([("1-0", {"id": "a"})])
+    rec = mod.Reclaimer("news_raw", "cg", "me", interval=60)
+    assert await rec.claim(r) == []         # first sweep one interval in
+    rec.next_at = 0
+    assert await rec.claim(r) == [("1-0", {"id": "a"})]
+    assert await rec.claim(r) == []         # next sweep scheduled again
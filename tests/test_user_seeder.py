@@ -70,7 +70,7 @@ def load_mod(monkeypatch):
 @pytest.mark.asyncio
 async def test_rconn(monkeypatch):
     mod = load_mod(monkeypatch)
-    async def from_url(url, decode_responses=True):
+    async def from_url(url, **kwargs):
         return DummyRedis()
     monkeypatch.setattr(mod.redis, "from_url", from_url)
     conn = await mod.rconn()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Reply‑parsing cost of the shared client: RESP2/RESP3 × python/hiredis.
+
+    python tools/bench_client.py --entries 100 --rounds 200
+
+Writes one bench stream of ``--entries`` feed‑sized entries, then reads it
+back ``--rounds`` times per client variant – XRANGE (what the gateway and
+fan‑out read) and XREADGROUP‑shaped XREAD replies – with the pool settings
+of ``agents/client.py`` and only the protocol and parser swapped.  Prints
+replies/s and entries/s; the hiredis rows are skipped when the ``hiredis``
+package is missing.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import redis.asyncio as redis  # noqa: E402
+from redis._parsers import (  # noqa: E402
+    _AsyncHiredisParser, _AsyncRESP2Parser, _AsyncRESP3Parser,
+)
+
+from agents import client  # noqa: E402
+
+STREAM = "bench:client"
+VARIANTS = {
+    "resp2/python": (2, _AsyncRESP2Parser),
+    "resp3/python": (3, _AsyncRESP3Parser),
+    "resp2/hiredis": (2, _AsyncHiredisParser),
+    "resp3/hiredis": (3, _AsyncHiredisParser),
+}
+
+
+async def fill(r, entries: int) -> None:
+    await r.delete(STREAM)
+    doc = {"id": "x", "title": "Headline " * 4, "body": "Lorem ipsum " * 60,
+           "tags": ["technology"], "topic": "technology"}
+    pipe = r.pipeline(transaction=False)
+    for i in range(entries):
+        pipe.xadd(STREAM, {"data": json.dumps({**doc, "id": str(i)})})
+    await pipe.execute()
+
+
+async def run(url: str, protocol: int, parser, entries: int, rounds: int) -> float:
+    opts = {**client.pool_options(), "protocol": protocol, "parser_class": parser}
+    r = redis.from_url(url, **opts)
+    try:
+        tic = time.perf_counter()
+        for _ in range(rounds):
+            got = await r.xrange(STREAM, count=entries)
+            msgs = client.stream_replies(
+                await r.xread({STREAM: "0-0"}, count=entries))
+            assert len(got) == len(msgs[0][1]) == entries
+        return time.perf_counter() - tic
+    finally:
+        await r.aclose()
+
+
+async def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default=client.cluster.VALKEY_URL)
+    ap.add_argument("--entries", type=int, default=100)
+    ap.add_argument("--rounds", type=int, default=200)
+    ap.add_argument("variants", nargs="*", default=list(VARIANTS))
+    args = ap.parse_args(argv)
+
+    r = await client.connect(args.url)
+    await fill(r, args.entries)
+    print(f"{'client':<15}{'seconds':>9}{'replies/s':>11}{'entries/s':>12}")
+    try:
+        for name in args.variants:
+            protocol, parser = VARIANTS[name]
+            if parser is _AsyncHiredisParser and not client.HIREDIS_AVAILABLE:
+                print(f"{name:<15}{'(hiredis not installed)':>32}")
+                continue
+            secs = await run(args.url, protocol, parser, args.entries, args.rounds)
+            replies = 2 * args.rounds
+            print(f"{name:<15}{secs:>9.2f}{replies / secs:>11,.0f}"
+                  f"{replies * args.entries / secs:>12,.0f}")
+    finally:
+        await r.delete(STREAM)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Compare fan‑out dedup backends for memory and false positives.
+
+Fills every backend of ``agents/fanout.py`` (``set``, ``bloom``,
+``bloom_daily``) with the same number of article ids per user, reports
+the ``used_memory_dataset`` growth, then probes unseen ids to measure how
+often an unseen article would be wrongly skipped:
+
+    python tools/bench_dedup.py --users 50000 --articles 200
+
+Bench users are named ``bench-<n>``; their dedup keys are removed before
+and after each backend runs.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from agents import fanout  # noqa: E402
+
+
+async def cleanup(r, dedup, uids: list[str]) -> None:
+    for chunk in fanout.chunks(uids, 1000):
+        await r.unlink(*{k for uid in chunk for k in dedup.keys(uid)})
+
+
+async def fill(r, dedup, uids: list[str], ids: list[str], chunk: int) -> list[bool]:
+    """Insert *ids* for every user; return the per‑check ``is_new`` flags."""
+    w = dedup.width
+    flags: list[bool] = []
+    for part in fanout.chunks(uids, chunk):
+        pipe = r.pipeline(transaction=False)
+        for uid in part:
+            keys = dedup.keys(uid)
+            for doc_id in ids:
+                dedup.queue(pipe, keys, doc_id)
+            pipe.expire(keys[0], dedup.ttl, nx=True)
+        res = await pipe.execute()
+        step = len(ids) * w + 1
+        for i in range(len(part)):
+            base = i * step
+            flags += [dedup.is_new(res[base + j * w:base + (j + 1) * w])
+                      for j in range(len(ids))]
+    return flags
+
+
+async def dataset_bytes(r) -> int:
+    return int((await r.info("memory"))["used_memory_dataset"])
+
+
+async def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("backends", nargs="*", default=list(fanout.DEDUP_BACKENDS))
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--articles", type=int, default=200,
+                    help="ids inserted per user (≈ articles per day)")
+    ap.add_argument("--probes", type=int, default=1_000,
+                    help="unseen ids checked per user")
+    ap.add_argument("--chunk", type=int, default=100)
+    args = ap.parse_args(argv)
+
+    r = await fanout.rconn()
+    uids = [f"bench-{i}" for i in range(args.users)]
+    seen = [f"bench-doc-{i}" for i in range(args.articles)]
+    unseen = [f"bench-new-{i}" for i in range(args.probes)]
+
+    print(f"{'backend':<13}{'MB':>9}{'B/user':>9}{'fill s':>9}{'FP rate':>10}")
+    for name in args.backends:
+        dedup = fanout.DEDUP_BACKENDS[name]()
+        await cleanup(r, dedup, uids)
+        before = await dataset_bytes(r)
+        tic = time.perf_counter()
+        await fill(r, dedup, uids, seen, args.chunk)
+        secs = time.perf_counter() - tic
+        grown = await dataset_bytes(r) - before
+
+        flags = await fill(r, dedup, uids, unseen, args.chunk)
+        fp = flags.count(False) / len(flags)
+        print(f"{name:<13}{grown / 2**20:>9.1f}{grown / args.users:>9.0f}"
+              f"{secs:>9.2f}{fp:>10.5f}")
+        await cleanup(r, dedup, uids)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
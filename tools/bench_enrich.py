@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""Benchmarks for the enrich service.
+
+    python tools/bench_enrich.py pipeline --docs 2000 --model-ms 2 inline thread
+    python tools/bench_enrich.py backends --csv data/news_sample.csv --sample 500
+    python tools/bench_enrich.py batching --csv data/news_sample.csv 0 1024 2048
+    python tools/bench_enrich.py quantized --min-agreement 0.9
+    python tools/bench_enrich.py route --batches 500 legacy pipelined
+
+``pipeline`` runs ``agents/enrich.py::main`` once per ``ENRICH_EXECUTOR``
+value over the same pre‑filled source stream and reports docs/sec against
+a live Valkey.  The stub model sleeps ``--model-ms`` per document
+(releasing the GIL like torch does), so the numbers isolate how well I/O
+overlaps inference.  Bench streams are ``bench:news_raw`` and
+``topic:bench``; both are deleted afterwards.
+
+``backends`` loads the real models and classifies the same CSV sample with
+every ``ENRICH_BACKEND``, printing CPU docs/sec and accuracy.  Accuracy is
+measured against the CSV's ``topic`` column when it has one, otherwise as
+agreement with the ``zeroshot`` pipeline.
+
+``batching`` feeds the replay CSV through ``classify`` in read batches of
+``--batch`` documents, once per ``ENRICH_TOKEN_BUDGET`` value (``0`` is
+the fixed‑count baseline), and prints tokens/sec and docs/sec.
+
+``quantized`` is the parity check for ``ENRICH_BACKEND=int8``: it
+classifies a fixed set of headlines (plus ``--csv`` rows if given) with the
+fp32 pipeline and the int8 model, prints docs/sec for each, top‑1
+agreement and the largest score drift, and exits non‑zero when agreement
+falls below ``--min-agreement``.
+
+``route`` times the per‑batch write path against a live Valkey: the old
+sequence (topic pipeline, XACK, exact XTRIM, XLEN) versus the current
+single pipeline, printing batches/sec and measured round trips per batch.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import csv
+import json
+import os
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+SOURCE = "bench:news_raw"
+SINK = "topic:bench"
+
+
+class StubModel:
+    """Zero‑shot pipeline stand‑in: fixed cost per document, one label."""
+
+    def __init__(self, ms_per_doc: float) -> None:
+        self.ms = ms_per_doc
+
+    def __call__(self, texts, labels, **kw):
+        time.sleep(self.ms * len(texts) / 1000)
+        return [{"labels": ["bench"], "scores": [1.0]} for _ in texts]
+
+
+def load_enrich(model_ms: float):
+    import transformers
+    transformers.pipeline = lambda *a, **k: StubModel(model_ms)
+    from agents import enrich
+    enrich.classifier = StubModel(model_ms)
+    enrich.start_http_server = lambda *a, **k: None
+    enrich.SOURCE = SOURCE
+    return enrich
+
+
+async def fill(r, docs: int) -> None:
+    await r.delete(SOURCE, SINK)
+    pipe = r.pipeline(transaction=False)
+    for i in range(docs):
+        pipe.xadd(SOURCE, {"id": i, "title": f"Article {i}",
+                           "text": "Lorem ipsum dolor sit amet. " * 20})
+    await pipe.execute()
+
+
+async def drain(enrich, r, docs: int) -> float:
+    """Run enrich until every document reached the sink; return seconds."""
+    tic = time.perf_counter()
+    task = asyncio.create_task(enrich.main())
+    try:
+        while await r.xlen(SINK) < docs:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.05)
+        return time.perf_counter() - tic
+    finally:
+        task.cancel()
+        await asyncio.wait([task], timeout=5)
+
+
+# ─── pipeline: executor modes on the same source stream ─────────────
+async def bench_pipeline(args) -> None:
+    enrich = load_enrich(args.model_ms)
+    r = await enrich.rconn()
+    print(f"{'executor':<10}{'seconds':>10}{'docs/s':>10}")
+    for mode in args.executors:
+        enrich.EXECUTOR = mode
+        await fill(r, args.docs)
+        secs = await drain(enrich, r, args.docs)
+        print(f"{mode:<10}{secs:>10.2f}{args.docs / secs:>10.0f}")
+    await r.delete(SOURCE, SINK)
+
+
+# ─── route: per-batch write path, legacy vs pipelined ───────────────
+class CountingRedis:
+    """Proxy counting round trips: awaited commands and pipeline executes."""
+
+    def __init__(self, r) -> None:
+        self.r, self.trips = r, 0
+
+    def pipeline(self, *a, **k):
+        pipe = self.r.pipeline(*a, **k)
+        execute = pipe.execute
+
+        async def counted(*ea, **ek):
+            self.trips += 1
+            return await execute(*ea, **ek)
+
+        pipe.execute = counted
+        return pipe
+
+    def __getattr__(self, name):
+        cmd = getattr(self.r, name)
+
+        async def counted(*a, **k):
+            self.trips += 1
+            return await cmd(*a, **k)
+
+        return counted
+
+
+async def legacy_route(enrich, r, grp, mids, docs) -> None:
+    pipe = r.pipeline()
+    for d in docs:
+        stream = f"topic:{d['topic']}"
+        pipe.xadd(stream, {"data": json.dumps(d)})
+        pipe.xtrim(stream, maxlen=enrich.TOPIC_MAXLEN)
+    await pipe.execute()
+    await r.xack(enrich.SOURCE, grp, *mids)
+    await r.xtrim(enrich.SOURCE, maxlen=enrich.NEWS_RAW_MAXLEN, approximate=False)
+    await r.xlen(enrich.SOURCE)
+
+
+async def bench_route(args) -> None:
+    enrich = load_enrich(args.model_ms)
+    base = await enrich.rconn()
+    grp = "cg_bench"
+    routes = {
+        "legacy": lambda r, m, d: legacy_route(enrich, r, grp, m, d),
+        "pipelined": lambda r, m, d: enrich.route(r, grp, m, d),
+    }
+    print(f"{'path':<11}{'batches/s':>11}{'trips/batch':>13}")
+    for name in args.paths:
+        await fill(base, args.batches * args.batch)
+        await base.xgroup_create(SOURCE, grp, id="0")
+        msgs = await base.xreadgroup(grp, "bench", {SOURCE: ">"},
+                                     count=args.batches * args.batch)
+        entries = enrich.stream_replies(msgs)[0][1]
+        r = CountingRedis(base)
+        tic = time.perf_counter()
+        for i in range(0, len(entries), args.batch):
+            part = entries[i:i + args.batch]
+            docs = [{"id": f["id"], "title": f["title"], "body": f["text"],
+                     "topic": "bench"} for _, f in part]
+            await routes[name](r, [mid for mid, _ in part], docs)
+        secs = time.perf_counter() - tic
+        print(f"{name:<11}{args.batches / secs:>11.0f}"
+              f"{r.trips / args.batches:>13.1f}")
+    await base.delete(SOURCE, SINK)
+
+
+# ─── backends: accuracy and CPU throughput per classifier backend ───
+def read_sample(path: str, n: int) -> list[dict]:
+    with open(path, newline="", encoding="utf-8") as fp:
+        rows = [row for _, row in zip(range(n), csv.DictReader(fp))]
+    return [{"title": r["title"], "body": r.get("text", r.get("body", "")),
+             "topic": r.get("topic")} for r in rows]
+
+
+async def bench_backends(args) -> None:
+    os.environ.setdefault("ENRICH_USE_CUDA", "0")
+    from agents import enrich
+
+    backends = {"zeroshot": enrich.load_classifier("zeroshot"),
+                "embed": enrich.load_classifier("embed")}
+    rows = read_sample(args.csv, args.sample)
+    texts = [enrich.clf_text(d) for d in rows]
+
+    preds: dict[str, list[str]] = {}
+    speed: dict[str, float] = {}
+    for name, clf in backends.items():
+        clf(texts[:args.batch], enrich.TOPICS)          # warm‑up
+        tic = time.perf_counter()
+        out = []
+        for i in range(0, len(texts), args.batch):
+            out += clf(texts[i:i + args.batch], enrich.TOPICS, multi_label=False)
+        speed[name] = len(texts) / (time.perf_counter() - tic)
+        preds[name] = [o["labels"][0] for o in out]
+
+    labelled = all(d["topic"] for d in rows)
+    truth = [d["topic"] for d in rows] if labelled else preds["zeroshot"]
+    metric = "accuracy" if labelled else "vs zeroshot"
+    print(f"{'backend':<10}{'docs/s':>10}{metric:>13}")
+    for name in backends:
+        hits = sum(p == t for p, t in zip(preds[name], truth))
+        print(f"{name:<10}{speed[name]:>10.1f}{hits / len(rows):>13.3f}")
+
+
+# ─── quantized: int8 parity and speed vs fp32 ───────────────────────
+PARITY_SAMPLE = [
+    "Parliament passes budget after marathon overnight session",
+    "Central bank holds interest rates steady as inflation cools",
+    "Chipmaker unveils faster processor for AI data centres",
+    "Underdogs stun champions with late goal in cup final",
+    "New vaccine shows strong protection in late-stage trial",
+    "Record heatwave pushes glaciers to fastest melt in decades",
+    "Astronomers detect water vapour on a distant exoplanet",
+    "Schools extend tutoring programme to close learning gaps",
+    "Streaming series breaks viewing records in opening week",
+    "Stocks rally as bond yields fall and earnings beat forecasts",
+    "Election officials certify results after lengthy recount",
+    "Start-up raises funding to expand battery recycling plants",
+]
+
+
+def run_clf(clf, texts, labels, batch):
+    out = []
+    tic = time.perf_counter()
+    for i in range(0, len(texts), batch):
+        out += clf(texts[i:i + batch], labels, multi_label=False,
+                   batch_size=len(texts[i:i + batch]))
+    return out, len(texts) / (time.perf_counter() - tic)
+
+
+async def bench_quantized(args) -> None:
+    os.environ.setdefault("ENRICH_USE_CUDA", "0")
+    from agents import enrich
+
+    texts = list(PARITY_SAMPLE)
+    if args.csv:
+        texts += [enrich.clf_text(d) for d in read_sample(args.csv, args.sample)]
+    fp32 = enrich.load_classifier("zeroshot")
+    int8 = enrich.load_classifier("int8")
+    for clf in (fp32, int8):
+        clf(texts[:2], enrich.TOPICS)                    # warm‑up
+    ref, ref_speed = run_clf(fp32, texts, enrich.TOPICS, args.batch)
+    got, speed = run_clf(int8, texts, enrich.TOPICS, args.batch)
+
+    agree = sum(a["labels"][0] == b["labels"][0] for a, b in zip(ref, got))
+    drift = max(abs(a["scores"][0] - dict(zip(b["labels"], b["scores"]))[a["labels"][0]])
+                for a, b in zip(ref, got))
+    print(f"{'model':<8}{'docs/s':>10}")
+    print(f"{'fp32':<8}{ref_speed:>10.1f}\n{'int8':<8}{speed:>10.1f}")
+    print(f"top-1 agreement {agree}/{len(texts)}  max score drift {drift:.3f}")
+    if agree / len(texts) < args.min_agreement:
+        raise SystemExit(f"int8 agreement below {args.min_agreement}")
+
+
+# ─── batching: fixed count vs token budget ──────────────────────────
+async def bench_batching(args) -> None:
+    os.environ.setdefault("ENRICH_USE_CUDA", "0")
+    os.environ["ENRICH_BACKEND"] = args.backend
+    from agents import enrich
+
+    docs = read_sample(args.csv, args.sample)
+    tokens = sum(enrich.token_lengths([enrich.clf_text(d) for d in docs]))
+    enrich.classify([dict(d) for d in docs[:args.batch]])   # warm‑up
+
+    print(f"{'budget':<10}{'seconds':>10}{'tokens/s':>12}{'docs/s':>10}")
+    for budget in args.budgets:
+        enrich.TOKEN_BUDGET = budget
+        tic = time.perf_counter()
+        for i in range(0, len(docs), args.batch):
+            enrich.classify([dict(d) for d in docs[i:i + args.batch]])
+        secs = time.perf_counter() - tic
+        label = str(budget) if budget else "fixed"
+        print(f"{label:<10}{secs:>10.2f}{tokens / secs:>12.0f}"
+              f"{len(docs) / secs:>10.1f}")
+
+
+async def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--model-ms", type=float, default=2.0,
+                    help="stub inference cost per document")
+    sub = ap.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("pipeline", help="docs/sec per ENRICH_EXECUTOR")
+    p.add_argument("executors", nargs="*", default=["inline", "thread"])
+    p.add_argument("--docs", type=int, default=2000)
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("route", help="batches/sec and round trips per batch")
+    p.add_argument("paths", nargs="*", default=["legacy", "pipelined"])
+    p.add_argument("--batches", type=int, default=500)
+    p.add_argument("--batch", type=int, default=32)
+    p.set_defaults(func=bench_route)
+
+    p = sub.add_parser("backends", help="accuracy and docs/sec per ENRICH_BACKEND")
+    p.add_argument("--csv", default="data/news_sample.csv")
+    p.add_argument("--sample", type=int, default=500)
+    p.add_argument("--batch", type=int, default=32)
+    p.set_defaults(func=bench_backends)
+
+    p = sub.add_parser("batching", help="tokens/sec, fixed vs token-budget batches")
+    p.add_argument("budgets", nargs="*", type=int, default=[0, 1024, 2048])
+    p.add_argument("--csv", default="data/news_sample.csv")
+    p.add_argument("--sample", type=int, default=500)
+    p.add_argument("--batch", type=int, default=32)
+    p.add_argument("--backend", default="zeroshot", choices=["zeroshot", "embed"])
+    p.set_defaults(func=bench_batching)
+
+    p = sub.add_parser("quantized", help="int8 vs fp32 parity and docs/sec")
+    p.add_argument("--csv", help="extra rows to compare beyond the fixed sample")
+    p.add_argument("--sample", type=int, default=200)
+    p.add_argument("--batch", type=int, default=32)
+    p.add_argument("--min-agreement", type=float, default=0.9)
+    p.set_defaults(func=bench_quantized)
+
+    args = ap.parse_args(argv)
+    await args.func(args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Benchmark fan‑out delivery modes against a live Valkey.
+
+Runs each mode of ``agents/fanout.py`` on the same synthetic topic batch
+and subscriber count, then prints feed pushes per second:
+
+    python tools/bench_fanout.py --users 50000 --articles 64 loop lua pipeline
+
+``FANOUT_CHUNK`` / ``FANOUT_INFLIGHT`` apply to the batched modes as usual.
+``--payload full ref`` repeats every mode in both payload modes and the
+``dataset MB`` column reports the growth of ``used_memory_dataset`` (the
+value behind ``redis_memory_dataset_bytes``) caused by the run.
+
+Bench users are named ``bench-<n>`` and their keys are removed before
+every run, so the script is safe to point at the demo stack.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from agents import fanout  # noqa: E402
+
+
+async def cleanup(r, uids: list[str], batch) -> None:
+    for chunk in fanout.chunks(uids, 1000):
+        keys = []
+        for uid in chunk:
+            keys += [*fanout.DEDUP.keys(uid), fanout.user_key("feed", uid),
+                     fanout.user_key("feed_stream", uid)]
+        await r.unlink(*keys)
+    await r.unlink(*(f"doc:{doc_id}" for doc_id, _ in batch))
+
+
+async def dataset_bytes(r) -> int:
+    return int((await r.info("memory"))["used_memory_dataset"])
+
+
+async def run(r, mode: str, uids: list[str], batch) -> tuple[float, int]:
+    await cleanup(r, uids, batch)
+    before = await dataset_bytes(r)
+    tic = time.perf_counter()
+    if fanout.FANOUT_PAYLOAD == "ref":
+        batch = await fanout.store_docs(r, batch)
+    if mode == "lua":
+        sha = await fanout.load_fanout_sha(r)
+        await fanout.fanout_lua(r, sha, uids, batch)
+    elif mode == "pipeline":
+        await fanout.fanout_pipeline(r, uids, batch)
+    else:
+        await fanout.fanout_loop(r, uids, batch)
+    secs = time.perf_counter() - tic
+    return secs, await dataset_bytes(r) - before
+
+
+async def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("modes", nargs="*", default=["loop", "lua", "pipeline"])
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--articles", type=int, default=64)
+    ap.add_argument("--payload", nargs="+", default=["full"],
+                    choices=["full", "ref"])
+    args = ap.parse_args(argv)
+
+    r = await fanout.rconn()
+    uids = [f"bench-{i}" for i in range(args.users)]
+    batch = [
+        (f"bench-doc-{i}", json.dumps({"id": f"bench-doc-{i}",
+                                       "title": f"Article {i}",
+                                       "body": "Lorem ipsum " * 40}))
+        for i in range(args.articles)
+    ]
+    pushes = args.users * args.articles
+
+    print(f"{'mode':<10}{'payload':<9}{'seconds':>10}{'pushes/s':>14}"
+          f"{'dataset MB':>12}")
+    for payload in args.payload:
+        fanout.FANOUT_PAYLOAD = payload
+        for mode in args.modes:
+            secs, grown = await run(r, mode, uids, batch)
+            print(f"{mode:<10}{payload:<9}{secs:>10.2f}{pushes / secs:>14,.0f}"
+                  f"{grown / 2**20:>12.1f}")
+    await cleanup(r, uids, batch)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""Benchmarks for the API gateway read paths against a live Valkey.
+
+    python tools/bench_gateway.py pull --topics 3 --entries 1000
+    python tools/bench_gateway.py hub --sockets 5000 --rounds 20
+    python tools/bench_gateway.py frames --sockets 100 --articles 2000
+    python tools/bench_gateway.py connects --connects 5000 --concurrency 50
+    python tools/bench_gateway.py resume --clients 1000 --missed 5
+
+``pull`` times the feed backlog a ``/ws/feed/{uid}`` socket assembles on
+connect – per‑user stream only vs. the same stream merged with pull‑mode
+topic streams – and prints p50 / p99 latency.
+
+``hub`` tails ``--sockets`` feed streams (one per simulated socket) the
+old way – a blocking ``XREAD COUNT 1`` per socket – and through the
+shared :class:`StreamHub`, then appends ``--rounds`` entries to every
+stream and prints the Valkey connections the process opened and p50 / p99 delivery
+latency (XADD → entry handed to the socket).
+
+``frames`` starts the gateway under uvicorn, connects ``--sockets``
+websockets to one topic with and without ``?batch=1`` and appends
+``--articles`` entries at ``--rate`` per second (``0`` = all at once).
+It prints frames/s received and the gateway's CPU time (``/proc``, so
+Linux only) per delivered article.
+
+``connects`` starts the gateway with ``GATEWAY_BACKLOG_CACHE=0`` and
+with the default ring, keeps one socket on a ``--entries`` topic (so the
+hub tails it) and opens ``--connects`` more sockets, ``--concurrency``
+at a time, each closing once its ``?batch=1`` backlog frame arrived.  It
+prints connects/s, p50 / p99 time to the backlog, gateway CPU per
+connect and the backlogs the ring served (from ``/metrics``).
+
+``resume`` opens ``--clients`` event streams (``/sse/topic``) that take
+the ``--backlog`` and disconnect, appends ``--missed`` articles, then
+reconnects every client at once – first as a fresh connect, then with
+the ``Last-Event-ID`` each one was given – and prints the bytes the
+storm transferred and how long it took.
+
+Bench keys are prefixed with ``bench`` and removed afterwards.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import redis.asyncio as redis  # noqa: E402
+
+from api_gateway.api_gateway import main as gw  # noqa: E402
+
+UID = "bench-user"
+
+
+def pct(samples: list[float], q: float) -> float:
+    return statistics.quantiles(samples, n=100)[int(q) - 1] * 1e3
+
+
+async def timed(fn, iterations: int, concurrency: int) -> list[float]:
+    samples: list[float] = []
+
+    async def worker(n):
+        for _ in range(n):
+            tic = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - tic)
+
+    await asyncio.gather(*(worker(iterations // concurrency)
+                           for _ in range(concurrency)))
+    return samples
+
+
+# ─── pull: feed backlog with / without pull-mode topics ─────────────
+async def bench_pull(r, args) -> None:
+    topics = [f"bench-{i}" for i in range(args.topics)]
+    feed = f"feed_stream:{UID}"
+    pipe = r.pipeline(transaction=False)
+    pipe.json().set(f"user:{UID}", "$", {"interests": topics})
+    for i in range(args.entries):
+        doc = json.dumps({"id": f"bench-{i}", "title": f"Article {i}",
+                          "body": "Lorem ipsum " * 40})
+        pipe.xadd(feed, {"data": doc})
+        pipe.xadd(f"topic:{topics[i % len(topics)]}", {"data": doc})
+    await pipe.execute()
+
+    async def backlog():
+        streams = [feed] + await gw.pull_streams(r, UID)
+        entries, _ = await gw.merged_backlog(r, streams, args.backlog)
+        seen = {} if len(streams) > 1 else None
+        return list(gw.decode(await gw.hydrate(r, entries), seen))
+
+    try:
+        print(f"{'feed':<10}{'streams':>8}{'p50 ms':>10}{'p99 ms':>10}")
+        for label, pulled in (("push", []), ("pull", topics)):
+            await r.delete(gw.PULL_TOPICS_KEY)
+            if pulled:
+                await r.sadd(gw.PULL_TOPICS_KEY, *pulled)
+            samples = await timed(backlog, args.iterations, args.concurrency)
+            print(f"{label:<10}{1 + len(pulled):>8}"
+                  f"{pct(samples, 50):>10.2f}{pct(samples, 99):>10.2f}")
+    finally:
+        await r.srem(gw.PULL_TOPICS_KEY, *topics)
+        await r.delete(feed, f"user:{UID}", *(f"topic:{t}" for t in topics))
+
+
+# ─── hub: per-socket XREAD vs. one shared hub ───────────────────────
+async def socket_tail(r, stream: str, deliver) -> None:
+    """The gateway's tail before the hub: one blocking XREAD per socket."""
+    last = "0-0"
+    while True:
+        msgs = await r.xread({stream: last}, block=0, count=1)
+        for _stream, entries in msgs or ():
+            last = entries[-1][0]
+            deliver(entries)
+
+
+async def hub_tail(hub, stream: str, deliver) -> None:
+    async with hub.watch({stream: "0-0"}) as batches:
+        async for entries in batches:
+            deliver(entries)
+
+
+async def bench_hub(r, args) -> None:
+    streams = [f"bench:hub:{i}" for i in range(args.sockets)]
+    await r.delete(*streams)
+    print(f"{'tail':<8}{'sockets':>8}{'valkey conns':>14}"
+          f"{'p50 ms':>10}{'p99 ms':>10}")
+    for label in ("socket", "hub"):
+        lat: list[float] = []
+        expected = args.sockets * args.rounds
+
+        def deliver(entries):
+            now = time.time()
+            lat.extend(now - float(f["ts"]) for _id, f in entries)
+
+        # the tails get their own client so its pool counts their sockets
+        tr = redis.from_url(args.url, decode_responses=True,
+                            max_connections=args.sockets + 8)
+        hub = gw.StreamHub(tr) if label == "hub" else None
+        tasks = [asyncio.create_task(hub_tail(hub, s, deliver) if hub
+                                     else socket_tail(tr, s, deliver))
+                 for s in streams]
+        await asyncio.sleep(1 + args.sockets / 5_000)     # settle
+        pool = tr.connection_pool
+        conns = len(pool._in_use_connections) + len(pool._available_connections)
+        try:
+            for _ in range(args.rounds):
+                pipe = r.pipeline(transaction=False)
+                for s in random.sample(streams, len(streams)):
+                    pipe.xadd(s, {"ts": repr(time.time())})
+                await pipe.execute()
+                await asyncio.sleep(args.interval)
+            while len(lat) < expected:
+                await asyncio.sleep(0.05)
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if hub:
+                await hub.close()
+            await tr.aclose()
+            await r.delete(*streams)
+        print(f"{label:<8}{args.sockets:>8}{conns:>14}"
+              f"{pct(lat, 50):>10.2f}{pct(lat, 99):>10.2f}")
+
+
+# ─── frames: one frame per article vs. batched frames ────────────────
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as fp:
+        fields = fp.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def start_gateway(args, **env) -> subprocess.Popen:
+    env = {**os.environ, "VALKEY_URL": args.url, "TOPIC_SHARDS": "1", **env}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_gateway.api_gateway.main:app",
+         "--port", str(args.port), "--log-level", "warning",
+         "--timeout-graceful-shutdown", "1"],
+        cwd=ROOT, env=env)
+    for _ in range(100):
+        try:
+            _r, w = await asyncio.open_connection("127.0.0.1", args.port)
+            w.close()
+            return proc
+        except OSError:
+            await asyncio.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("gateway did not start")
+
+
+async def bench_frames(r, args) -> None:
+    import websockets
+
+    stream = "topic:bench-frames"
+    doc = {"title": "Headline " * 4, "body": "Lorem ipsum " * 60,
+           "topic": "bench-frames"}
+    print(f"{'mode':<8}{'sockets':>8}{'frames':>9}{'frames/s':>10}"
+          f"{'articles/s':>12}{'cpu µs/article':>16}")
+    for batch in (0, 1):
+        await r.delete(stream)
+        proc = await start_gateway(args)
+        url = (f"ws://127.0.0.1:{args.port}/ws/topic/bench-frames"
+               f"?batch={batch}")
+        try:
+            socks = [await websockets.connect(url, max_size=None)
+                     for _ in range(args.sockets)]
+            frames = 0
+
+            async def receive(ws):
+                nonlocal frames
+                got = 0
+                while got < args.articles:
+                    data = json.loads(await ws.recv())
+                    got += len(data) if isinstance(data, list) else 1
+                    frames += 1
+
+            await asyncio.sleep(1)                    # sockets join the hub
+            cpu0, tic = cpu_seconds(proc.pid), time.perf_counter()
+            readers = [asyncio.create_task(receive(ws)) for ws in socks]
+            step = max(1, args.rate // 20) if args.rate else args.articles
+            for i in range(0, args.articles, step):
+                pipe = r.pipeline(transaction=False)
+                for n in range(i, min(i + step, args.articles)):
+                    pipe.xadd(stream, {"data": json.dumps({**doc, "id": str(n)})})
+                await pipe.execute()
+                if args.rate:
+                    await asyncio.sleep(step / args.rate)
+            await asyncio.gather(*readers)
+            secs = time.perf_counter() - tic
+            cpu = cpu_seconds(proc.pid) - cpu0
+            for ws in socks:
+                await ws.close()
+        finally:
+            proc.terminate()
+            proc.wait()
+            await r.delete(stream)
+        delivered = args.articles * args.sockets
+        print(f"{'batch' if batch else 'single':<8}{args.sockets:>8}"
+              f"{frames:>9}{frames / secs:>10,.0f}{delivered / secs:>12,.0f}"
+              f"{cpu / delivered * 1e6:>16.1f}")
+
+
+# ─── connects: topic backlogs from Valkey vs. the hub's ring ──────────
+async def ring_hits(port: int) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+    body = (await reader.read()).decode()
+    writer.close()
+    return sum(int(float(line.rpartition(" ")[2])) for line in body.splitlines()
+               if line.startswith('gateway_backlog_cache_total{result="hit"}'))
+
+
+async def bench_connects(r, args) -> None:
+    import websockets
+
+    stream = "topic:bench-connects"
+    doc = {"title": "Headline " * 4, "body": "Lorem ipsum " * 60,
+           "topic": "bench-connects"}
+    pipe = r.pipeline(transaction=False)
+    for n in range(args.entries):
+        pipe.xadd(stream, {"data": json.dumps({**doc, "id": str(n)})})
+    await pipe.execute()
+    url = (f"ws://127.0.0.1:{args.port}/ws/topic/bench-connects"
+           f"?backlog={args.backlog}&batch=1")
+    print(f"{'ring':<6}{'connects':>9}{'conn/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'cpu µs/conn':>13}{'ring hits':>11}")
+    try:
+        for cache in ("0", str(max(args.backlog, 200))):
+            proc = await start_gateway(args, GATEWAY_BACKLOG_CACHE=cache)
+            try:
+                anchor = await websockets.connect(url, max_size=None)
+                await anchor.recv()
+                await asyncio.sleep(0.5)              # the hub tails the topic
+
+                async def connect():
+                    async with websockets.connect(url, max_size=None) as ws:
+                        assert len(json.loads(await ws.recv())) == min(
+                            args.backlog, args.entries)
+
+                cpu0, tic = cpu_seconds(proc.pid), time.perf_counter()
+                samples = await timed(connect, args.connects, args.concurrency)
+                secs = time.perf_counter() - tic
+                cpu = cpu_seconds(proc.pid) - cpu0
+                hits = await ring_hits(args.port)
+                await anchor.close()
+            finally:
+                proc.terminate()
+                proc.wait()
+            print(f"{'off' if cache == '0' else 'on':<6}{args.connects:>9}"
+                  f"{args.connects / secs:>9,.0f}{pct(samples, 50):>9.1f}"
+                  f"{pct(samples, 99):>9.1f}"
+                  f"{cpu / args.connects * 1e6:>13,.0f}{hits:>11}")
+    finally:
+        await r.delete(stream)
+
+
+# ─── resume: SSE reconnect storm with and without Last-Event-ID ───────
+async def sse_session(port: int, path: str, last_id: str | None,
+                      want: int) -> tuple[int, str | None]:
+    """Read *want* events from *path*; bytes received and the last event id."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = f"GET {path} HTTP/1.1\r\nHost: bench\r\n"
+    if last_id:
+        head += f"Last-Event-ID: {last_id}\r\n"
+    writer.write((head + "\r\n").encode())
+    received, events, buf = 0, 0, b""
+    while events < want:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        received += len(chunk)
+        *lines, buf = (buf + chunk).split(b"\n")
+        for line in lines:
+            if line.startswith(b"data: "):
+                events += 1
+            elif line.startswith(b"id: "):
+                last_id = line[4:].decode().strip()
+    writer.close()
+    return received, last_id
+
+
+async def bench_resume(r, args) -> None:
+    stream = "topic:bench-resume"
+    doc = {"title": "Headline " * 4, "body": "Lorem ipsum " * 60,
+           "topic": "bench-resume"}
+
+    async def append(count):
+        pipe = r.pipeline(transaction=False)
+        for n in range(count):
+            pipe.xadd(stream, {"data": json.dumps({**doc, "id": str(n)})})
+        await pipe.execute()
+
+    path = f"/sse/topic/bench-resume?backlog={args.backlog}"
+    await r.delete(stream)
+    await append(args.backlog)
+    proc = await start_gateway(args)
+    try:
+        ids = []
+        for i in range(0, args.clients, 100):         # ids for the storm
+            ids += [last for _received, last in await asyncio.gather(*(
+                sse_session(args.port, path, None, args.backlog)
+                for _ in range(min(100, args.clients - i))))]
+        await asyncio.sleep(0.5)                      # the clients are gone
+        await append(args.missed)
+        print(f"{'reconnect':<12}{'clients':>8}{'bytes':>14}"
+              f"{'bytes/client':>14}{'seconds':>9}")
+        for mode, want in (("backlog", args.backlog), ("resume", args.missed)):
+            tic = time.perf_counter()
+            storm = await asyncio.gather(*(
+                sse_session(args.port, path,
+                            last if mode == "resume" else None, want)
+                for last in ids))
+            secs = time.perf_counter() - tic
+            total = sum(received for received, _last in storm)
+            print(f"{mode:<12}{args.clients:>8}{total:>14,}"
+                  f"{total // args.clients:>14,}{secs:>9.2f}")
+        if missing := ids.count(None):
+            print(f"({missing} clients got no event id and reloaded the "
+                  "backlog on resume)")
+    finally:
+        proc.terminate()
+        proc.wait()
+        await r.delete(stream)
+
+
+async def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default="redis://localhost:6379")
+    sub = ap.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("pull", help="feed backlog p50/p99, push vs pull")
+    p.add_argument("--topics", type=int, default=3)
+    p.add_argument("--entries", type=int, default=1000)
+    p.add_argument("--backlog", type=int, default=100)
+    p.add_argument("--iterations", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.set_defaults(func=bench_pull)
+
+    p = sub.add_parser("hub", help="valkey connections and delivery latency")
+    p.add_argument("--sockets", type=int, default=5_000)
+    p.add_argument("--rounds", type=int, default=20)
+    p.add_argument("--interval", type=float, default=0.2,
+                   help="seconds between rounds")
+    p.set_defaults(func=bench_hub)
+
+    p = sub.add_parser("frames", help="frames/s and gateway CPU per article")
+    p.add_argument("--sockets", type=int, default=100)
+    p.add_argument("--articles", type=int, default=2_000)
+    p.add_argument("--rate", type=int, default=500,
+                   help="articles appended per second (0 = burst)")
+    p.add_argument("--port", type=int, default=8765)
+    p.set_defaults(func=bench_frames)
+
+    p = sub.add_parser("connects", help="topic connects/s with and without "
+                                        "the backlog ring")
+    p.add_argument("--entries", type=int, default=1_000)
+    p.add_argument("--backlog", type=int, default=50)
+    p.add_argument("--connects", type=int, default=5_000)
+    p.add_argument("--concurrency", type=int, default=50)
+    p.add_argument("--port", type=int, default=8765)
+    p.set_defaults(func=bench_connects)
+
+    p = sub.add_parser("resume", help="bytes of an SSE reconnect storm with "
+                                      "and without Last-Event-ID")
+    p.add_argument("--clients", type=int, default=1_000)
+    p.add_argument("--backlog", type=int, default=50)
+    p.add_argument("--missed", type=int, default=5)
+    p.add_argument("--port", type=int, default=8765)
+    p.set_defaults(func=bench_resume)
+
+    args = ap.parse_args(argv)
+    r = await redis.from_url(args.url, decode_responses=True)
+    await args.func(r, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
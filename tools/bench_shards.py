@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Fan‑out throughput at 1, 2, 4 … replicas over a sharded topic.
+
+    python tools/bench_shards.py --shards 4 --users 2000 --articles 2000 1 2 4
+
+Fills the shards of topic ``bench`` (``topic:bench:<n>``) with articles
+placed exactly as enrich places them, subscribes ``--users`` bench users,
+then for each replica count starts that many fan‑out processes.  Each one
+runs ``agents/fanout.py::consume_topic`` per shard inside the shared
+``cg_bench`` groups, just like scaled ``fanout`` containers.  The clock
+runs from rewinding the groups until every shard is delivered and acked;
+the script prints articles/s and feed pushes/s.  ``FANOUT_MODE`` and the
+other fan‑out variables apply to the replicas as usual.
+
+Bench users are ``bench-<n>``; their feed keys and the bench topic are
+removed before every run and afterwards.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+TOPIC, GROUP = "bench", "cg_bench"
+
+
+def replica(n: int, streams: list[str], ready) -> None:
+    """One fan‑out process: a consumer task per shard."""
+    from agents import fanout
+
+    async def run():
+        r = await fanout.rconn()
+        ready.set()
+        await asyncio.gather(*(fanout.consume_topic(r, TOPIC, f"bench-{n}", s)
+                               for s in streams))
+
+    asyncio.run(run())
+
+
+async def cleanup(r, uids: list[str]) -> None:
+    from agents import fanout
+    for chunk in fanout.chunks(uids, 1000):
+        await r.unlink(*(k for uid in chunk
+                         for k in (*fanout.DEDUP.keys(uid),
+                                   fanout.user_key("feed", uid),
+                                   fanout.user_key("feed_stream", uid))))
+
+
+async def fill(r, streams: list[str], uids: list[str], articles: int) -> None:
+    from agents.sharding import topic_stream
+    await r.unlink(*streams, f"user:topic:{TOPIC}")
+    pipe = r.pipeline(transaction=False)
+    for uid in uids:
+        pipe.zadd(f"user:topic:{TOPIC}", {uid: 0})
+    for i in range(articles):
+        doc = {"id": f"bench-doc-{i}", "title": f"Article {i}",
+               "body": "Lorem ipsum " * 40, "topic": TOPIC}
+        pipe.xadd(topic_stream(TOPIC, doc["id"]), {"data": json.dumps(doc)})
+    await pipe.execute()
+
+
+async def drained(r, streams: list[str]) -> bool:
+    for s in streams:
+        last = await r.xrevrange(s, count=1)
+        group = next(g for g in await r.xinfo_groups(s) if g["name"] == GROUP)
+        if group["pending"] or (last and group["last-delivered-id"] != last[0][0]):
+            return False
+    return True
+
+
+async def run(r, streams, uids, replicas: int) -> float:
+    await cleanup(r, uids)
+    for s in streams:
+        await r.xgroup_create(s, GROUP, id="$")    # nothing to deliver yet
+    ctx = multiprocessing.get_context("spawn")
+    ready = [ctx.Event() for _ in range(replicas)]
+    procs = [ctx.Process(target=replica, args=(n, streams, ev), daemon=True)
+             for n, ev in enumerate(ready)]
+    for p in procs:
+        p.start()
+    try:
+        while not all(ev.is_set() for ev in ready):
+            await asyncio.sleep(0.05)
+        tic = time.perf_counter()
+        for s in streams:
+            await r.xgroup_setid(s, GROUP, id="0")
+        while not await drained(r, streams):
+            await asyncio.sleep(0.02)
+        return time.perf_counter() - tic
+    finally:
+        for p in procs:
+            p.terminate()
+            p.join()
+        for s in streams:
+            await r.xgroup_destroy(s, GROUP)
+
+
+async def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("replicas", nargs="*", type=int, default=[1, 2, 4])
+    ap.add_argument("--shards", type=int, default=4)
+    ap.add_argument("--users", type=int, default=2_000)
+    ap.add_argument("--articles", type=int, default=2_000)
+    args = ap.parse_args(argv)
+
+    # replicas inherit the environment; short blocks so a rewound group
+    # is noticed right away
+    os.environ["TOPIC_SHARDS"] = str(args.shards)
+    os.environ.setdefault("FANOUT_BLOCK_MS", "50")
+    from agents import fanout
+    from agents.sharding import topic_streams
+
+    r = await fanout.rconn()
+    streams = topic_streams(TOPIC, args.shards)
+    uids = [f"bench-{i}" for i in range(args.users)]
+    await fill(r, streams, uids, args.articles)
+
+    print(f"{'replicas':<10}{'shards':>7}{'seconds':>10}{'articles/s':>12}"
+          f"{'pushes/s':>14}")
+    try:
+        for n in args.replicas:
+            secs = await run(r, streams, uids, n)
+            print(f"{n:<10}{args.shards:>7}{secs:>10.2f}"
+                  f"{args.articles / secs:>12,.0f}"
+                  f"{args.articles * args.users / secs:>14,.0f}")
+    finally:
+        await cleanup(r, uids)
+        await r.unlink(*streams, f"user:topic:{TOPIC}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
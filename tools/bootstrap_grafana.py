@@ -84,12 +84,39 @@ add("Dataset memory MB",
 add("CPU util (%)", ["rate(process_cpu_seconds_total[1m])*100"])
 add("Mem frag ratio", ["redis_mem_fragmentation_ratio"])
 
+add("Fan‑out idle s/s per topic",
+    ["rate(fanout_read_idle_seconds_total[1m])"], stack=True)
+add("Fan‑out chunk p99 ms", [
+    "histogram_quantile(0.99, rate(fanout_chunk_seconds_bucket[2m]))*1e3"
+], unit="ms")
+add("Enrich batch size", ["enrich_batch_size"], unit="none")
+add("Enrich queue wait p99 ms", [
+    "histogram_quantile(0.99, rate(enrich_queue_wait_seconds_bucket[2m]))*1e3"
+], unit="ms")
+add("Enrich cache hit ratio", [
+    "sum(rate(enrich_cache_hits_total[5m])) / (sum(rate(enrich_cache_hits_total[5m]))"
+    " + sum(rate(enrich_cache_misses_total[5m])))"
+], unit="percentunit")
+add("Enrich replicas ready / first ack s",
+    ["sum(enrich_model_ready)", "max(enrich_first_ack_seconds)"], unit="none")
+add("Pending entries per group",
+    ["max by (group) (stream_pending_entries)"], unit="none", stack=True)
+add("Reclaimed entries /s",
+    ["sum by (group) (rate(stream_reclaimed_total[5m]))"])
+add("Gateway send p99 ms / queue p99", [
+    "histogram_quantile(0.99, rate(gateway_send_seconds_bucket[2m]))*1e3",
+    "histogram_quantile(0.99, rate(gateway_send_queue_depth_bucket[2m]))",
+], unit="none")
+add("Gateway dropped entries /s",
+    ["sum by (policy) (rate(gateway_dropped_entries_total[1m]))",
+     "rate(gateway_slow_disconnects_total[1m])"], stack=True)
+
 # ─── write dashboard & provider files ────────────────────────────────
 dashboard = {
     "uid": "agent-overview",
     "title": "Agent Overview",
     "schemaVersion": 38,
-    "version": 11,               # bump → Grafana auto‑reload
+    "version": 17,               # bump → Grafana auto‑reload
     "refresh": "5s",
     "panels": panels,
 }
@@ -19,11 +19,11 @@ afterEach(() => {
 });
 
 test('topic filter resets when uid changes', async () => {
-  setupMockServer('/ws/feed/0?backlog=100', [
+  setupMockServer('/ws/feed/0?backlog=100&batch=1', [
     { title: 'p0', topic: 'foo' },
     { title: 'p1', topic: 'bar' }
   ]);
-  setupMockServer('/ws/feed/1?backlog=100', [{ title: 'x', topic: 'baz' }]);
+  setupMockServer('/ws/feed/1?backlog=100&batch=1', [{ title: 'x', topic: 'baz' }]);
 
   const { rerender } = render(<App initialUid="0" />);
   await waitFor(() => expect(document.querySelectorAll('details')).toHaveLength(1));
@@ -8,7 +8,7 @@ vi.mock('../hooks/useUser', () => ({
 }));
 
 it('filters feed when clicking interest chip', async () => {
-  setupMockServer('/ws/feed/0?backlog=100', [
+  setupMockServer('/ws/feed/0?backlog=100&batch=1', [
     { title: 't1', topic: 'tech' },
     { title: 's1', topic: 'sports' }
   ]);
@@ -30,7 +30,8 @@ export interface FeedState {
 export function useFeed(uid: string): FeedState {
   const { messages: socketMsgs, ready } = useSocket(
     `/ws/feed/${uid}?backlog=100`,
-    normalize
+    normalize,
+    { batch: true }
   );
   const [messages, setMessages] = useState<Message[]>([]);
   const [pending, setPending] = useState<Message[]>([]);
@@ -10,7 +10,16 @@ export interface SocketState<T> {
   ready: boolean;
 }
 
-export function useSocket<T>(path: string, normalize: (raw: any) => T): SocketState<T> {
+export interface SocketOptions {
+  /** Ask for `?batch=1` frames: JSON arrays of articles per message. */
+  batch?: boolean;
+}
+
+export function useSocket<T>(
+  path: string,
+  normalize: (raw: any) => T,
+  { batch = false }: SocketOptions = {}
+): SocketState<T> {
   const [messages, setMessages] = useState<T[]>([]);
   const [ready, setReady] = useState(false);
 
@@ -20,8 +29,10 @@ export function useSocket<T>(path: string, normalize: (raw: any) => T): SocketSt
     let ws: WebSocket | null = null;
     let retry = 0;
 
+    const url = batch ? `${path}${path.includes('?') ? '&' : '?'}batch=1` : path;
+
     const connect = () => {
-      ws = new WebSocket(`${socketBase()}${path}`);
+      ws = new WebSocket(`${socketBase()}${url}`);
       ws.onopen = () => {
         if (!isMounted) return;
         retry = 0;
@@ -29,7 +40,11 @@ export function useSocket<T>(path: string, normalize: (raw: any) => T): SocketSt
       };
       ws.onmessage = (ev) => {
         if (!isMounted) return;
-        setMessages((m) => [...m, normalize(JSON.parse(ev.data))]);
+        const data = JSON.parse(ev.data);
+        const items = (batch && Array.isArray(data) ? data : [data])
+          // {"notice": "missed", count} – the gateway dropped items for us
+          .filter((item: any) => !item?.notice);
+        setMessages((m) => [...m, ...items.map(normalize)]);
       };
       const handleClose = () => {
         if (!isMounted) return;
@@ -51,7 +66,7 @@ export function useSocket<T>(path: string, normalize: (raw: any) => T): SocketSt
       setReady(false);
       ws?.close();
     };
-  }, [path]);
+  }, [path, batch]);
 
   return { messages, ready };
 }
@@ -22,7 +22,8 @@ const normalize = (raw: any): Message => ({
 export function useTopic(slug: string): TopicState {
   const { messages: socketMsgs, ready } = useSocket(
     `/ws/topic/${slug}?backlog=50`,
-    normalize
+    normalize,
+    { batch: true }
   );
   const [messages, setMessages] = useState<Message[]>([]);
   const [pending, setPending] = useState<Message[]>([]);
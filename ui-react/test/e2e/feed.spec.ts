@@ -1,8 +1,8 @@
 import { test, expect } from '@playwright/test';
 import { setupMockServer } from '../setupTests';
 
-const FEED1_PATH = '/ws/feed/1?backlog=100';
-const FEED2_PATH = '/ws/feed/2?backlog=100';
+const FEED1_PATH = '/ws/feed/1?backlog=100&batch=1';
+const FEED2_PATH = '/ws/feed/2?backlog=100&batch=1';
 
 let server: { send: (m: string) => void; stop: () => void };
 let server2: { send: (m: string) => void; stop: () => void } | null = null;
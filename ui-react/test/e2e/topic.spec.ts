@@ -1,7 +1,7 @@
 import { test, expect } from '@playwright/test';
 import { setupMockServer } from '../setupTests';
 
-const PATH = '/ws/topic/news?backlog=50';
+const PATH = '/ws/topic/news?backlog=50&batch=1';
 
 let server: { send: (m: string) => void; stop: () => void };
 